@@ -0,0 +1,273 @@
+import sys
+import threading
+import time
+import Queue
+
+from _LoreDeadline import Deadline, RpcCancelled, RpcTimeout
+from _LoreDeadline import deadline_scope
+from _LoreStats import STATS
+
+
+class RpcFuture(object):
+  """
+  The pending result of a call that was submitted to an RpcPool.
+
+  The call itself runs on one of the pool's worker threads.  Completion
+  callbacks are never run on a worker; they are run by RpcPool.poll() on
+  whichever thread polls the pool (for the plugin, the Tk main loop).
+
+  A call that is cancelled, or outlives its timeout, finishes at once with
+  RpcCancelled or RpcTimeout; whatever the worker returns later is dropped.
+  """
+
+  def __init__(self, method, args=(), kwargs=None, timeout=None):
+    self.method = method
+    self.args = args
+    self.kwargs = kwargs or {}
+    self.deadline = Deadline(timeout, name=method)
+    # run under STATS.profile on the worker; set by RpcPool.profile
+    self.profiled = False
+    self._done = threading.Event()
+    self._lock = threading.Lock()
+    self._delivered = False
+    self._result = None
+    self._exc_info = None
+    self._callbacks = []
+    # where a finished future goes to be delivered; set by RpcPool.submit
+    self._queue = None
+
+
+  def done(self):
+    return self._done.is_set()
+
+
+  def result(self, timeout=None):
+    """
+    Block until the call has finished and return its result.  If the call
+    raised, the exception is re-raised here with its original traceback.
+    """
+    if(not self._done.wait(timeout)):
+      raise RuntimeError("%s did not finish within %s seconds" %
+                         (self.method, timeout))
+    if(self._exc_info is not None):
+      raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+    return self._result
+
+
+  def exception(self, timeout=None):
+    try:
+      self.result(timeout)
+    except Exception as E:
+      return E
+    return None
+
+
+  def add_done_callback(self, fn):
+    """
+    Call fn(future) once the call has finished.  If the result has already
+    been delivered by RpcPool.poll(), fn is called immediately.
+    """
+    if(self._delivered):
+      fn(self)
+    else:
+      self._callbacks.append(fn)
+
+
+  def cancel(self):
+    """
+    Stop the call.  It is delivered by the next poll() as RpcCancelled,
+    and its worker is interrupted if it is waiting on the server.
+
+    :returns: False if the call had already finished
+    """
+    self.deadline.cancel()
+    return self._finish_early(RpcCancelled("%s was cancelled" % (self.method)))
+
+
+  def _finish_early(self, error):
+    try:
+      raise error
+    except Exception:
+      if(not self._set_exc_info(sys.exc_info())):
+        return False
+    if(self._queue is not None):
+      self._queue.put(self)
+    return True
+
+
+  def _set_result(self, result):
+    "Finish with a result; False if the call had already finished"
+    with self._lock:
+      if(self._done.is_set()):
+        return False
+      self._result = result
+      self._done.set()
+      return True
+
+
+  def _set_exc_info(self, exc_info):
+    with self._lock:
+      if(self._done.is_set()):
+        return False
+      self._exc_info = exc_info
+      self._done.set()
+      return True
+
+
+  def _deliver(self):
+    "Run every callback; the first one to raise is re-raised at the end"
+    self._delivered = True
+    (callbacks, self._callbacks) = (self._callbacks, [])
+    exc_info = None
+    for fn in callbacks:
+      try:
+        fn(self)
+      except Exception:
+        if(exc_info is None):
+          exc_info = sys.exc_info()
+    if(exc_info is not None):
+      raise exc_info[0], exc_info[1], exc_info[2]
+
+
+class RpcPool(object):
+  """
+  A small pool of worker threads that run JSON-RPC calls off the GUI thread.
+
+  jsonrpclib proxies are not safe to share between threads, so each worker
+  lazily builds its own proxy with proxy_factory().  Finished calls are put
+  on a result queue that the owner drains with poll(), e.g. from Tk's after().
+
+  :param proxy_factory: a callable returning a new jsonrpclib.Server proxy
+  :param num_workers: the number of worker threads
+  :param category: the STATS category the calls are timed under
+  :param timeouts: method name -> the seconds a call of it may take, from
+                   submit() until its result is delivered
+  """
+
+  def __init__(self, proxy_factory, num_workers=4, category="rpc",
+               timeouts=None):
+    self.proxy_factory = proxy_factory
+    self.category = category
+    self.timeouts = timeouts or {}
+    self._jobs = Queue.Queue()
+    self._results = Queue.Queue()
+    self._local = threading.local()
+    self._lock = threading.Lock()
+    self._pending = 0
+    # the calls with a timeout that have not finished
+    self._timed = set()
+    self._workers = []
+    for i in range(num_workers):
+      worker = threading.Thread(target=self._work, name="LoreRpc-%d" % (i))
+      worker.daemon = True
+      worker.start()
+      self._workers.append(worker)
+
+
+  @property
+  def pending(self):
+    "The number of submitted calls whose results have not been delivered yet"
+    return self._pending
+
+
+  def submit(self, method, *args, **kwargs):
+    """
+    Queue a call of the named rpc method and return its RpcFuture.
+    """
+    return self._submit(method, args, kwargs, False)
+
+
+  def profile(self, method, *args, **kwargs):
+    """
+    Like submit(), but the call is run under STATS.profile on its worker,
+    whose time a profile of the submitting thread would miss.
+    """
+    return self._submit(method, args, kwargs, True)
+
+
+  def _submit(self, method, args, kwargs, profiled):
+    future = RpcFuture(method, args, kwargs, self.timeouts.get(method))
+    future.profiled = profiled
+    future._queue = self._results
+    with self._lock:
+      self._pending += 1
+      if(future.deadline.expires is not None):
+        self._timed.add(future)
+    self._jobs.put(future)
+    return future
+
+
+  def poll(self, max_results=None):
+    """
+    Deliver finished calls to their callbacks on the calling thread.
+
+    :param max_results: stop after this many results; None drains the queue
+    :returns: the number of results delivered
+    """
+    if(self._timed):
+      self._expire()
+    delivered = 0
+    while(max_results is None or delivered < max_results):
+      try:
+        future = self._results.get_nowait()
+      except Queue.Empty:
+        break
+      with self._lock:
+        self._pending -= 1
+      delivered += 1
+      future._deliver()
+    return delivered
+
+
+  def _expire(self):
+    "Finish the calls that have outlived their timeouts"
+    with self._lock:
+      expired = [ f for f in self._timed
+                  if f.done() or f.deadline.expired() ]
+      self._timed.difference_update(expired)
+    for future in expired:
+      if(future.done()):
+        continue
+      # also frees the worker if it is waiting on the server
+      future.deadline.cancel()
+      future._finish_early(RpcTimeout(
+        "%s did not finish within %s seconds" % (
+          future.method, self.timeouts[future.method])))
+
+
+  def shutdown(self):
+    "Let the workers exit once the calls already queued have run"
+    for worker in self._workers:
+      self._jobs.put(None)
+    self._workers = []
+
+
+  def _proxy(self):
+    proxy = getattr(self._local, "proxy", None)
+    if(proxy is None):
+      proxy = self._local.proxy = self.proxy_factory()
+    return proxy
+
+
+  def _work(self):
+    while(True):
+      future = self._jobs.get()
+      if(future is None):
+        break
+      if(future.done()):
+        # cancelled or timed out while it was queued, and already delivered
+        continue
+      start = time.time()
+      try:
+        method = getattr(self._proxy(), future.method)
+        with deadline_scope(future.deadline):
+          if(future.profiled):
+            result = STATS.profile(method, *future.args, **future.kwargs)
+          else:
+            result = method(*future.args, **future.kwargs)
+          finished = future._set_result(result)
+      except Exception:
+        finished = future._set_exc_info(sys.exc_info())
+      STATS.record(self.category, future.method, time.time() - start)
+      if(finished):
+        self._results.put(future)
@@ -0,0 +1,295 @@
+"""
+Run many searches without the GUI: every target of a job file is searched
+under every parameter set, with a bounded number of requests in flight.
+
+A job file is JSON:
+
+  {
+    "name": "kinase-screen",
+    "targets": [
+      {"pdbname": "1ABC", "residue_txt": "A:GLY12 A:SER13 A:LYS14"},
+      {"pymol_selection": "pocket"}
+    ],
+    "parameter_sets": [
+      {"rmslimit": 1.5},
+      {"rmslimit": 2.0, "searchabletablename": "subset_001"}
+    ]
+  }
+
+Each parameter set overrides the search parameters define_target returned
+for the target.  Targets are defined, and jobs searched, several to a
+JSON-RPC batch.  Finished jobs are checkpointed in the batch_jobs table,
+so running the same file again only runs the jobs that did not finish:
+
+  python -m LoreClient._LoreBatch jobs.json --concurrency 8
+"""
+import argparse
+import collections
+import hashlib
+import json
+import sys
+import time
+
+from _LoreAsync import RpcPool
+from _LoreCache import target_cache_key
+from _LoreCore import DEFAULT_URL, Client, SearchParams
+
+
+def search_params(user_fields, overrides):
+  "The SearchParams of a target with a parameter set applied"
+  return SearchParams.decode(user_fields, **overrides)
+
+
+def load_jobs(fname):
+  with open(fname) as f:
+    jobs = json.load(f)
+  for key in ("name", "targets", "parameter_sets"):
+    if(key not in jobs):
+      raise ValueError("%s has no %s" % (fname, key))
+  return jobs
+
+
+class _Job(object):
+
+  def __init__(self, batch, target_key, params):
+    self.batch = batch
+    self.target_key = target_key
+    self.params = params
+    self.key = hashlib.sha1(json.dumps(
+      [batch, target_key, params], sort_keys=True)).hexdigest()
+    self.started = None
+
+
+class BatchRunner(object):
+  """
+  Runs the jobs of a job file on a pool of workers calling a Client.
+  The bookkeeping runs on the calling thread.
+
+  :param client: the Client the searches and checkpoints go through
+  :param concurrency: the most requests in flight at once
+  :param batch_size: the most server calls sent in one request
+  :param report_every: seconds between progress lines
+  :param log: called with each progress line
+  """
+  _poll_s = 0.005
+
+  def __init__(self, client, concurrency=4, batch_size=10, report_every=10.0,
+               log=None):
+    self.client = client
+    # a stuck call fails its jobs rather than holding up the batch
+    self.rpc = RpcPool(lambda: client, num_workers=concurrency,
+                       category="core", timeouts=client.pool_timeouts())
+    self.concurrency = concurrency
+    self.batch_size = batch_size
+    self.report_every = report_every
+    self.log = log or (lambda line: sys.stdout.write(line + "\n"))
+    self.counts = collections.Counter()
+
+
+  def close(self):
+    self.rpc.shutdown()
+
+
+  def run(self, jobs):
+    """
+    Run every job of a loaded job file that has not finished before.
+
+    :returns: the counts of jobs done, failed, skipped and cached, and the
+              throughput in jobs per second
+    """
+    batch = jobs["name"]
+    with self.client.lock() as data:
+      finished = data.batch_jobs.finished(batch)
+    # targets waiting to be defined, and jobs whose target is defined
+    (self._defines, self._ready) = (collections.deque(), collections.deque())
+    self._in_flight = 0
+    self.counts = collections.Counter()
+    started = time.time()
+
+    for target in jobs["targets"]:
+      (pdbname, residue_txt, selection) = self._target(target)
+      target_key = target_cache_key(pdbname, residue_txt)
+      todo = []
+      for params in jobs["parameter_sets"]:
+        job = _Job(batch, target_key, params)
+        if(job.key in finished):
+          self.counts["skipped"] += 1
+        else:
+          todo.append(job)
+      self.counts["jobs"] += len(todo)
+      if(not todo):
+        continue
+      target = self.client.cached_target(pdbname, residue_txt, selection)
+      if(target is not None):
+        self.counts["targets_cached"] += 1
+        self._ready.extend([ (job, target.user_fields) for job in todo ])
+      else:
+        self._defines.append((pdbname, residue_txt, selection, todo))
+
+    last_report = time.time()
+    while(self._defines or self._ready or self._in_flight):
+      self._fill()
+      if(not self.rpc.poll()):
+        time.sleep(self._poll_s)
+      if(time.time() - last_report >= self.report_every):
+        self.log(self._progress(started))
+        last_report = time.time()
+
+    elapsed = time.time() - started
+    report = dict(self.counts)
+    report["elapsed"] = elapsed
+    report["jobs_per_s"] = (self.counts["done"] / elapsed if elapsed else 0.0)
+    self.log(self._progress(started))
+    return report
+
+
+  def _target(self, target):
+    "(pdbname, residue_txt, pymol_selection) for one target of a job file"
+    selection = target.get("pymol_selection", "")
+    if(selection):
+      converted = self.client.convert_selection(selection)
+      return (converted["pdbname"], converted["residue_txt"], selection)
+    return (target.get("pdbname", ""), target.get("residue_txt", ""), "")
+
+
+  def _fill(self):
+    "Start requests until concurrency are in flight, jobs before targets"
+    while(self._in_flight < self.concurrency):
+      if(self._ready):
+        self._start_jobs(self._take(self._ready))
+      elif(self._defines):
+        self._start_defines(self._take(self._defines))
+      else:
+        break
+
+
+  def _take(self, queue):
+    """
+    The next batch from a queue; a short queue is spread over the free
+    requests rather than sent as one batch
+    """
+    free = self.concurrency - self._in_flight
+    size = min(self.batch_size, -(-len(queue) // free))
+    return [ queue.popleft() for i in range(size) ]
+
+
+  def _submit(self, method, on_result, on_error, **kwargs):
+    self._in_flight += 1
+    future = self.rpc.submit(method, **kwargs)
+    def done(future):
+      self._in_flight -= 1
+      error = future.exception()
+      if(error is not None):
+        on_error(error)
+      else:
+        on_result(future.result())
+    future.add_done_callback(done)
+
+
+  def _start_defines(self, defines):
+    def fail(todo, error):
+      for job in todo:
+        self._failed(job, None, error)
+    def on_result(targets):
+      for ((p, r, s, todo), target) in zip(defines, targets):
+        if(isinstance(target, Exception)):
+          fail(todo, target)
+        else:
+          self._ready.extend([ (job, target.user_fields) for job in todo ])
+    def on_error(error):
+      for (p, r, s, todo) in defines:
+        fail(todo, error)
+    self._submit("define_targets", on_result, on_error,
+                 targets=[ d[:3] for d in defines ])
+
+
+  def _start_jobs(self, ready):
+    (jobs, params_list) = ([], [])
+    for (job, user_fields) in ready:
+      job.started = time.time()
+      try:
+        params_list.append(search_params(user_fields, job.params))
+      except ValueError as E:
+        self._failed(job, None, E)
+        continue
+      jobs.append(job)
+    if(not jobs):
+      return
+    def on_result(results):
+      for (job, result) in zip(jobs, results):
+        if(isinstance(result, Exception)):
+          self._failed(job, None, result)
+        else:
+          self._done(job, result)
+    def on_error(error):
+      for job in jobs:
+        self._failed(job, None, error)
+    self._submit("search_many", on_result, on_error, params_list=params_list)
+
+
+  def _checkpoint(self, job, status, user_fields_sha1, num_hits, error):
+    with self.client.lock() as data:
+      data.batch_jobs.store_row((
+        job.key, job.batch, job.target_key,
+        json.dumps(job.params, sort_keys=True), status, user_fields_sha1,
+        num_hits, error, time.time() - (job.started or time.time()),
+        time.strftime("%Y-%m-%d %H:%M:%S"),
+      ))
+
+
+  def _done(self, job, result):
+    if(result.source != "server"):
+      self.counts["cached"] += 1
+    self._checkpoint(job, "done", result.user_fields_sha1,
+                     len(result.ovly_keys), None)
+    self.counts["done"] += 1
+
+
+  def _failed(self, job, user_fields_sha1, error):
+    self._checkpoint(job, "failed", user_fields_sha1, None, "%s" % (error))
+    self.counts["failed"] += 1
+
+
+  def _progress(self, started):
+    elapsed = time.time() - started
+    c = self.counts
+    return ("%d/%d jobs done, %d failed, %d from cache, %d skipped; "
+            "%.1f s, %.2f jobs/s" % (
+              c["done"], c["jobs"], c["failed"], c["cached"], c["skipped"],
+              elapsed, c["done"] / elapsed if elapsed else 0.0))
+
+
+def run_batch(fname, url=DEFAULT_URL, concurrency=4, db=None, log=None,
+              batch_size=10):
+  """
+  Run a job file against a Lore server and return the run's report.
+
+  :param db: the sqlite file to use; the plugin's own by default
+  """
+  jobs = load_jobs(fname)
+  client = Client(url, db=db, max_idle=concurrency)
+  runner = BatchRunner(client, concurrency=concurrency,
+                       batch_size=batch_size, log=log)
+  try:
+    return runner.run(jobs)
+  finally:
+    runner.close()
+    client.close()
+
+
+def main(args=None):
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+  parser.add_argument("jobs", help="the job file")
+  parser.add_argument("--url", default=DEFAULT_URL)
+  parser.add_argument("--concurrency", type=int, default=4)
+  parser.add_argument("--db", help="the sqlite file to use")
+  parser.add_argument("--batch-size", type=int, default=10,
+                      help="the most server calls sent in one request")
+  opts = parser.parse_args(args)
+  report = run_batch(opts.jobs, opts.url, opts.concurrency, opts.db,
+                     batch_size=opts.batch_size)
+  return 1 if report.get("failed") else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,369 @@
+"""
+Benchmarks for the local cache and the Tk page builders.
+
+Each benchmark is run over a sweep of sizes and timed a few times; the best
+time is the one compared.  Results are written as JSON and can be compared
+against a saved baseline, which makes the run fail if anything got slower
+than the allowed ratio:
+
+  python -m LoreClient._LoreBench --output new.json --baseline old.json
+
+The Tk benchmarks use a real Tk root when a display is available and
+otherwise build the pages with widget construction mocked out, which times
+only our own code; each result records which mode it was run in.
+"""
+import argparse
+import collections
+import json
+import platform
+import sqlite3
+import sys
+import timeit
+import types
+
+import numpy
+
+from _LoreSqlite import BaseTable, LoreConnection
+from _LoreServer import StandInLore
+from _LoreSuperpose import superpose
+
+
+# name -> (function(size) returning the seconds taken, default sizes)
+BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(name, sizes):
+  "Register a benchmark; the function times one run at the given size"
+  def register(fn):
+    BENCHMARKS[name] = (fn, sizes)
+    return fn
+  return register
+
+
+class _BenchTable(BaseTable):
+  "A scratch table shaped like the cache's own, with an AUTOINCREMENT key"
+
+  def __init__(self, con):
+    self.name = "bench"
+    self.fields = (("id", "INTEGER PRIMARY KEY AUTOINCREMENT"),
+                   ("name", "TEXT"),
+                   ("value", "REAL"),
+                  )
+    self.indexes = (("bench_name", ("name",)),)
+    BaseTable.__init__(self, con)
+
+
+_Pagination = collections.namedtuple("_Pagination", "row_start per_page")
+
+
+def _table(num_rows=0):
+  con = sqlite3.connect(":memory:", factory=LoreConnection)
+  table = _BenchTable(con)
+  table.store_many_rows(
+    (None, "row %08d" % (i), float(i)) for i in xrange(num_rows))
+  return table
+
+
+def _time(fn):
+  start = timeit.default_timer()
+  fn()
+  return timeit.default_timer() - start
+
+
+@benchmark("store_row", (100, 1000, 10000))
+def bench_store_row(size):
+  table = _table()
+  rows = [ (None, "row %08d" % (i), float(i)) for i in xrange(size) ]
+  return _time(lambda: [ table.store_row(r) for r in rows ])
+
+
+@benchmark("store_many_rows", (100, 1000, 10000, 100000))
+def bench_store_many_rows(size):
+  table = _table()
+  rows = [ (None, "row %08d" % (i), float(i)) for i in xrange(size) ]
+  return _time(lambda: table.store_many_rows(rows))
+
+
+_TABLE_ROWS = 100000
+_tables = {}
+
+def _big_table():
+  # built once; the paging benchmarks only read it
+  if("big" not in _tables):
+    _tables["big"] = _table(_TABLE_ROWS)
+  return _tables["big"]
+
+
+@benchmark("records_offset", (0, 1000, 10000, 90000))
+def bench_records_offset(size):
+  table = _big_table()
+  page = _Pagination(size, 200)
+  return _time(lambda: table.records(page, order_by_tag="name"))
+
+
+@benchmark("records_keyset", (0, 1000, 10000, 90000))
+def bench_records_keyset(size):
+  table = _big_table()
+  (after,) = table.records(_Pagination(size, 1), order_by_tag="name")
+  page = _Pagination(size + 1, 200)
+  return _time(
+    lambda: table.records(page, order_by_tag="name", after=after))
+
+
+@benchmark("clear", (1000, 10000, 100000))
+def bench_clear(size):
+  table = _table(size)
+  return _time(table.clear)
+
+
+@benchmark("clear_ids", (1000, 10000, 100000))
+def bench_clear_ids(size):
+  # remove a tenth of the rows, which also resets the AUTOINCREMENT counter
+  table = _table(size)
+  return _time(lambda: table.clear(rm_ids=range(1, size + 1, 10)))
+
+
+@benchmark("superpose", (100, 1000, 10000))
+def bench_superpose(size):
+  "Superimpose size hits of 30 matched atoms on a target"
+  rng = numpy.random.RandomState(size)
+  target = rng.uniform(-10, 10, (30, 3))
+  mobile = target + rng.normal(scale=0.5, size=(size, 30, 3))
+  return _time(lambda: superpose(mobile, target))
+
+
+class _StubWidget(object):
+  "Stands in for every Tk widget and variable when there is no display"
+
+  def __init__(self, *args, **kw):
+    self._options = dict(kw)
+    self._value = None
+
+  def __setitem__(self, key, value):
+    self._options[key] = value
+
+  def __getitem__(self, key):
+    return self._options.get(key)
+
+  def set(self, value):
+    self._value = value
+
+  def get(self):
+    return self._value
+
+  def __getattr__(self, name):
+    return lambda *args, **kw: None
+
+
+class _StubModule(object):
+  def __getattr__(self, name):
+    return _StubWidget
+
+
+def _target_user_fields(num_residues, seg_len=10):
+  "user_fields for a target of num_residues, as the stand-in server gives"
+  residues = [ "A:GLY%d" % (i + 1) for i in range(num_residues) ]
+  residue_txt = "\n".join([ " ".join(residues[i:i + seg_len])
+                            for i in range(0, num_residues, seg_len) ])
+  return StandInLore().define_target("bench", residue_txt)
+
+
+def _bare(cls):
+  "An instance of a Tk widget class whose __init__ has not been run"
+  if(isinstance(cls, types.ClassType)):
+    return types.InstanceType(cls)
+  return cls.__new__(cls)
+
+
+class _PageBuilder(object):
+  """
+  Builds AdjustFrame residue filters, on a real Tk root if there is a
+  display and with stub widgets if not.
+  """
+
+  def __init__(self):
+    import _LoreGui
+    self.plugin = _LoreGui
+    try:
+      self.root = self.plugin.Tkinter.Tk()
+      self.root.withdraw()
+      self.mode = "tk"
+    except self.plugin.Tkinter.TclError:
+      self.root = None
+      self.mode = "mocked"
+      self.plugin.Tkinter = self.plugin.ttk = _StubModule()
+      # the editor's base class is the real ttk.Frame, so stub its tree
+      editor_class = self.plugin.ResidueEditor
+      self.plugin.ResidueEditor = lambda *a, **kw: self._editor(editor_class)
+
+
+  def _editor(self, editor_class):
+    editor = _bare(editor_class)
+    editor.tree = _StubWidget()
+    editor.grid = lambda *args, **kw: None
+    (editor.segments, editor.residues, editor._seg_lengths) = ([], [], [])
+    (editor._rows, editor._entry) = ({}, None)
+    return editor
+
+
+  def build(self):
+    "A bare AdjustFrame with only its residue filters built"
+    page = _bare(self.plugin.AdjustFrame)
+    (page.vars, page.xboxes) = ({}, {})
+    if(self.root is None):
+      page.inner_frame = _StubWidget()
+      page._setup_residue_filters_frame()
+    else:
+      page.inner_frame = self.plugin.ttk.Frame(self.root)
+      page._setup_residue_filters_frame().grid()
+    return page
+
+
+  def show(self, page, user_fields):
+    page.update_residue_filters_frame(user_fields)
+    if(self.root is not None):
+      self.root.update_idletasks()
+
+
+  def destroy(self, page):
+    if(self.root is not None):
+      page.inner_frame.destroy()
+
+
+_builders = {}
+
+def _page_builder():
+  if("page" not in _builders):
+    _builders["page"] = _PageBuilder()
+  return _builders["page"]
+
+
+@benchmark("residue_filters_frame", (10, 100, 1000))
+def bench_residue_filters_frame(size):
+  "Build the residue filters and show a first target"
+  builder = _page_builder()
+  user_fields = _target_user_fields(size)
+  pages = []
+  def build():
+    pages.append(builder.build())
+    builder.show(pages[0], user_fields)
+  elapsed = _time(build)
+  builder.destroy(pages[0])
+  return elapsed
+
+
+@benchmark("residue_filters_update", (10, 100, 1000))
+def bench_residue_filters_update(size):
+  "Show a target that differs from the one shown in one residue's mask"
+  builder = _page_builder()
+  user_fields = _target_user_fields(size)
+  page = builder.build()
+  builder.show(page, user_fields)
+  changed = dict(user_fields)
+  changed["mask"] = "0" + user_fields["mask"][1:]
+  elapsed = _time(lambda: builder.show(page, changed))
+  builder.destroy(page)
+  return elapsed
+
+
+def _mode(name):
+  if(name.startswith("residue_filters") and "page" in _builders):
+    return _builders["page"].mode
+  if(name == "superpose"):
+    return "numpy"
+  return "sqlite"
+
+
+def run(names=None, repeat=5, sizes=None):
+  """
+  Run the benchmarks and return their results as a list of dicts.
+
+  :param names: the benchmarks to run; None runs all of them
+  :param repeat: the number of timings taken at each size
+  :param sizes: sizes to use instead of each benchmark's own
+  """
+  results = []
+  for (name, (fn, default_sizes)) in BENCHMARKS.iteritems():
+    if(names and name not in names):
+      continue
+    for size in (sizes or default_sizes):
+      times = sorted([ fn(size) for i in range(repeat) ])
+      results.append({
+        "name": name,
+        "size": size,
+        "mode": _mode(name),
+        "best": times[0],
+        "median": times[len(times) // 2],
+        "repeat": repeat,
+      })
+  return results
+
+
+def compare(results, baseline, max_ratio=1.25, min_delta=0.001):
+  """
+  Compare results against a baseline run.
+
+  :param max_ratio: how many times slower than the baseline a best time may
+                    be before it counts as a regression
+  :param min_delta: slowdowns of fewer seconds than this are timer noise
+  :returns: a list of (name, size, mode, baseline best, best, ratio) for the
+            benchmarks that regressed
+  """
+  old = dict([ ((r["name"], r["size"], r["mode"]), r) for r in baseline ])
+  regressions = []
+  for r in results:
+    key = (r["name"], r["size"], r["mode"])
+    if(key not in old or old[key]["best"] <= 0):
+      continue
+    ratio = r["best"] / old[key]["best"]
+    if(ratio > max_ratio and r["best"] - old[key]["best"] > min_delta):
+      regressions.append(key + (old[key]["best"], r["best"], ratio))
+  return regressions
+
+
+def main(args=None):
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+  parser.add_argument("names", nargs="*", help="benchmarks to run")
+  parser.add_argument("--repeat", type=int, default=5)
+  parser.add_argument("--sizes", type=int, nargs="+",
+                      help="sizes to use for every benchmark")
+  parser.add_argument("--output", help="write the results to this file")
+  parser.add_argument("--baseline", help="compare against this results file")
+  parser.add_argument("--max-ratio", type=float, default=1.25)
+  parser.add_argument("--min-delta", type=float, default=0.001)
+  parser.add_argument("--list", action="store_true",
+                      help="list the benchmarks and exit")
+  opts = parser.parse_args(args)
+
+  if(opts.list):
+    for (name, (fn, sizes)) in BENCHMARKS.iteritems():
+      print "%-24s %s" % (name, " ".join([ str(s) for s in sizes ]))
+    return 0
+
+  results = run(opts.names, opts.repeat, opts.sizes)
+  for r in results:
+    print "%-24s %8d %-7s best %10.6f  median %10.6f" % (
+      r["name"], r["size"], r["mode"], r["best"], r["median"])
+  if(opts.output):
+    with open(opts.output, "w") as f:
+      json.dump({
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "results": results,
+      }, f, indent=2)
+
+  if(opts.baseline):
+    with open(opts.baseline) as f:
+      regressions = compare(results, json.load(f)["results"],
+                            opts.max_ratio, opts.min_delta)
+    for (name, size, mode, old_best, best, ratio) in regressions:
+      print "REGRESSION %s %d %s: %.6f -> %.6f (%.2fx)" % (
+        name, size, mode, old_best, best, ratio)
+    if(regressions):
+      return 1
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import time
+
+from _LoreSqlite import TargetCacheTable
+from _LoreFilter import IGNORED_FIELDS
+from _LoreStats import STATS
+
+
+def target_cache_key(pdbname="", residue_txt=""):
+  """
+  A content address for a target definition.  Leading/trailing whitespace,
+  runs of blanks and empty lines are not significant to the server, so they
+  are normalized away before hashing; case is kept since chain ids are case
+  sensitive.
+  """
+  lines = [ " ".join(l.split()) for l in residue_txt.splitlines() ]
+  normalized = "%s\n%s" % (
+    pdbname.strip(), "\n".join([ l for l in lines if l ]))
+  return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def _canonical_value(value):
+  if(isinstance(value, (bool, int, long, float))):
+    return float(value)
+  if(isinstance(value, (list, tuple))):
+    return "|".join([ str(int(v)) if isinstance(v, bool) else
+                      ("%s" % (v)).strip() for v in value ])
+  if(isinstance(value, basestring)):
+    return value.strip()
+  return value
+
+
+def canonical_user_fields(user_fields):
+  """
+  The search parameters in one canonical form, so parameter sets that mean
+  the same search are equal: numbers and flags become floats, lists become
+  "|" joined strings and strings lose the blanks around them.  Fields that
+  do not change the search are dropped.
+  """
+  return dict([ (field, _canonical_value(value))
+                for (field, value) in user_fields.iteritems()
+                if field not in IGNORED_FIELDS ])
+
+
+def user_fields_key(user_fields):
+  "A sha1 of the search parameters, used to key the results of a search"
+  return hashlib.sha1(json.dumps(
+    canonical_user_fields(user_fields), sort_keys=True,
+    separators=(",", ":"))).hexdigest()
+
+
+class TargetCache(object):
+  """
+  A local cache of define_target responses, stored in the target_cache table.
+  Lookups are timed in STATS as ("cache", "target_hit"), "target_miss" and
+  "target_expired", so lore_stats counts them over every thread's cache.
+
+  :param con: the sqlite connection
+  :param ttl: the number of seconds an entry stays valid; None never expires
+  """
+
+  def __init__(self, con, ttl=24*3600):
+    self.table = TargetCacheTable(con)
+    self.ttl = ttl
+
+
+  def get(self, pdbname="", residue_txt=""):
+    """
+    Get the cached user_fields for a target or None if we have to ask the
+    server.  Entries older than the ttl are removed.
+    """
+    start = time.time()
+    key = target_cache_key(pdbname, residue_txt)
+    row = self.table.lookup(key)
+    if(row is not None and self.ttl is not None and
+       time.time() - row["date_created"] > self.ttl):
+      self.table.clear_by(cache_key=key)
+      STATS.record("cache", "target_expired", time.time() - start)
+      row = None
+
+    if(row is None):
+      STATS.record("cache", "target_miss", time.time() - start)
+      return None
+    STATS.record("cache", "target_hit", time.time() - start)
+    return json.loads(row["user_fields"])
+
+
+  def put(self, pdbname, residue_txt, user_fields):
+    self.table.store_row((
+      target_cache_key(pdbname, residue_txt),
+      user_fields["fixed_fields_sha1"],
+      json.dumps(user_fields),
+      time.time(),
+    ))
+
+
+  def purge(self):
+    "Remove every expired entry; returns the number of entries removed"
+    if(self.ttl is None):
+      return 0
+    return self.table.purge(time.time() - self.ttl)
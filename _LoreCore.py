@@ -0,0 +1,715 @@
+"""
+The Lore client without its window.
+
+Client defines targets, checks and encodes search parameters, runs
+searches and keeps everything in the local cache.  It imports no Tk, and
+its methods may be called from any thread, so it can be driven from a
+script or a pipeline worker as well as from the plugin's window:
+
+  client = Client("http://localhost:8765/mmLore/jsonrpc")
+  target = client.define_target("1ABC", "A:GLY12 A:SER13 A:LYS14")
+  params = SearchParams.decode(target.user_fields).replace(rmslimit=1.5)
+  result = client.search(params)
+"""
+import collections
+import contextlib
+import httplib
+import Queue
+import random
+import socket
+import sys
+import threading
+import time
+import xmlrpclib
+
+from _LoreData import DataPool
+from _LoreDeadline import Deadline, RpcCancelled, RpcTimeout
+from _LoreDeadline import current_deadline, deadline_scope
+from _LoreCache import user_fields_key
+from _LoreExport import export
+from _LoreFilter import residue_is_na
+from _LoreResults import ResultPager
+from _LoreRpc import RpcBatcher
+from _LoreSelection import SelectionConverter
+from _LoreStats import STATS
+from _LoreTransport import PooledTransport, server_proxy
+
+
+DEFAULT_URL = "http://drugsite-dev.msi.umn.edu/mmLore/jsonrpc"
+
+# the user_fields that set_user_fields takes
+SEARCH_FIELDS = (
+  "fixed_fields_sha1", "probe_pdblist", "superposition_atoms",
+  "na_superposition_atoms", "acceptable_residues", "mask", "seg_pattern",
+  "seg_joins", "best_match_only", "bestsequence", "ignore_seg_pattern",
+  "intra_tolerance", "inter_tolerance", "na_intra_tolerance",
+  "na_inter_tolerance", "rmslimit",
+)
+_LIST_FIELDS = ("probe_pdblist", "superposition_atoms",
+                "na_superposition_atoms")
+_FLAG_FIELDS = ("best_match_only", "bestsequence", "ignore_seg_pattern")
+_FLOAT_FIELDS = ("intra_tolerance", "inter_tolerance", "na_intra_tolerance",
+                 "na_inter_tolerance", "rmslimit")
+
+# the seconds each server method may take in all, retries included, the
+# number of retries and whether a call slower than the method's p95 is
+# sent again; only the methods that change nothing on the server are
+# retried or hedged
+CallPolicy = collections.namedtuple("CallPolicy", "budget retries hedge")
+CALL_POLICIES = {
+  "define_target": CallPolicy(60.0, 0, False),
+  "set_user_fields": CallPolicy(300.0, 0, False),
+  "get_searchable_subsets": CallPolicy(20.0, 3, True),
+  "get_overlays": CallPolicy(60.0, 2, True),
+}
+DEFAULT_POLICY = CallPolicy(120.0, 0, False)
+
+# Client method -> the server method whose budget bounds it
+_CLIENT_CALLS = {
+  "define_target": "define_target",
+  "define_targets": "define_target",
+  "search": "set_user_fields",
+  "search_many": "set_user_fields",
+  "refresh_searchable": "get_searchable_subsets",
+  "get_overlays": "get_overlays",
+}
+
+
+def _retryable(error):
+  """
+  Whether a failed call may be sent again: a connection that failed or an
+  HTTP 5xx may go better next time, an error the server answered with not
+  """
+  if(isinstance(error, xmlrpclib.ProtocolError)):
+    return error.errcode >= 500
+  return isinstance(error, (socket.error, httplib.HTTPException))
+
+
+def _split(value, per_residue=False):
+  """
+  A list from a |-joined string, or the list itself.  An empty string is
+  an empty list, unless it holds one value per residue: then it is the
+  one empty value of a single residue target.
+  """
+  if(isinstance(value, basestring)):
+    return value.split("|") if (value or per_residue) else []
+  return list(value)
+
+
+class SearchParams(object):
+  """
+  The parameters of one search as Python values: lists of names and
+  flags, booleans and floats.  They are checked when made, and encode()
+  gives the strings set_user_fields expects.  Start from a target's own
+  parameters with SearchParams.decode(target.user_fields).
+
+  :param mask: per residue, whether its DG-errors are checked
+  :param acceptable_residues: per residue, the residue names it may match;
+                              empty for any
+  :param seg_pattern: one character per segment
+  :param seg_joins: per segment, whether it is joined to the one before
+  :param searchabletablename: the subset to search; empty for all of them
+  """
+
+  def __init__(self, fixed_fields_sha1, mask, acceptable_residues,
+               seg_pattern, seg_joins, probe_pdblist=(),
+               superposition_atoms=(), na_superposition_atoms=(),
+               intra_tolerance=None, inter_tolerance=None,
+               na_intra_tolerance=None, na_inter_tolerance=None,
+               rmslimit=None, best_match_only=False, bestsequence=False,
+               ignore_seg_pattern=False, searchabletablename=""):
+    self.fixed_fields_sha1 = str(fixed_fields_sha1 or "")
+    self.mask = [ bool(int(m)) for m in mask ]
+    self.acceptable_residues = [ str(a).strip() for a in acceptable_residues ]
+    self.seg_pattern = [ str(p) for p in seg_pattern ]
+    self.seg_joins = [ bool(j) for j in seg_joins ]
+    self.probe_pdblist = [ str(p) for p in probe_pdblist ]
+    self.superposition_atoms = [ str(a) for a in superposition_atoms ]
+    self.na_superposition_atoms = [ str(a) for a in na_superposition_atoms ]
+    self.intra_tolerance = intra_tolerance
+    self.inter_tolerance = inter_tolerance
+    self.na_intra_tolerance = na_intra_tolerance
+    self.na_inter_tolerance = na_inter_tolerance
+    self.rmslimit = rmslimit
+    self.best_match_only = bool(best_match_only)
+    self.bestsequence = bool(bestsequence)
+    self.ignore_seg_pattern = bool(ignore_seg_pattern)
+    self.searchabletablename = str(searchabletablename or "")
+    self.validate()
+
+
+  @classmethod
+  def decode(cls, user_fields, **overrides):
+    """
+    The parameters in user_fields as define_target returns them or
+    set_user_fields takes them, with any overrides in the same form.
+    """
+    fields = dict(user_fields)
+    fields.update(overrides)
+    seg_joins = fields.get("seg_joins", [])
+    if(isinstance(seg_joins, basestring)):
+      seg_joins = [ int(j) for j in _split(seg_joins) ]
+    kwargs = dict(
+      fixed_fields_sha1=fields.get("fixed_fields_sha1"),
+      mask=_split(fields.get("mask", "")),
+      acceptable_residues=_split(fields.get("acceptable_residues", ""),
+                                 per_residue=True),
+      seg_pattern=fields.get("seg_pattern", ""),
+      seg_joins=seg_joins,
+      searchabletablename=fields.get("searchabletablename", ""),
+    )
+    for f in _LIST_FIELDS:
+      kwargs[f] = [ v for v in _split(fields.get(f, "")) if v ]
+    for f in _FLAG_FIELDS:
+      kwargs[f] = bool(int(fields.get(f) or 0))
+    for f in _FLOAT_FIELDS:
+      kwargs[f] = fields.get(f)
+    return cls(**kwargs)
+
+
+  def validate(self):
+    "Raise ValueError for parameters the server would not accept"
+    if(not self.fixed_fields_sha1):
+      raise ValueError("The search has no target; define one first")
+    if(not self.mask):
+      raise ValueError("The target has no residues")
+    if(len(self.acceptable_residues) != len(self.mask)):
+      raise ValueError("%d residue filters for %d residues" % (
+        len(self.acceptable_residues), len(self.mask)))
+    if(len(self.seg_joins) != len(self.seg_pattern)):
+      raise ValueError("%d segment joins for %d segments" % (
+        len(self.seg_joins), len(self.seg_pattern)))
+    for (i, pattern) in enumerate(self.seg_pattern):
+      if(len(pattern) != 1):
+        msg = "Segment pattern %d must have exactly 1 character as input"
+        raise ValueError(msg % (i))
+    for f in _LIST_FIELDS + ("acceptable_residues",):
+      for value in getattr(self, f):
+        if("|" in value or (f != "acceptable_residues" and
+                            len(value.split()) != 1)):
+          raise ValueError("%s has a bad entry: %r" % (f, value))
+    for f in _FLOAT_FIELDS:
+      value = getattr(self, f)
+      try:
+        value = float(value)
+      except (TypeError, ValueError):
+        raise ValueError("%s must be a number, not %r" % (f, value))
+      if(value < 0):
+        raise ValueError("%s must not be negative" % (f))
+      setattr(self, f, value)
+
+
+  def as_dict(self):
+    "The parameters as keyword arguments for SearchParams"
+    fields = dict([ (f, getattr(self, f)) for f in SEARCH_FIELDS ])
+    fields["seg_pattern"] = list(self.seg_pattern)
+    fields["searchabletablename"] = self.searchabletablename
+    return fields
+
+
+  def replace(self, **changes):
+    "A copy with some parameters changed, checked again"
+    fields = self.as_dict()
+    fields.update(changes)
+    return SearchParams(**fields)
+
+
+  def encode(self):
+    "The user_fields sent to set_user_fields"
+    data = {
+      "fixed_fields_sha1": self.fixed_fields_sha1,
+      "acceptable_residues": "|".join(self.acceptable_residues),
+      "mask": "|".join([ str(int(m)) for m in self.mask ]),
+      "seg_pattern": "".join(self.seg_pattern),
+      "seg_joins": list(self.seg_joins),
+    }
+    for f in _LIST_FIELDS:
+      data[f] = "|".join(getattr(self, f))
+    for f in _FLAG_FIELDS + _FLOAT_FIELDS:
+      data[f] = getattr(self, f)
+    if(self.searchabletablename):
+      data["searchabletablename"] = self.searchabletablename
+    return data
+
+
+Target = collections.namedtuple(
+  "Target", "pymol_selection pdbname residue_txt user_fields skipped")
+
+# source is "cache" for a repeated search, "refilter" for one answered from
+# the hits of a looser search and "server" otherwise
+SearchResult = collections.namedtuple(
+  "SearchResult", "user_fields_sha1 params ovly_keys source")
+
+
+class _Locked(object):
+  "Calls an object's methods while holding a lock"
+
+  def __init__(self, obj, lock):
+    self._obj = obj
+    self._lock = lock
+
+  def __getattr__(self, name):
+    attr = getattr(self._obj, name)
+    if(not callable(attr)):
+      return attr
+    def locked(*args, **kwargs):
+      with self._lock:
+        return attr(*args, **kwargs)
+    return locked
+
+
+class Client(object):
+  """
+  A Lore server and the local cache behind it.
+
+  Server calls block the calling thread; each thread gets its own proxy,
+  and they all share one connection pool.  Each thread also opens its own
+  connection to the cache on first use, so any number of threads, and
+  other PyMOLs, may share the cache.
+
+  :param url: the server's JSON-RPC address
+  :param db: the sqlite file; ~/.pymol_lore.sqlite3 by default
+  :param proxy_factory: builds a jsonrpclib proxy; by default one using a
+                        PooledTransport of up to max_idle connections
+  :param policies: server method -> CallPolicy, overriding CALL_POLICIES
+  """
+  # the first retry waits about this long, each later one twice as long
+  _backoff_s = 0.25
+  _max_backoff_s = 4.0
+  # calls of a method timed before its p95 is trusted for hedging
+  _hedge_min_calls = 20
+
+  def __init__(self, url=DEFAULT_URL, db=None, proxy_factory=None,
+               max_idle=4, policies=None):
+    self.url = url
+    self.db = db
+    self.policies = dict(CALL_POLICIES)
+    self.policies.update(policies or {})
+    self.transport = None
+    if(proxy_factory is None):
+      self.transport = PooledTransport(secure=url.startswith("https:"),
+                                       max_idle=max_idle)
+      proxy_factory = lambda: server_proxy(url, transport=self.transport)
+    self.proxy_factory = proxy_factory
+    self.selection_converter = SelectionConverter()
+    self._pool = DataPool(db)
+    self._lock = threading.RLock()
+    self._local = threading.local()
+    # fixed_fields_sha1 -> residue_is_na, for the targets defined here
+    self._is_na = {}
+
+
+  @property
+  def data(self):
+    "This thread's connection to the local cache; use it through lock()"
+    return self._pool.get()
+
+
+  @contextlib.contextmanager
+  def lock(self):
+    """
+    Give the with block this thread's cache.  Only an in-memory cache,
+    which every thread shares, is locked for the block.
+    """
+    if(self._pool.shared):
+      with self._lock:
+        yield self.data
+    else:
+      yield self.data
+
+
+  def close(self):
+    if(self.transport is not None):
+      self.transport.close()
+    self._pool.close()
+
+
+  def call(self, method, **kwargs):
+    """
+    Call a server method on this thread and return its result.
+
+    The call has the budget of the method's CallPolicy, or less if the
+    thread's own Deadline ends sooner, and raises RpcTimeout once that is
+    spent or RpcCancelled if the Deadline is cancelled.  A call of a
+    method that may be retried is sent again after an exponential, and
+    jittered, backoff if the connection failed or the server answered
+    with an HTTP 5xx; one that may be hedged is sent a second time once
+    it has taken longer than the method's p95, and the first answer wins.
+    """
+    policy = self.policies.get(method, DEFAULT_POLICY)
+    deadline = Deadline(policy.budget, name=method,
+                        parent=current_deadline())
+    for attempt in range(policy.retries + 1):
+      try:
+        if(policy.hedge):
+          return self._hedged(method, kwargs, deadline)
+        return self._attempt(method, kwargs, deadline)
+      except (RpcCancelled, RpcTimeout):
+        raise
+      except Exception as E:
+        if(not _retryable(E)):
+          raise
+        delay = min(self._backoff_s * 2 ** attempt, self._max_backoff_s)
+        delay *= random.uniform(0.5, 1.0)
+        remaining = deadline.remaining()
+        if(attempt == policy.retries or
+           (remaining is not None and remaining <= delay)):
+          raise
+        STATS.record("rpc", "%s retry" % (method), delay)
+        deadline.wait(delay)
+
+
+  def pool_timeouts(self, slack=5.0):
+    """
+    Timeouts for an RpcPool running this Client's methods: a little over
+    the budget of the server call each makes, so that the call's own
+    deadline is what normally ends it.
+    """
+    return dict([ (m, self.policies.get(s, DEFAULT_POLICY).budget + slack)
+                  for (m, s) in _CLIENT_CALLS.iteritems() ])
+
+
+  def call_many(self, method, kwargs_list):
+    """
+    Call a server method once for each dict of keyword arguments, in one
+    JSON-RPC batch if the server takes batches and one call() at a time
+    if not.  All the calls together have the budget of one call.
+
+    :returns: the result of each call, or the exception it raised
+    """
+    if(not kwargs_list):
+      return []
+    policy = self.policies.get(method, DEFAULT_POLICY)
+    deadline = Deadline(policy.budget, name=method,
+                        parent=current_deadline())
+    batcher = self._batcher()
+    results = []
+    with deadline_scope(deadline):
+      if(len(kwargs_list) > 1 and batcher.batches_supported):
+        batch = batcher.batch()
+        calls = [ getattr(batch, method)(**kwargs) for kwargs in kwargs_list ]
+        try:
+          deadline.check()
+          batch.send()
+        except Exception as E:
+          return [ E ] * len(calls)
+        for call in calls:
+          try:
+            results.append(call.result())
+          except Exception as E:
+            results.append(E)
+      else:
+        for kwargs in kwargs_list:
+          try:
+            results.append(self.call(method, **kwargs))
+          except Exception as E:
+            results.append(E)
+    return results
+
+
+  def _proxy(self):
+    "This thread's proxy"
+    proxy = getattr(self._local, "proxy", None)
+    if(proxy is None):
+      proxy = self._local.proxy = self.proxy_factory()
+    return proxy
+
+
+  def _batcher(self):
+    "This thread's RpcBatcher, around its proxy"
+    batcher = getattr(self._local, "batcher", None)
+    if(batcher is None):
+      batcher = self._local.batcher = RpcBatcher(self._proxy())
+    return batcher
+
+
+  def _attempt(self, method, kwargs, deadline):
+    proxy = self._proxy()
+    start = time.time()
+    try:
+      with deadline_scope(deadline):
+        deadline.check()
+        return getattr(proxy, method)(**kwargs)
+    finally:
+      # a cancelled call, e.g. the slower of two hedged attempts, only
+      # took as long as it was let run
+      if(not deadline.cancelled):
+        STATS.record("rpc", method, time.time() - start)
+
+
+  def _hedged(self, method, kwargs, deadline):
+    """
+    Run a call on a thread of its own, and a second one if the first is
+    slower than the method's p95; return the first to succeed.
+    """
+    p95 = STATS.percentile("rpc", method, 0.95, self._hedge_min_calls)
+    if(p95 is None):
+      return self._attempt(method, kwargs, deadline)
+    results = Queue.Queue()
+    attempts = []
+
+    def run(child):
+      try:
+        results.put((True, self._attempt(method, kwargs, child)))
+      except Exception:
+        results.put((False, sys.exc_info()))
+
+    def start():
+      # each attempt can be cancelled alone
+      child = Deadline(name=method, parent=deadline)
+      attempts.append(child)
+      thread = threading.Thread(target=run, args=(child,), name="LoreHedge")
+      thread.daemon = True
+      thread.start()
+
+    start()
+    (running, errors) = (1, [])
+    try:
+      while(True):
+        remaining = deadline.remaining()
+        wait = remaining if len(attempts) > 1 else p95
+        if(remaining is not None):
+          wait = min(wait, remaining)
+        try:
+          (ok, value) = results.get(timeout=wait)
+        except Queue.Empty:
+          deadline.check()
+          if(len(attempts) == 1):
+            STATS.record("rpc", "%s hedge" % (method), p95)
+            start()
+            running += 1
+          continue
+        running -= 1
+        if(ok):
+          return value
+        errors.append(value)
+        if(not running):
+          raise errors[0][0], errors[0][1], errors[0][2]
+    finally:
+      # the slower attempt is not needed any more
+      for child in attempts:
+        child.cancel()
+
+
+  def convert_selection(self, pymol_selection):
+    "See SelectionConverter.convert; needs PyMOL"
+    with self._lock:
+      return self.selection_converter.convert(pymol_selection)
+
+
+  def cached_target(self, pdbname, residue_txt, pymol_selection=""):
+    "The Target of a previously defined target, or None"
+    with self.lock() as data:
+      user_fields = data.cached_target_def(pdbname, residue_txt)
+      if(user_fields is not None):
+        data.add_target_def(pymol_selection, user_fields)
+    if(user_fields is None):
+      return None
+    return self._target(pymol_selection, pdbname, residue_txt, user_fields,
+                        [])
+
+
+  def define_target(self, pdbname="", residue_txt="", pymol_selection=""):
+    """
+    Define a target on the server, or take it from the cache.  A PyMOL
+    selection is converted to a pdbname and residue_txt unless they are
+    given as well.
+
+    :returns: a Target
+    """
+    skipped = []
+    if(pymol_selection and not (pdbname or residue_txt)):
+      converted = self.convert_selection(pymol_selection)
+      (pdbname, residue_txt, skipped) = (
+        converted["pdbname"], converted["residue_txt"], converted["skipped"])
+    elif(not pdbname and not residue_txt):
+      raise ValueError("You must provide either a PyMOL selection or a "
+                       "DrugSite selection")
+
+    target = self.cached_target(pdbname, residue_txt, pymol_selection)
+    if(target is not None):
+      return target._replace(skipped=skipped)
+    user_fields = self.call("define_target", pdbname=pdbname,
+                            residue_txt=residue_txt)
+    return self._defined(pdbname, residue_txt, pymol_selection, user_fields,
+                         skipped)
+
+
+  def define_targets(self, targets):
+    """
+    Define several targets, sending those not in the cache as one batch.
+
+    :param targets: (pdbname, residue_txt, pymol_selection) tuples; the
+                    selections are not converted
+    :returns: a Target, or the exception raised defining it, for each
+    """
+    results = [ self.cached_target(*target) for target in targets ]
+    todo = [ i for (i, target) in enumerate(results) if target is None ]
+    answers = self.call_many("define_target", [
+      { "pdbname": targets[i][0], "residue_txt": targets[i][1] }
+      for i in todo ])
+    for (i, user_fields) in zip(todo, answers):
+      if(isinstance(user_fields, Exception)):
+        results[i] = user_fields
+      else:
+        (pdbname, residue_txt, pymol_selection) = targets[i]
+        results[i] = self._defined(pdbname, residue_txt, pymol_selection,
+                                   user_fields, [])
+    return results
+
+
+  def _defined(self, pdbname, residue_txt, pymol_selection, user_fields,
+               skipped):
+    "Cache a target the server defined and return its Target"
+    with self.lock() as data:
+      with data.transaction():
+        data.cache_target_def(pdbname, residue_txt, user_fields)
+        data.add_target_def(pymol_selection, user_fields)
+    return self._target(pymol_selection, pdbname, residue_txt, user_fields,
+                        skipped)
+
+
+  def _target(self, pymol_selection, pdbname, residue_txt, user_fields,
+              skipped):
+    with self._lock:
+      self._is_na[user_fields["fixed_fields_sha1"]] = residue_is_na(
+        user_fields)
+    return Target(pymol_selection, pdbname, residue_txt, user_fields,
+                  skipped)
+
+
+  def search(self, params):
+    """
+    Run a search.  A search made before with the same parameters is not
+    sent again, and one that only tightens an earlier search's parameters
+    is answered from that search's stored hits.
+
+    :param params: SearchParams, or user_fields to decode into them
+    :returns: a SearchResult
+    """
+    (params, data, result) = self._cached_search(params)
+    if(result is not None):
+      return result
+    return self._searched(params, data,
+                          self.call("set_user_fields", **data))
+
+
+  def search_many(self, params_list):
+    """
+    Run several searches, sending those the cache cannot answer as one
+    batch.
+
+    :param params_list: SearchParams, or user_fields, as for search()
+    :returns: a SearchResult, or the exception raised running it, for each
+    """
+    results = [ None ] * len(params_list)
+    todo = []
+    for (i, params) in enumerate(params_list):
+      try:
+        (params, data, results[i]) = self._cached_search(params)
+      except ValueError as E:
+        results[i] = E
+        continue
+      if(results[i] is None):
+        todo.append((i, params, data))
+    answers = self.call_many("set_user_fields", [ t[2] for t in todo ])
+    for ((i, params, data), ovly_keys) in zip(todo, answers):
+      if(isinstance(ovly_keys, Exception)):
+        results[i] = ovly_keys
+      else:
+        results[i] = self._searched(params, data, ovly_keys)
+    return results
+
+
+  def _cached_search(self, params):
+    """
+    Decode and encode a search's parameters, and answer it from the cache
+    if possible.
+
+    :returns: (SearchParams, user_fields, SearchResult or None)
+    """
+    if(not isinstance(params, SearchParams)):
+      params = SearchParams.decode(params)
+    data = params.encode()
+    user_fields_sha1 = user_fields_key(data)
+    with self.lock() as cache:
+      ovly_keys = cache.cached_result(user_fields_sha1)
+      if(ovly_keys is not None):
+        STATS.record("cache", "result_set_hit", 0.0)
+        return (params, data,
+                SearchResult(user_fields_sha1, params, ovly_keys, "cache"))
+      # without the target's polytypes only the rmslimit can be refiltered
+      ovly_keys = cache.refilter_cached_result(
+        user_fields_sha1, data, is_na=self._is_na.get(params.fixed_fields_sha1))
+      if(ovly_keys is not None):
+        return (params, data,
+                SearchResult(user_fields_sha1, params, ovly_keys, "refilter"))
+    return (params, data, None)
+
+
+  def _searched(self, params, data, ovly_keys):
+    "Store the hits the server found for a search and return its result"
+    user_fields_sha1 = user_fields_key(data)
+    with self.lock() as cache:
+      with cache.transaction():
+        cache.add_user_fields(user_fields_sha1, data)
+        cache.add_result_set(user_fields_sha1, ovly_keys)
+    return SearchResult(user_fields_sha1, params, ovly_keys, "server")
+
+
+  def get_overlays(self, ovly_keys=()):
+    "Fetch overlays from the server; ResultPager stores them"
+    return self.call("get_overlays", ovly_keys=list(ovly_keys))
+
+
+  def result_arrays(self, user_fields_sha1):
+    "The stored overlays of a search as arrays; see OverlaysTable"
+    with self.lock() as data:
+      return data.result_arrays(user_fields_sha1)
+
+
+  def pager(self, result, submit, page_size=200):
+    """
+    A ResultPager over a search's overlays.  submit should run this
+    Client's get_overlays in the background; see ResultPager.
+    """
+    with self.lock() as data:
+      table = data.overlays
+      if(self._pool.shared):
+        table = _Locked(table, self._lock)
+    return ResultPager(table, submit, result.user_fields_sha1,
+                       result.ovly_keys, page_size=page_size)
+
+
+  def export(self, fname, user_fields_sha1=None, **kwargs):
+    """
+    Write a search's stored hits to a .csv, .jsonl or .npz file; see
+    _LoreExport.export.
+    """
+    with self.lock() as data:
+      return export(data, fname, user_fields_sha1, **kwargs)
+
+
+  def refresh_searchable(self):
+    """
+    Fetch the searchable subsets from the server into the cache.
+
+    :returns: the subsets' records if they changed, None if not
+    """
+    subsets = self.call("get_searchable_subsets")
+    # yea!, have to swap order
+    rows = [ (s[1], s[0]) for s in subsets ]
+    with self.lock() as data:
+      if(data.update_searchable(rows) is None):
+        return None
+      return data.searchable_records()
+
+
+  def searchable_records(self):
+    with self.lock() as data:
+      return data.searchable_records()
+
+
+  def save_stats(self):
+    with self.lock() as data:
+      data.save_stats()
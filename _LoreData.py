@@ -0,0 +1,219 @@
+import os
+import hashlib
+import json
+import threading
+import time
+
+from _LoreSqlite import FixedFieldsTable, UserFieldsTable, Searchable
+from _LoreSqlite import MetaTable, OverlaysTable, ResultSetsTable, StatsTable
+from _LoreSqlite import BatchJobsTable, connect, set_schema_version
+from _LoreCache import TargetCache
+from _LoreFilter import is_tightening, refilter
+from _LoreStats import STATS
+
+
+class Data(object):
+  """
+  The local cache of targets, searches and their overlays, kept in
+  ~/.pymol_lore.sqlite3 unless another file is given.
+
+  :param shared: open the connection for use from any thread; the caller
+                 must hold a lock around every use, as Client does
+  """
+  _fname = ".pymol_lore.sqlite3"
+  _target_cache_ttl = 24*3600
+  _result_set_ttl = 24*3600
+
+  def __init__(self, fname=None, shared=False):
+    if(fname is None):
+      fname = os.path.join(os.path.expanduser('~'), self._fname)
+    self.fname = fname
+    self.conn = connect(self.fname, check_same_thread=not shared)
+    self._init_tables()
+
+
+  def _init_tables(self):
+    self.uf_tbl = UserFieldsTable(self.conn)
+    self.ff_tbl = FixedFieldsTable(self.conn)
+    self.searchable = Searchable(self.conn)
+    self.meta = MetaTable(self.conn)
+    self.overlays = OverlaysTable(self.conn)
+    self.result_sets = ResultSetsTable(self.conn)
+    self.target_cache = TargetCache(self.conn, ttl=self._target_cache_ttl)
+    self.stats = StatsTable(self.conn)
+    self.batch_jobs = BatchJobsTable(self.conn)
+    set_schema_version(self.conn)
+
+
+  def transaction(self):
+    "Group the writes made in a with block into one unit of work"
+    return self.conn.transaction()
+
+  def close(self):
+    self.conn.close()
+
+
+  def add_target_def(self, pymol_selection, user_fields):
+    "Add fields used to define the target to the table, indexed by ff_sha1"
+
+    self.ff_tbl.store_row((
+      user_fields["fixed_fields_sha1"],
+      pymol_selection,
+      user_fields["pdbname"],
+      user_fields["residue_txt"],
+    ))
+
+  def _user_fields_row(self, data):
+    "The search parameters as they are stored in the user_fields table"
+    row = dict([ (f, data.get(f)) for (f, t) in self.uf_tbl.fields ])
+    row["seg_joins"] = "|".join([ str(int(j)) for j in data["seg_joins"] ])
+    for k in ["best_match_only", "bestsequence", "ignore_seg_pattern"]:
+      row[k] = int(bool(data.get(k)))
+    return row
+
+  def add_user_fields(self, user_fields_sha1, data):
+    "Add the parameters of a search to the table, indexed by uf_sha1"
+    row = self._user_fields_row(data)
+    row["user_fields_sha1"] = user_fields_sha1
+    row["date_created"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    self.uf_tbl.store_row(row)
+
+  def refilter_cached_result(self, user_fields_sha1, data, is_na=None):
+    """
+    Answer a search locally if it only tightens the parameters of a search
+    whose overlays, with their DG-errors, are all stored.  The hits that
+    pass are stored as a new result set.
+
+    :param is_na: per residue nucleic acid flags, None if unknown
+    :returns: the overlay keys of the new result set, or None if the
+              server has to be asked
+    """
+    new = self._user_fields_row(data)
+    best = None
+    for old in self.uf_tbl.iter_records(
+      fixed_fields_sha1=data["fixed_fields_sha1"]):
+      result_set = self.result_sets.lookup(old["user_fields_sha1"])
+      if(result_set is None or
+         old["user_fields_sha1"] == user_fields_sha1 or
+         not is_tightening(dict(zip(old.keys(), old)), new,
+                           polytypes_known=is_na is not None)):
+        continue
+      if(best is None or result_set["num_hits"] < best["num_hits"]):
+        if(self.overlays.count_complete(old["user_fields_sha1"]) ==
+           result_set["num_hits"]):
+          best = result_set
+    if(best is None):
+      return None
+
+    arrays = self.overlays.load_arrays(best["user_fields_sha1"])
+    try:
+      keep = refilter(arrays, data, is_na)
+    except ValueError:
+      # hits of differing sizes cannot be refiltered; ask the server
+      return None
+    ovly_keys = json.loads(best["ovly_keys"])
+    kept_rows = arrays["row_no"][keep]
+    ovly_keys = [ ovly_keys[i] for i in kept_rows ]
+    with self.transaction():
+      self.overlays.copy_rows(
+        best["user_fields_sha1"], user_fields_sha1, kept_rows)
+      self.add_user_fields(user_fields_sha1, data)
+      self.add_result_set(user_fields_sha1, ovly_keys)
+    return ovly_keys
+
+  def cached_result(self, user_fields_sha1):
+    """
+    The overlay keys of a search already made with the same parameters, or
+    None if there is none younger than the result set ttl.
+    """
+    row = self.result_sets.lookup(user_fields_sha1)
+    if(row is None):
+      return None
+    # the dates sort as text, so no strptime, which is not thread-safe the
+    # first time it is called in Python 2
+    if(self._result_set_ttl is not None):
+      oldest = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(
+        time.time() - self._result_set_ttl))
+      if(row["date_created"] < oldest):
+        return None
+    return json.loads(row["ovly_keys"])
+
+  def add_result_set(self, user_fields_sha1, ovly_keys):
+    self.result_sets.store_row((
+      user_fields_sha1, len(ovly_keys), json.dumps(list(ovly_keys)),
+      time.strftime("%Y-%m-%d %H:%M:%S"),
+    ))
+
+  def result_arrays(self, user_fields_sha1):
+    "The stored overlays of a search as columns of NumPy arrays"
+    return self.overlays.load_arrays(user_fields_sha1)
+
+  def cached_target_def(self, target_pdbname, residue_txt):
+    "The user_fields of a previously defined target, or None"
+    return self.target_cache.get(target_pdbname, residue_txt)
+
+  def cache_target_def(self, target_pdbname, residue_txt, user_fields):
+    self.target_cache.put(target_pdbname, residue_txt, user_fields)
+
+  def update_searchable(self, rows):
+    """
+    Apply a fresh list of searchable subsets as a diff against the cached
+    table.  The sha1 of the list is kept as an ETag, so an unchanged list
+    costs no writes at all.
+
+    :returns: the (inserted, deleted, renamed) ids, or None if unchanged
+    """
+    etag = hashlib.sha1(json.dumps(sorted(rows))).hexdigest()
+    if(etag == self.meta.get_value("searchable_etag")):
+      return None
+    with self.transaction():
+      diff = self.searchable.sync(rows)
+      self.meta.set_value("searchable_etag", etag)
+    return diff
+
+  def searchable_records(self):
+    return self.searchable.records()
+
+  def save_stats(self):
+    STATS.save(self.stats)
+
+
+class DataPool(object):
+  """
+  One Data per thread on the same cache file, each with its own
+  connection, so threads never share a connection and only wait on one
+  another while one of them writes.  An in-memory cache cannot be opened
+  twice, so it is one Data shared by every thread; shared tells the
+  caller to serialize its use.
+  """
+
+  def __init__(self, fname=None):
+    if(fname is None):
+      fname = os.path.join(os.path.expanduser('~'), Data._fname)
+    self.fname = fname
+    self.shared = fname == ":memory:"
+    self._local = threading.local()
+    self._lock = threading.Lock()
+    self._opened = []
+
+  def get(self):
+    "This thread's Data, opened on first use"
+    data = getattr(self._local, "data", None)
+    if(data is None):
+      with self._lock:
+        if(self.shared and self._opened):
+          data = self._opened[0]
+        else:
+          # closed from whichever thread calls close()
+          data = Data(self.fname, shared=True)
+          self._opened.append(data)
+      self._local.data = data
+    return data
+
+  def close(self):
+    "Close every thread's connection; nothing may use them afterwards"
+    with self._lock:
+      for data in self._opened:
+        data.close()
+      self._opened = []
+    self._local = threading.local()
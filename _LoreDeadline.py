@@ -0,0 +1,146 @@
+"""
+Deadlines and cancellation for server calls.
+
+A Deadline is made for each call and made current on the thread running
+it.  The layers below read it from there rather than taking it as an
+argument: Client.call bounds each attempt by what is left of it, and
+PooledTransport sets its socket timeouts from it and registers the
+connection, so that cancel() can close the socket a worker is blocked on.
+"""
+import contextlib
+import socket
+import threading
+import time
+
+
+class RpcTimeout(Exception):
+  "A call that did not finish within its deadline"
+  pass
+
+
+class RpcCancelled(Exception):
+  "A call that was cancelled before it finished"
+  pass
+
+
+_local = threading.local()
+
+
+def current_deadline():
+  "The Deadline of the call running on this thread, or None"
+  return getattr(_local, "deadline", None)
+
+
+@contextlib.contextmanager
+def deadline_scope(deadline):
+  "Make deadline current on this thread for the with block"
+  outer = current_deadline()
+  _local.deadline = deadline
+  try:
+    yield deadline
+  finally:
+    _local.deadline = outer
+
+
+class Deadline(object):
+  """
+  When a call has to finish by, and whether it was cancelled.  A child
+  deadline expires no later than its parent and is cancelled with it.
+
+  :param seconds: the time allowed from now; None for no limit
+  :param name: the call, for error messages
+  :param parent: the Deadline of the call this one is part of
+  """
+
+  def __init__(self, seconds=None, name="call", parent=None):
+    self.name = name
+    self.parent = parent
+    self.expires = time.time() + seconds if seconds is not None else None
+    if(parent is not None and parent.expires is not None):
+      self.expires = min(self.expires or parent.expires, parent.expires)
+    self._cancelled = threading.Event()
+    self._lock = threading.Lock()
+    self._conns = set()
+    self._children = []
+    if(parent is not None):
+      parent._add_child(self)
+
+
+  @property
+  def cancelled(self):
+    return self._cancelled.is_set()
+
+
+  def remaining(self):
+    "Seconds left, never below zero, or None for no limit"
+    if(self.expires is None):
+      return None
+    return max(0.0, self.expires - time.time())
+
+
+  def expired(self):
+    return self.expires is not None and time.time() >= self.expires
+
+
+  def check(self):
+    "Raise RpcCancelled or RpcTimeout if the call should stop"
+    if(self.cancelled):
+      raise RpcCancelled("%s was cancelled" % (self.name))
+    if(self.expired()):
+      raise RpcTimeout("%s did not finish in time" % (self.name))
+
+
+  def error(self):
+    "The exception to raise for a call that stopped early"
+    if(self.cancelled):
+      return RpcCancelled("%s was cancelled" % (self.name))
+    return RpcTimeout("%s did not finish in time" % (self.name))
+
+
+  def wait(self, seconds):
+    """
+    Sleep for seconds, or less if the deadline comes first.  Returns
+    early, and raises, if the call is cancelled meanwhile.
+    """
+    remaining = self.remaining()
+    if(remaining is not None):
+      seconds = min(seconds, remaining)
+    self._cancelled.wait(seconds)
+    self.check()
+
+
+  def cancel(self):
+    "Cancel the call, and close any connection it is blocked on"
+    self._cancelled.set()
+    with self._lock:
+      (conns, children) = (list(self._conns), list(self._children))
+    for conn in conns:
+      sock = getattr(conn, "sock", None)
+      if(sock is not None):
+        try:
+          sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+          pass
+    for child in children:
+      child.cancel()
+
+
+  def attach(self, conn):
+    "Register the connection a call is using, for cancel()"
+    with self._lock:
+      self._conns.add(conn)
+    # a cancel that came first would have found nothing to close
+    if(self.cancelled):
+      self.cancel()
+
+
+  def detach(self, conn):
+    with self._lock:
+      self._conns.discard(conn)
+
+
+  def _add_child(self, child):
+    with self._lock:
+      self._children.append(child)
+    if(self.cancelled):
+      child.cancel()
@@ -0,0 +1,252 @@
+"""
+Export the stored hits of a search for analysis outside PyMOL.
+
+Hits are streamed from the cache a batch at a time, so a result set of
+any size is written in constant memory:
+
+  .csv    one row per hit; DG-errors are |-joined
+  .jsonl  one JSON object per hit, optionally with its coordinates
+  .npz    NumPy arrays: row_no, ovly_key, pdbname, residues, rmsd,
+          n_atoms, intra_dg_errors, inter_dg_errors and coords, shaped
+          (hits, atoms, 3), or (total atoms, 3) when hits have different
+          numbers of atoms; user_fields holds the search's parameters
+
+The search's parameters go in <file>.user_fields.json next to a .csv or
+.jsonl file.  Export the most recent search with
+
+  python -m LoreClient._LoreExport hits.csv
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+import numpy
+
+from _LoreData import Data
+from _LoreSqlite import ResultStoreError, unpack_floats
+from _LoreStats import STATS
+
+
+# the columns of a .csv export, in order
+CSV_COLUMNS = ("row_no", "ovly_key", "pdbname", "residues", "rmsd",
+               "n_atoms", "intra_dg_errors", "inter_dg_errors")
+
+
+def _rounded(blob, digits=4):
+  values = unpack_floats(blob)
+  if(values is None):
+    return None
+  return numpy.round(values.astype(numpy.float64), digits).tolist()
+
+
+def iter_hits(data, user_fields_sha1, coords=False, arraysize=1000):
+  """
+  Each stored hit of a search as a dict of the CSV_COLUMNS, with the
+  DG-errors, and coords if asked for, as lists.
+  """
+  for row in data.overlays.iter_hits(user_fields_sha1, arraysize):
+    hit = dict(zip(CSV_COLUMNS[:6], row[:6]))
+    hit["rmsd"] = None if row[4] is None else round(row[4], 4)
+    hit["intra_dg_errors"] = _rounded(row[6])
+    hit["inter_dg_errors"] = _rounded(row[7])
+    if(coords):
+      xyz = _rounded(row[8], 3)
+      hit["coords"] = (None if xyz is None else
+                       [ xyz[i:i + 3] for i in range(0, len(xyz), 3) ])
+    yield hit
+
+
+def _user_fields(data, user_fields_sha1):
+  for row in data.uf_tbl.iter_records(user_fields_sha1=user_fields_sha1):
+    return dict(zip(row.keys(), row))
+  return {}
+
+
+def _write_user_fields(data, user_fields_sha1, fname):
+  with open(fname + ".user_fields.json", "w") as f:
+    json.dump(_user_fields(data, user_fields_sha1), f, indent=2,
+              sort_keys=True)
+
+
+def export_csv(data, user_fields_sha1, fname, **kwargs):
+  rows = 0
+  with open(fname, "wb") as f:
+    writer = csv.writer(f)
+    writer.writerow(CSV_COLUMNS)
+    for hit in iter_hits(data, user_fields_sha1):
+      for k in ("intra_dg_errors", "inter_dg_errors"):
+        if(hit[k] is not None):
+          hit[k] = "|".join([ "%g" % (v) for v in hit[k] ])
+      writer.writerow([ hit[c] for c in CSV_COLUMNS ])
+      rows += 1
+  _write_user_fields(data, user_fields_sha1, fname)
+  return rows
+
+
+def export_jsonl(data, user_fields_sha1, fname, coords=False, **kwargs):
+  rows = 0
+  with open(fname, "wb") as f:
+    for hit in iter_hits(data, user_fields_sha1, coords=coords):
+      f.write(json.dumps(hit, sort_keys=True, separators=(",", ":")))
+      f.write("\n")
+      rows += 1
+  _write_user_fields(data, user_fields_sha1, fname)
+  return rows
+
+
+def export_npz(data, user_fields_sha1, fname, chunk_rows=10000, **kwargs):
+  """
+  The arrays are filled a chunk of hits at a time into .npy files on
+  disk, which are then copied into the archive, so only one chunk is ever
+  in memory.
+  """
+  sizes = data.overlays.hit_sizes(user_fields_sha1)
+  n = sizes["num_hits"]
+  ragged = sizes["min_atoms"] != sizes["max_atoms"]
+  shapes = [
+    ("row_no", "<i8", (n,)),
+    ("ovly_key", "S%d" % max(1, sizes["ovly_key"]), (n,)),
+    ("pdbname", "S%d" % max(1, sizes["pdbname"]), (n,)),
+    ("residues", "S%d" % max(1, sizes["residues"]), (n,)),
+    ("rmsd", "<f4", (n,)),
+    ("n_atoms", "<i4", (n,)),
+    ("intra_dg_errors", "<f4", (n, sizes["intra_residues"])),
+    ("inter_dg_errors", "<f4", (n, sizes["inter_residues"])),
+    ("coords", "<f4", ((sizes["total_atoms"], 3) if ragged else
+                       (n, sizes["max_atoms"], 3))),
+  ]
+
+  tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(fname)))
+  try:
+    arrays = {}
+    for (name, dtype, shape) in shapes:
+      arrays[name] = numpy.lib.format.open_memmap(
+        os.path.join(tmp_dir, name + ".npy"), mode="w+", dtype=dtype,
+        shape=shape)
+      if(dtype == "<f4"):
+        arrays[name][...] = numpy.nan
+
+    (start, atom_start) = (0, 0)
+    hits = data.overlays.iter_hits(user_fields_sha1, chunk_rows)
+    while(True):
+      chunk = [ row for (i, row) in zip(xrange(chunk_rows), hits) ]
+      if(not chunk):
+        break
+      atom_start = _fill_chunk(arrays, start, atom_start, chunk, ragged)
+      start += len(chunk)
+
+    for a in arrays.values():
+      a.flush()
+    del arrays
+    with zipfile.ZipFile(fname, "w", zipfile.ZIP_STORED,
+                         allowZip64=True) as zf:
+      for (name, dtype, shape) in shapes:
+        zf.write(os.path.join(tmp_dir, name + ".npy"), name + ".npy")
+      user_fields = numpy.array(
+        json.dumps(_user_fields(data, user_fields_sha1), sort_keys=True))
+      path = os.path.join(tmp_dir, "user_fields.npy")
+      numpy.save(path, user_fields)
+      zf.write(path, "user_fields.npy")
+  finally:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+  return n
+
+
+def _fill_chunk(arrays, start, atom_start, chunk, ragged):
+  "Copy one chunk of hit rows into the arrays; returns the next atom row"
+  stop = start + len(chunk)
+  columns = zip(*chunk)
+  for (i, name) in enumerate(("row_no", "ovly_key", "pdbname", "residues")):
+    arrays[name][start:stop] = [ (v or "").encode("utf-8")
+                                 if isinstance(v, basestring) else v
+                                 for v in columns[i] ]
+  arrays["rmsd"][start:stop] = [ numpy.nan if v is None else v
+                                 for v in columns[4] ]
+  arrays["n_atoms"][start:stop] = [ v or 0 for v in columns[5] ]
+  for (i, name) in ((6, "intra_dg_errors"), (7, "inter_dg_errors")):
+    for (j, blob) in enumerate(columns[i]):
+      if(blob is not None):
+        values = unpack_floats(blob)
+        arrays[name][start + j, :len(values)] = values
+  for (j, blob) in enumerate(columns[8]):
+    if(blob is None):
+      continue
+    xyz = unpack_floats(blob, (-1, 3))
+    if(ragged):
+      arrays["coords"][atom_start:atom_start + len(xyz)] = xyz
+    else:
+      arrays["coords"][start + j] = xyz
+    atom_start += len(xyz)
+  return atom_start
+
+
+FORMATS = {
+  ".csv": export_csv,
+  ".jsonl": export_jsonl,
+  ".npz": export_npz,
+}
+
+
+def export(data, fname, user_fields_sha1=None, **kwargs):
+  """
+  Write a search's stored hits to fname, in the format its extension
+  names.
+
+  :param data: the Data cache to read
+  :param user_fields_sha1: the search; the most recent one if None
+  :param kwargs: coords=True adds coordinates to a .jsonl export, and
+                 chunk_rows sets the hits per chunk of a .npz export
+  :returns: a dict of the search, rows written, seconds, rows per second
+            and bytes written
+  """
+  ext = os.path.splitext(fname)[1].lower()
+  if(ext not in FORMATS):
+    raise ValueError("Cannot export to %s; use one of %s" % (
+      fname, ", ".join(sorted(FORMATS))))
+  if(user_fields_sha1 is None):
+    latest = data.result_sets.latest()
+    if(latest is None):
+      raise ResultStoreError("There are no searches to export")
+    user_fields_sha1 = latest["user_fields_sha1"]
+
+  start = time.time()
+  rows = FORMATS[ext](data, user_fields_sha1, fname, **kwargs)
+  elapsed = time.time() - start
+  size = os.path.getsize(fname)
+  STATS.record("io", "export%s" % (ext), elapsed, size=size, rows=rows)
+  return {
+    "user_fields_sha1": user_fields_sha1,
+    "fname": fname,
+    "rows": rows,
+    "seconds": elapsed,
+    "rows_per_s": rows / elapsed if elapsed else 0.0,
+    "bytes": size,
+  }
+
+
+def format_report(report):
+  return "Exported %(rows)d hits to %(fname)s in %(seconds).2f s " \
+         "(%(rows_per_s).0f rows/s, %(bytes)d bytes)" % report
+
+
+def main(args=None):
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+  parser.add_argument("fname", help="the .csv, .jsonl or .npz file to write")
+  parser.add_argument("--search", help="the search's user_fields_sha1")
+  parser.add_argument("--db", help="the sqlite file to read")
+  parser.add_argument("--coords", action="store_true",
+                      help="add coordinates to a .jsonl export")
+  opts = parser.parse_args(args)
+  print format_report(export(Data(opts.db), opts.fname, opts.search,
+                             coords=opts.coords))
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,100 @@
+import numpy
+
+
+# a lower value for any of these can only remove hits
+TOLERANCE_FIELDS = ("intra_tolerance", "inter_tolerance",
+                    "na_intra_tolerance", "na_inter_tolerance", "rmslimit")
+# searches keeping only the best hit per structure or sequence; under
+# tighter limits the server may pick a hit for it that was never stored
+BEST_ONLY_FIELDS = ("best_match_only", "bestsequence")
+# fields that do not change which hits a search returns
+IGNORED_FIELDS = ("user_fields_sha1", "date_created")
+
+
+def residue_is_na(user_fields):
+  """
+  Whether each target residue is a nucleic acid, from the seg_polytypes and
+  seg_lengths returned by define_target; None if the server did not send
+  the segment polytypes.
+  """
+  polytypes = user_fields.get("seg_polytypes")
+  if(not polytypes or len(polytypes) != len(user_fields["seg_lengths"])):
+    return None
+  is_na = []
+  for (polytype, seg_len) in zip(polytypes, user_fields["seg_lengths"]):
+    is_na += [ str(polytype).upper().startswith("N") ] * seg_len
+  return numpy.array(is_na, dtype=bool)
+
+
+def _mask(mask_txt):
+  return numpy.array([ bool(int(m)) for m in mask_txt.split("|") ])
+
+
+def is_tightening(old, new, polytypes_known=True):
+  """
+  True if every hit a search with the parameters new can find is among the
+  hits already found with the parameters old: only tolerances were lowered
+  and residue masks set, and everything else is the same.  Without the
+  residue polytypes, a residue's DG-errors cannot be checked against the
+  right tolerance, so only the rmslimit may change.  Clearing a mask
+  loosens a search, and so does tightening one that keeps only the best
+  hit per structure or sequence (best_match_only or bestsequence): the
+  best hit left may be one that was never stored.
+
+  :param old: the stored user_fields row of a cached search
+  :param new: the same fields for the search about to be made
+  """
+  for field in BEST_ONLY_FIELDS:
+    if(old.get(field) or new.get(field)):
+      return False
+  for field in set(old.keys()) | set(new.keys()):
+    if(field in IGNORED_FIELDS):
+      continue
+    (old_value, new_value) = (old.get(field), new.get(field))
+    if(field in TOLERANCE_FIELDS):
+      if(float(new_value) > float(old_value)):
+        return False
+      if(not polytypes_known and field != "rmslimit" and
+         float(new_value) != float(old_value)):
+        return False
+    elif(field == "mask"):
+      (old_mask, new_mask) = (_mask(old_value), _mask(new_value))
+      # clearing a mask stops checking that residue's DG-errors
+      if(len(old_mask) != len(new_mask) or (old_mask & ~new_mask).any()):
+        return False
+      if(not polytypes_known and (old_mask != new_mask).any()):
+        return False
+    elif(old_value != new_value):
+      return False
+  return True
+
+
+def refilter(arrays, params, is_na=None):
+  """
+  Apply tighter parameters to the hits of a cached search.
+
+  :param arrays: the result columns from OverlaysTable.load_arrays
+  :param params: the new search parameters
+  :param is_na: per residue nucleic acid flags, see residue_is_na; without
+                them only the rmslimit is applied, which is all is_tightening
+                allows to change in that case
+  :returns: a boolean array selecting the hits that pass
+  :raises ValueError: if the hits do not have one DG-error per residue
+  """
+  # the stored values are float32, so compare against float32 limits
+  keep = arrays["rmsd"] <= numpy.float32(params["rmslimit"])
+  mask = _mask(params["mask"])
+  if(is_na is None or not mask.any()):
+    return keep
+
+  intra_tol = numpy.where(is_na, params["na_intra_tolerance"],
+                          params["intra_tolerance"]).astype("<f4")[mask]
+  inter_tol = numpy.where(is_na, params["na_inter_tolerance"],
+                          params["inter_tolerance"]).astype("<f4")[mask]
+  for name in ("intra_dg_errors", "inter_dg_errors"):
+    if(arrays[name] is None or arrays[name].shape != (len(keep), len(mask))):
+      raise ValueError("The stored %s are not one per target residue" % (
+        name))
+  keep &= (arrays["intra_dg_errors"][:, mask] <= intra_tol).all(axis=1)
+  keep &= (arrays["inter_dg_errors"][:, mask] <= inter_tol).all(axis=1)
+  return keep
@@ -0,0 +1,1346 @@
+"""
+The plugin's Tk client.  LorePlugin.py imports this on first use, so
+nothing here is loaded while PyMOL starts up.
+"""
+import os
+import collections
+import time
+import Tkinter
+import ttk
+import tkFileDialog
+import tkMessageBox
+
+import jsonrpclib
+from _LoreAsync import RpcPool
+from _LoreCore import Client, SearchParams
+from _LoreDeadline import RpcCancelled, RpcTimeout
+from _LoreExport import format_report
+from _LoreStats import STATS
+from _LoreStructures import StructureLoader
+from _LoreSuperpose import overlay, residue_selection, target_coords
+
+
+# the open Controllers, most recent last, for the lore_stats command
+_controllers = []
+
+
+def stats_command(action="show"):
+  "The lore_stats PyMOL command; see LorePlugin.lore_stats"
+  action = action.strip().lower()
+  if(action == "show"):
+    print STATS.report()
+  elif(action == "reset"):
+    STATS.reset()
+  elif(action in ("on", "off")):
+    STATS.enabled = (action == "on")
+  elif(action in ("save", "profile")):
+    if(not _controllers):
+      print "lore_stats: the Lore plugin is not open"
+    elif(action == "save"):
+      client = _controllers[-1].client
+      client.save_stats()
+      print "lore_stats: saved to %s" % (client.data.fname)
+    else:
+      _controllers[-1].profile_next = True
+      print "lore_stats: the next action will be profiled"
+  else:
+    print "lore_stats: unknown action %s" % (action)
+
+
+class LoreException(Exception):
+
+  def __init__(self, msg=""):
+    self.args = (msg,)
+
+  def __str__(self):
+    return " ".join(self.args)
+
+
+def _jsonrpc_exception_dialog(E=None):
+  if(not E): 
+    return
+  title = "%s.%s: %s" % (
+    E.__class__.__module__, E.__class__.__name__, E.args[0])
+  if(len(E.args) > 2):
+    msg = E.args[2].replace("|", os.linesep)
+  elif(len(E.args) == 2):
+    msg = "%s: A server error has occured" % (E.args[1])
+  else:
+    msg = "A server error has occured"
+  tkMessageBox.showerror(title=title, message=msg)
+
+
+def form_search_params(values):
+  """
+  SearchParams from the Adjust Target page: the text of its entries, the
+  residue filters as ResidueEditor.values gives them and the subset picked
+  to search.
+  """
+  residues = values["residues"].split("|")
+  num_segs = values["num_segs"]
+  floats = [ "intra_tolerance", "inter_tolerance", "na_intra_tolerance",
+             "na_inter_tolerance", "rmslimit" ]
+  kwargs = dict([ (v, values[v]) for v in floats ])
+  for k in ["best_match_only", "bestsequence", "ignore_seg_pattern"]:
+    kwargs[k] = (values.get(k, 0) == 1)
+  for v in ["probe_pdblist", "superposition_atoms", "na_superposition_atoms"]:
+    kwargs[v] = values.get(v, "").split()
+  # the combobox shows All for every subset
+  subset = values.get("searchabletablename", "").strip()
+  kwargs["searchabletablename"] = "" if subset == "All" else subset
+  return SearchParams(
+    fixed_fields_sha1=values["fixed_fields_sha1"],
+    mask=[ int(values.get(r + "_mask", 1)) for r in residues ],
+    acceptable_residues=[ values[r + "_filter"] for r in residues ],
+    seg_pattern=[ values["seg_pattern_%d" % (i)] for i in range(num_segs) ],
+    seg_joins=[ values.get("seg_%d_joins_prev" % (i), 0) == 1
+                for i in range(num_segs) ],
+    **kwargs)
+
+
+class AutoScrollbar(ttk.Scrollbar):
+  """An updated version of Fredrik Lundh's autohiding scrollbar 
+  (http://effbot.org/zone/tkinter-autoscrollbar.htm)
+  """
+
+  def __init__(self, master=None, grid_row=0, grid_column=0, sticky="", **kw):
+    ttk.Scrollbar.__init__(self, master, **kw)
+    self.grid_kw = { "row": grid_row, "column": grid_column, "sticky": sticky }
+
+  def set(self, low, high):
+    if(float(low) <= 0.0 and float(high) >= 1.0):
+      self.grid_forget()
+    else:
+      self.grid(**self.grid_kw)
+    ttk.Scrollbar.set(self, low, high)
+
+  def pack(self, **kw):
+    raise Tkinter.TclError("Cannot use pack with this widget")
+
+  def place(self, **kw):
+    raise Tkinter.TclError("Cannot use place with this widget")
+
+
+class ScrollingFrame(Tkinter.Canvas):
+  """Setup a frame with autoscrollbars
+  
+  :param master: the master widget for the canvas
+  :param xscroll: If true, put in a horizontal autoscrollbar 
+  :param yscroll: If true, put in a vertical autoscrollbar
+  :param label: If true, use a Labelframe instead of Frame
+  :param style: If true, use to style the frame
+  :param kw: keywords to pass to ttk.Canvas
+  """
+
+  def __init__(self, master=None, xscroll=False, yscroll=False, 
+               label="", style="", **kw):
+    Tkinter.Canvas.__init__(self, master, **kw)
+    scrollbars = {
+      "v": AutoScrollbar(master, grid_row=0, grid_column=1, sticky="ns"),
+      "h": AutoScrollbar(master, grid_row=1, grid_column=0, sticky="ew"),
+    }
+    scrollbars["h"].config(orient=Tkinter.HORIZONTAL)
+
+    print "(x,y) scroll:", xscroll, yscroll
+    if(xscroll):
+      self.config(xscrollcommand=scrollbars["h"].set)
+      scrollbars["h"].config(command=self.xview)
+    if(yscroll):
+      self.config(yscrollcommand=scrollbars["v"].set)
+      scrollbars["v"].config(command=self.yview)
+
+    # make the canvas expandable
+    master.grid_rowconfigure(0, weight=1)
+    master.grid_columnconfigure(0, weight=1)
+
+    # Create a frame for the contents
+    if(label):
+      self.frame = ttk.Labelframe(self, text=label, style=style)
+    else:
+      self.frame = ttk.Frame(self, style=style)
+    self.frame.rowconfigure(0, weight=1)
+    self.frame.columnconfigure(0, weight=1)
+
+    # Anchor the frame to the NW corner of the canvas
+    self.create_window(0, 0, anchor="nw", window=self.frame)
+
+  def update_scroll(self):
+    "Need to update idletasks and bbox after gridding widgets into the frame"
+    self.update_idletasks()
+    self.config(scrollregion=self.bbox("all"))
+
+
+class Controller(object):
+  """
+  The plugin's window over a Client.  The Client's methods block, so they
+  are run on a worker pool and their results handled on the Tk thread.
+  """
+  _poll_ms = 50
+  _num_rpc_workers = 4
+  
+  def __init__(self, app, 
+               LoreURL="http://drugsite-dev.msi.umn.edu/mmLore/jsonrpc",
+               started=None):
+    """
+    :param started: when the user asked for the window, for timing how long
+                    it took to appear; defaults to now
+    """
+    self.LoreURL = LoreURL
+    self._started = started if started is not None else time.time()
+    (self._client, self._rpc, self._loader) = (None, None, None)
+    self._busy = 0
+    # the calls in flight that the Cancel buttons stop
+    self._cancellable = set()
+    # the target and search on display, for overlaying hits
+    (self.target, self.result) = (None, None)
+    self.profile_next = False
+    # the calls submitted by the action being profiled, and those of them
+    # still running
+    (self._profiling, self._profiled) = (None, set())
+    self.app = app
+    self.window = MainWindow(
+      app.root, searchable=lambda: self.client.searchable_records())
+    self.window.protocol("WM_DELETE_WINDOW", self.on_close)
+    self.window.notebook.on_page_built = self.on_page_built
+    self.window.notebook.page("Define Target")
+    _controllers.append(self)
+    # the cache and the server are only needed once the window is up
+    self.window.after_idle(self._on_window_shown)
+
+
+  @property
+  def client(self):
+    "The Client, made on first use"
+    if(self._client is None):
+      self._client = Client(self.LoreURL, max_idle=self._num_rpc_workers)
+    return self._client
+
+
+  @property
+  def rpc(self):
+    "The pool running the Client's methods, started on first use"
+    if(self._rpc is None):
+      # the Client is safe to share, so every worker gets the same one
+      self._rpc = RpcPool(lambda: self.client,
+                          num_workers=self._num_rpc_workers, category="core",
+                          timeouts=self.client.pool_timeouts())
+      self._poll_rpc()
+    return self._rpc
+
+
+  @property
+  def loader(self):
+    "The structure loader, made on first use; polled with the rpc pool"
+    if(self._loader is None):
+      self._loader = StructureLoader(num_workers=self._num_rpc_workers)
+      self.rpc
+    return self._loader
+
+
+  def _on_window_shown(self):
+    STATS.record("ui", "time_to_first_window", time.time() - self._started)
+    self.update_searchable_subsets()
+
+
+  def on_page_built(self, tag, page):
+    "Hook up a notebook page the first time it is shown"
+    if(tag == "Define Target"):
+      page.set_on_define_button_pushed_cb(
+        self.on_define_structure_button_pushed)
+      page.set_on_cancel_button_pushed_cb(self.on_cancel_button_pushed)
+    elif(tag == "Adjust Target"):
+      page.set_on_search_button_pushed_cb(self.on_search_button_pushed)
+      page.set_on_cancel_button_pushed_cb(self.on_cancel_button_pushed)
+    elif(tag == "Search Results"):
+      page.set_on_load_button_pushed_cb(self.on_load_button_pushed)
+      page.set_on_overlay_button_pushed_cb(self.on_overlay_button_pushed)
+      page.set_on_export_button_pushed_cb(self.on_export_button_pushed)
+    page.set_busy(self._busy > 0)
+
+
+  def on_close(self):
+    if(self in _controllers):
+      _controllers.remove(self)
+    if(self._rpc is not None):
+      self._rpc.shutdown()
+    if(self._loader is not None):
+      self._loader.close()
+    if(self._client is not None):
+      # keep this session's numbers so a slow session can be looked at later
+      self._client.save_stats()
+      self._client.close()
+    self.window.destroy()
+
+
+  def _poll_rpc(self):
+    "Deliver finished calls on the Tk thread, then check again later"
+    try:
+      self._rpc.poll()
+      if(self._loader is not None):
+        self._loader.poll()
+    finally:
+      if(self.window.winfo_exists()):
+        self.window.after(self._poll_ms, self._poll_rpc)
+
+
+  def set_busy(self, busy=True):
+    """
+    Disable the action buttons while a user initiated call is in flight.
+    Calls may overlap, so only the last one to finish re-enables them.
+    """
+    self._busy = max(0, self._busy + (1 if busy else -1))
+    for page in self.window.notebook.pages.values():
+      page.set_busy(self._busy > 0)
+    self.window.configure(cursor="watch" if self._busy else "")
+
+
+  def _submit(self, method, on_result, busy=True, cancellable=False,
+              **kwargs):
+    """
+    Run a Client method on the worker pool.  on_result(result) is called
+    on the Tk thread once the call succeeds; errors are shown in a dialog.
+
+    :param cancellable: let the Cancel buttons stop the call
+    """
+    if(busy):
+      self.set_busy(True)
+    if(self._profiling is not None):
+      future = self.rpc.profile(method, **kwargs)
+      self._profiling.append(future)
+    else:
+      future = self.rpc.submit(method, **kwargs)
+    if(cancellable):
+      self._cancellable.add(future)
+    future.add_done_callback(
+      lambda f, cb=on_result, b=busy: self._on_rpc_done(f, cb, b))
+    return future
+
+
+  def cancel_calls(self):
+    "Stop the cancellable calls in flight; each is delivered as cancelled"
+    for future in list(self._cancellable):
+      future.cancel()
+
+
+  def _on_rpc_done(self, future, on_result, busy):
+    self._cancellable.discard(future)
+    if(busy):
+      self.set_busy(False)
+    if(future in self._profiled):
+      self._profiled.discard(future)
+      if(not self._profiled):
+        print STATS.last_profile
+    try:
+      result = future.result()
+    except RpcCancelled as E:
+      print "Lore: %s" % (E)
+    except RpcTimeout as E:
+      tkMessageBox.showerror(title="Timed out", message="%s" % (E))
+    except jsonrpclib.jsonrpc.ProtocolError as E:
+      _jsonrpc_exception_dialog(E)
+    except Exception as E:
+      tkMessageBox.showerror(
+        title="Error", message="; ".join([ "%s" % (s) for s in E.args ]))
+      # easier to debug during development if we raise the exception
+      raise
+    else:
+      on_result(result)
+
+
+  def on_define_structure_button_pushed(self, *args, **kwargs):
+    self._run_action(self.define_target_substructure, kwargs)
+
+
+  def on_search_button_pushed(self, *args, **kwargs):
+    self._run_action(self.do_search, kwargs)
+
+
+  def on_cancel_button_pushed(self, *args, **kwargs):
+    self._run_action(self.cancel_calls, {})
+
+
+  def on_load_button_pushed(self, *args, **kwargs):
+    self._run_action(self.load_structures, kwargs)
+
+
+  def on_overlay_button_pushed(self, *args, **kwargs):
+    self._run_action(self.overlay_hits, kwargs)
+
+
+  def on_export_button_pushed(self, *args, **kwargs):
+    self._run_action(self.export_results, kwargs)
+
+
+  def _run_action(self, action, kwargs):
+    """
+    Run a button's action with the values of its page's variables and
+    any plain values it passed, timed
+    in STATS and profiled if lore_stats profile asked for it.
+    """
+    vars = dict([ (k, v.get()) for k,v in kwargs.get("vars", {}).iteritems() ])
+    vars.update(kwargs.get("values", {}))
+    try:
+      with STATS.timer("ui", action.__name__):
+        if(self.profile_next):
+          self.profile_next = False
+          self._profile_action(action, vars)
+        else:
+          action(**vars)
+    except Exception as E:
+      tkMessageBox.showerror(
+        title="Error", message="; ".join([ "%s" % (s) for s in E.args ]))
+      # easier to debug during development if we raise the exception
+      raise
+
+
+  def _profile_action(self, action, vars):
+    """
+    Profile an action and the Client calls it submits, on the workers that
+    run them; the merged report is printed once the last of them is done.
+    """
+    STATS.start_profile()
+    self._profiling = []
+    try:
+      STATS.profile(action, **vars)
+    finally:
+      (futures, self._profiling) = (self._profiling, None)
+    self._profiled.update([ f for f in futures if not f.done() ])
+    if(not self._profiled):
+      print STATS.last_profile
+
+
+  def define_target_substructure(self, **kwargs):
+    pymol_selection = kwargs.get("pymol_selection", "")
+    target_pdbname = kwargs.get("target_pdbname", "")
+    residue_txt = kwargs.get("residue_txt", "")
+
+    if(pymol_selection):
+      # PyMOL is asked on the Tk thread, not on a worker
+      target = self.client.convert_selection(pymol_selection)
+      (target_pdbname, residue_txt) = (
+        target["pdbname"], target["residue_txt"])
+      if(target["skipped"]):
+        tkMessageBox.showwarning(
+          title="Warning", message="Skipped %d residues that are neither "
+          "amino nor nucleic acids: %s" % (len(target["skipped"]), " ".join(
+            [ "%s:%s%s" % r for r in target["skipped"][:10] ])))
+    elif(not target_pdbname and not residue_txt):
+      msg = "You must provide either a PyMOL selection or a DrugSite"
+      raise LoreException(msg + " selection")
+
+    target = self.client.cached_target(
+      target_pdbname, residue_txt, pymol_selection)
+    if(target is not None):
+      self.on_target_defined(target)
+      return None
+    return self._submit("define_target", self.on_target_defined,
+                        cancellable=True, pdbname=target_pdbname,
+                        residue_txt=residue_txt,
+                        pymol_selection=pymol_selection)
+
+
+  def on_target_defined(self, target):
+    self.target = target
+    my_page = self.window.notebook.page("Adjust Target")
+    self.set_adjust_target_entries(
+      target.pymol_selection, target.pdbname, target.residue_txt)
+    self.update_adjust_target_match_filters(my_page, target.user_fields)
+    self.update_adjust_target_match_params(my_page, target.user_fields)
+    my_page.update_residue_filters_frame(target.user_fields)
+    my_page.update_scroll()
+    self.window.notebook.show("Adjust Target")
+
+
+  def do_search(self, **kwargs):
+    # bad input is reported here, before anything is sent
+    params = form_search_params(kwargs)
+    return self._submit("search", self.show_results, cancellable=True,
+                        params=params)
+
+
+  def show_results(self, result):
+    self.result = result
+    # pages are fetched while the user reads, so they must not block the GUI
+    submit = lambda method, on_result, **kw: self._submit(
+      method, on_result, busy=False, **kw)
+    pager = self.client.pager(result, submit)
+    self.window.notebook.page("Search Results").show(pager)
+    self.window.notebook.show("Search Results")
+
+
+  def _load_then(self, pdbnames, prefix, on_done):
+    """
+    Load structures into PyMOL, downloading the uncached ones, and call
+    on_done() once all of them are loaded or have failed.
+    """
+    loading = [True]
+    def on_loaded(pdbname, name, error):
+      if(error is not None):
+        print "Could not load %s: %s" % (pdbname, error)
+      if(not loading[0] and not self.loader.pending):
+        on_done()
+    self.loader.load(pdbnames, prefix, on_loaded)
+    loading[0] = False
+    if(not self.loader.pending):
+      on_done()
+
+
+  def load_structures(self, pdbnames=(), row_nos=()):
+    "Load the hits' structures into PyMOL"
+    self._load_then(pdbnames, "", self.print_structure_report)
+
+
+  def print_structure_report(self):
+    report = self.loader.report()
+    print ("Structures: %(hits)d cached, %(misses)d downloaded, "
+           "%(hit_rate).0f%% hit rate, %(bytes_saved)d bytes saved" %
+           dict(report, hit_rate=100 * report["hit_rate"]))
+
+
+  def overlay_hits(self, pdbnames=(), row_nos=()):
+    """
+    Superimpose hits on the target: each hit's matched residues become an
+    object lore_hit_<row>, all of them moved in one batch.
+
+    :param row_nos: the rows of the hits; every stored hit if empty
+    """
+    (target, result) = (self.target, self.result)
+    if(target is None or not target.pymol_selection or result is None):
+      raise LoreException("Overlaying hits needs a search on a target "
+                          "defined from a PyMOL selection")
+    arrays = self.client.result_arrays(result.user_fields_sha1)
+    if(arrays["coords"] is None):
+      raise LoreException("Not every stored hit has its matched-atom "
+                          "coordinates")
+    wanted = set([ int(r) for r in row_nos ])
+    idx = [ i for (i, r) in enumerate(arrays["row_no"])
+            if not wanted or r in wanted ]
+    self._load_then([ arrays["pdbname"][i] for i in idx ], "_lore_",
+                    lambda: self._overlay(target, arrays, idx))
+
+
+  def _overlay(self, target, arrays, idx):
+    cmd = self.loader.cmd
+    with STATS.timer("ui", "overlay_hits"):
+      target_xyz = target_coords(cmd, target.pymol_selection,
+                                 target.user_fields)
+      # ragged hits come back flat, one row per atom
+      if(arrays["coords"].ndim != 3):
+        raise LoreException("The hits have different numbers of matched "
+                            "atoms, so they cannot be overlaid on the target")
+      if(arrays["coords"].shape[1:] != (len(target_xyz), 3)):
+        raise LoreException(
+          "The hits have %d matched atoms each, but the target has %d "
+          "superposition atoms" % (arrays["coords"].shape[1],
+                                   len(target_xyz)))
+      (objects, kept) = ([], [])
+      for i in idx:
+        base = "_lore_%s" % (arrays["pdbname"][i])
+        if(not cmd.count_atoms(base)):
+          continue
+        name = "lore_hit_%d" % (arrays["row_no"][i] + 1)
+        cmd.create(name, "%s and %s" % (
+          base, residue_selection(arrays["residues"][i].split("|"))))
+        objects.append(name)
+        kept.append(i)
+      if(not kept):
+        return
+      result = overlay(cmd, objects, arrays["coords"][kept], target_xyz,
+                       reported=arrays["rmsd"][kept])
+    print ("Overlaid %d hits; the RMSDs found here differ from the "
+           "server's by up to %.3f A, %d of them by more than 0.01 A" % (
+             len(kept), result["max_error"], len(result["mismatched"])))
+
+
+  def export_results(self, fname):
+    "Write the current search's hits to a file in the background"
+    if(self.result is None):
+      raise LoreException("There is no search to export")
+    return self._submit("export", self.print_export_report, busy=False,
+                        fname=fname,
+                        user_fields_sha1=self.result.user_fields_sha1)
+
+
+  def print_export_report(self, report):
+    print format_report(report)
+
+
+  def set_adjust_target_entries(self, pymol_selection, target_pdbname,
+                                residue_txt):
+    self.window.notebook.page("Adjust Target").target_def.update(
+      pymol_selection, target_pdbname, residue_txt)
+
+
+  def update_adjust_target_search_types(self, page, user_fields):
+    pass
+
+
+  def update_adjust_target_match_filters(self, page, user_fields):
+    for k in ["bestsequence", "best_match_only"]:
+      page.vars[k].set(user_fields[k])
+
+
+  def update_adjust_target_match_params(self, page, user_fields):
+    var_names = [
+      "superposition_atoms", "na_superposition_atoms", "intra_tolerance", 
+      "inter_tolerance", "na_intra_tolerance", "na_inter_tolerance",
+      "rmslimit",
+    ]
+    for k in var_names:
+      page.vars[k].set(" ".join(str(user_fields[k]).split("|")))
+
+
+  def update_searchable_subsets(self):
+    "Refresh the searchable subsets in the background"
+    return self._submit("refresh_searchable", self.on_searchable_subsets,
+                        busy=False)
+
+
+  def on_searchable_subsets(self, records):
+    # a page that is not built yet reads the subsets when it is
+    my_page = self.window.notebook.pages.get("Adjust Target")
+    if(records is not None and my_page is not None):
+      my_page.update_searchable(records)
+
+
+class MainWindow(Tkinter.Toplevel):
+  _Toplevel_kw = {
+    "borderwidth": "2",
+  }
+  _title = "Lore Substructure Searching"
+  _geometry = "600x480+200+200"
+
+  def __init__(self, master, cnf={}, **kw):
+    # a callable giving the searchable subsets, read when a page needs them
+    self.searchable = kw.pop("searchable")
+    for k,v in self._Toplevel_kw.iteritems():
+      if(not k in kw):
+        kw[k] = v
+       
+    Tkinter.Toplevel.__init__(self, master, cnf=cnf, **kw)
+    self.title(self._title)
+    self.geometry(self._geometry)
+    self.notebook = Notebook(self)
+    self.notebook.grid(row=0, column=0, sticky="news")
+    ttk.Sizegrip(self).grid(row=1, column=1, sticky=("S","E"))
+
+
+class TabFrame(ttk.Frame):
+  _padding = (7,7)
+
+  def __init__(self, master=None, **kw):
+    ttk.Frame.__init__(self, master=master, **kw)
+    self["padding"] = self._padding
+
+    master.grid_rowconfigure(0, weight=1)
+    master.grid_columnconfigure(0, weight=1)
+
+    self._scrolling_frame = ScrollingFrame(self, yscroll=True)
+    self._scrolling_frame.grid(row=0, column=0, sticky="news")
+    self.inner_frame = self._scrolling_frame.frame
+    # buttons that start a server call; disabled while the client is busy
+    self.action_buttons = []
+    # buttons that stop one; enabled only while the client is busy
+    self.cancel_buttons = []
+
+  def update_scroll(self):
+    with STATS.timer("ui", "update_scroll"):
+      self._scrolling_frame.update_scroll()
+
+  def set_busy(self, busy=True):
+    for button in self.action_buttons:
+      button.state(["disabled"] if busy else ["!disabled"])
+    for button in self.cancel_buttons:
+      button.state(["!disabled"] if busy else ["disabled"])
+
+  def add_cancel_button(self, **grid):
+    button = ttk.Button(self.inner_frame, text="Cancel")
+    button.grid(**grid)
+    button.state(["disabled"])
+    self.cancel_buttons.append(button)
+    return button
+
+  def set_on_cancel_button_pushed_cb(self, cb):
+    for button in self.cancel_buttons:
+      button.configure(command=lambda s=self: cb(widget=s))
+
+#  def __init__(self, master=None, xscroll=False, yscroll=False, 
+#               label="", style="", **kw):
+
+
+#    ScrollingFrame.__init__(self, master, yscroll=True, **kw)
+#    self.frame["padding"] = self._padding
+#    #self.grid(row=0, column=0, padx=10, pady=10, sticky="nesw")
+#    #self.grid(row=0, column=0, padx=10, pady=10, sticky="ne")
+#    #self.update_scroll()
+
+#    #vscroll = ttk.Scrollbar(master, orient="VERTICAL", command=self.yview)
+#    vscroll = ttk.Scrollbar(master, orient=Tkinter.VERTICAL)
+#    vscroll.grid(row=0, column=1, sticky=("N","S"))
+#    self["yscrollcommand"] = vscroll.set
+#    master.grid_columnconfigure(0, weight=1)
+#    master.grid_rowconfigure(0, weight=1)
+
+
+  def Labelcheckbutton(self, master, label="", varname="", val=False):
+    my_label = ttk.Label(master, text=label)
+    self.vars[varname] = Tkinter.BooleanVar()
+    self.vars[varname].set(val)
+    vartxt = "On"
+    if(val is False):
+      vartxt = "Off"
+    self.xboxes[varname] = ttk.Checkbutton(
+      master, variable=self.vars[varname], text=vartxt,
+      command=lambda var=varname: self._xbox_cb(var))
+    return (my_label, self.xboxes[varname])
+
+
+  def Entry(self, master, varname="", val="", width=20):
+    self.vars[varname] = Tkinter.StringVar()
+    self.vars[varname].set(val)
+    return ttk.Entry(master, textvariable=self.vars[varname], width=width)
+
+
+  def Labelentry(self, master, varname="", val="", width=20, label=""):
+    entry = self.Entry(master, varname, val, width)
+    return (ttk.Label(master, text=label), entry)
+
+
+  def _xbox_cb(self, box_name):
+    if(self.vars[box_name].get()):
+      self.xboxes[box_name].configure(text="On")
+    else:
+      self.xboxes[box_name].configure(text="Off")
+
+
+
+
+class DefineFrame(TabFrame):
+  __entry_field_labels = {
+    "pymol_selection": "PyMOL Selection:",
+    "target_pdbname": "Lore PDB Name:",
+    "residue_txt": "Lore Target Residues:",
+  }
+  __pymol_selection_txt = """
+Use a PyMOL selection to
+define a target substructure
+"""
+  __lore_selection_txt = """
+Use a DrugSite selection to
+define a target substructure
+"""
+  __balloons_text = {
+    "pymol_selection": __pymol_selection_txt,
+    "target_pdbname": __lore_selection_txt,
+  }
+
+  def __init__(self, master=None, **kw):
+    TabFrame.__init__(self, master=master, **kw)
+
+    self.vars = {}
+    rowno=0
+    for (k, v) in self.__entry_field_labels.iteritems():
+      (my_label, my_entry) = self.Labelentry(
+        self.inner_frame, varname=k, label=v)
+      my_label.grid(row=rowno, column=0, sticky="w", padx=2, pady=2)
+      my_entry.grid(row=rowno, column=1, padx=2, pady=2, sticky="we")
+      rowno += 1
+    self.define_button = ttk.Button(self.inner_frame, text="Define Target")
+    self.define_button.grid(row=rowno, column=1, padx=5, pady=5)
+    self.action_buttons.append(self.define_button)
+    self.add_cancel_button(row=rowno + 1, column=1, padx=5, pady=5)
+    self.inner_frame.columnconfigure(1, weight=1)
+
+
+  def set_on_define_button_pushed_cb(self, cb):
+    self.define_button.configure(
+      command=lambda s=self: cb(widget=s, vars=s.vars))
+
+
+class AdjustFrame(TabFrame):
+
+  def __init__(self, master=None, **kw):
+    self.searchable = master.searchable()
+    TabFrame.__init__(self, master=master, **kw)
+    self.vars = {}
+  
+    self.target_def = DisplayTargetDef(
+      self.inner_frame, text="Target Substructure Definition")
+    search_types = self._setup_search_types_frame()
+    filter_types = self._setup_filter_types_frame()
+
+#    self.panes = ttk.Panedwindow(self.inner_frame, orient=Tkinter.VERTICAL)
+    match_params = self._setup_match_parameters_frame()
+    self.residue_filters = self._setup_residue_filters_frame()
+#    self.panes.add(match_params)
+#    self.panes.add(self.residue_filters)
+    self.search_button = ttk.Button(self.inner_frame, text="Search")
+    self.action_buttons.append(self.search_button)
+
+    self.target_def.grid(row=0, column=0, padx=5, pady=5, sticky="W")
+    search_types.grid(row=1, column=0, padx=5, pady=5, sticky="W")
+    filter_types.grid(row=2, column=0, padx=5, pady=5, sticky="W")
+    match_params.grid(row=3, column=0, padx=5, pady=5, sticky="W")
+    self.residue_filters.grid(row=4, column=0, padx=5, pady=5, sticky="W")
+
+#    self.panes.grid(row=3, column=0, padx=5, pady=5, sticky="W")
+
+    self.search_button.grid(row=5, column=0, padx=5, pady=5, sticky="W")
+    self.add_cancel_button(row=6, column=0, padx=5, pady=5, sticky="W")
+
+
+  def _setup_search_types_frame(self):
+    frame = ttk.Labelframe(self.inner_frame, text="Search Types")
+    frame["padding"] = (5,5)
+
+    labs = [ ttk.Label(frame, text="List of Lore Structure Names:") ]
+    labs.append( ttk.Label(frame, text="Lore Structures Subset:") )
+
+    self.vars["probe_pdblist"] = Tkinter.StringVar()
+    self.vars["searchabletablename"] = Tkinter.StringVar()
+
+    entries = [ ttk.Entry(frame, textvariable=self.vars["probe_pdblist"]) ]
+    entries[0].configure(width=30)
+    entries.append( 
+      ttk.Combobox(frame, textvariable=self.vars["searchabletablename"]) )
+    self.searchable_combobox = entries[1]
+    #tmp = [ row["name"] for row in self.searchable ]
+    entries[1]["values"] = [ row["name"] for row in self.searchable ]
+    self.vars["searchabletablename"].set("All")
+    print entries[1].configure()
+
+    #print tmp
+
+    for i in range(2):
+      labs[i].grid(row=i, column=0, padx=2, pady=2, sticky="w")
+      entries[i].grid(row=i, column=1, padx=2, pady=2, sticky="w")
+
+    return frame
+
+
+  def update_searchable(self, searchable):
+    "Swap in a new list of searchable subsets without rebuilding the frame"
+    self.searchable = searchable
+    self.searchable_combobox["values"] = [ row["name"] for row in searchable ]
+
+
+  def _setup_match_parameters_frame(self):
+    var_names = [
+      "superposition_atoms", "na_superposition_atoms",
+      "intra_tolerance", "inter_tolerance",
+      "na_intra_tolerance", "na_inter_tolerance",
+      "rmslimit",
+    ]
+    labels = [
+      "AA Superposition Atoms:", "NA Superposition Atoms:",
+      "AA Intra Tolerance:", "AA Inter Tolerance:",
+      "NA Intra Tolerance:", "NA Inter Tolerance:",
+      "RMSD Tolerance:",
+    ]
+    desc = [
+      "Atoms used to superimpose matched amino acids",
+      "Atoms used to superimpose matched nucleic acids",
+      "Maximum DG-error allowed within a bonded amino acid segment",
+      "Maximum DG-error allowed between two bonded amino acid segments",
+      "Maximum DG-error allowed within a bonded nucleic acid segment",
+      "Maximum DG-error allowed between two bonded nucleic acid segments",
+      "Maximum RMSD allowed for superposition of all matched atoms",
+    ]  
+
+    return self._setup_match_params("Match Parameters", labels, var_names, desc)
+
+
+  def _setup_match_params(self, frame_label, labels, var_names, desc, 
+                          padding=(5,5)):
+    frame = ttk.Labelframe(self.inner_frame, text=frame_label)
+    frame["padding"] = padding
+
+    for i in range(len(labels)):
+      my_row = self.Labelentry(
+        frame, varname=var_names[i], label=labels[i], width=30)
+      my_row += (ttk.Label(frame, text=desc[i]),)
+
+      for j,el in enumerate(my_row):
+        el.grid(row=i, column=j, padx=2, pady=2, sticky='W')
+
+    return frame
+
+
+  def update_residue_filters_frame(self, user_fields):
+    "The residue filters will change if target changes..."
+    with STATS.timer("ui", "update_residue_filters_frame"):
+      self.vars["fixed_fields_sha1"].set(user_fields["fixed_fields_sha1"])
+      self.vars["ignore_seg_pattern"].set(user_fields["ignore_seg_pattern"])
+      self._xbox_cb("ignore_seg_pattern")
+      self.residue_editor.show_target(user_fields)
+
+
+  def _setup_residue_filters_frame(self, padding=(5,5)):
+    frame = ttk.Labelframe(self.inner_frame, text="Residue Filters")
+    frame["padding"] = padding
+
+    self.vars["fixed_fields_sha1"] = Tkinter.StringVar()
+    #ignore segment pattern
+    (my_label, my_box) = self.Labelcheckbutton(
+      frame, label="Ignore Segment Pattern", varname="ignore_seg_pattern")
+    my_label.grid(row=0, column=0, padx=5, pady=2, sticky="W")
+    my_box.grid(row=0, column=1, padx=5, pady=2, sticky="W")
+
+    self.residue_editor = ResidueEditor(frame)
+    self.residue_editor.grid(row=1, column=0, columnspan=2, padx=2, pady=3,
+                             sticky="news")
+    return frame
+
+
+  def _setup_filter_types_frame(self):
+    frame = ttk.Labelframe(self.inner_frame, text="Match Filters")
+    frame["padding"] = (5,5)
+
+    txt = [
+      ["bestsequence", "Best Sequence:", "Keep best match for each sequence"],
+      ["best_match_only", "Best Match:", 
+       "Keep best match for each library structure"],
+    ]
+    self.xboxes = {}
+    for (rowno, txt_tuple) in enumerate(txt):
+      (row_label, row_box) = self.Labelcheckbutton(
+        frame, label=txt_tuple[1], varname=txt_tuple[0])
+      row_desc = ttk.Label(frame, text=txt_tuple[2])
+      
+      row_label.grid(row=rowno, column=0, sticky="W", padx=2, pady=2)
+      row_box.grid(row=rowno, column=1, sticky="W", padx=2, pady=2)
+      row_desc.grid(row=rowno, column=2, sticky="W", padx=2, pady=2)
+    return frame
+
+
+  def set_on_search_button_pushed_cb(self, cb):
+    self.search_button.configure(
+      command=lambda s=self: cb(widget=s, vars=s.vars,
+                                values=s.residue_editor.values()))
+
+
+class ResidueEditor(ttk.Frame):
+  """
+  The residue filters of a target as one Treeview: a row per segment with
+  the residues under it.  Only the rows in view are drawn, and a single
+  entry is placed over a cell while it is edited, so a target with hundreds
+  of residues costs no more widgets than one with ten.
+
+  Click the distance geometry column to toggle it (for a segment, whether
+  it joins the previous one); double click or press Return on the last
+  column to edit a residue's acceptable residues or a segment's pattern.
+  """
+  _columns = (
+    ("respect", "Respect Residue Distance Geometry", 210),
+    ("acceptable", "Acceptable Amino/Nucleic Acids", 230),
+  )
+
+  def __init__(self, master=None, height=12, **kw):
+    ttk.Frame.__init__(self, master=master, **kw)
+    self.tree = ttk.Treeview(
+      self, columns=[ c[0] for c in self._columns ], height=height,
+      selectmode="browse")
+    self.tree.heading("#0", text="Residue Name")
+    self.tree.column("#0", width=160, stretch=False)
+    for (name, heading, width) in self._columns:
+      self.tree.heading(name, text=heading)
+      self.tree.column(name, width=width)
+    vscroll = ttk.Scrollbar(self, orient=Tkinter.VERTICAL,
+                            command=self.tree.yview)
+    self.tree.configure(yscrollcommand=vscroll.set)
+    self.tree.grid(row=0, column=0, sticky="news")
+    vscroll.grid(row=0, column=1, sticky="ns")
+    self.rowconfigure(0, weight=1)
+    self.columnconfigure(0, weight=1)
+
+    self.tree.bind("<Button-1>", self._on_click)
+    self.tree.bind("<Double-1>", self._on_double_click)
+    self.tree.bind("<Return>", lambda e: self._begin_edit(self.tree.focus()))
+    self.tree.bind("<space>", lambda e: self.toggle(self.tree.focus()))
+
+    # the model: [pattern, joins previous] per segment, and
+    # [name, mask, acceptable residues] per residue
+    (self.segments, self.residues, self._seg_lengths) = ([], [], [])
+    # iid -> (parent, index, text, values) of every row in the tree
+    self._rows = {}
+    self._entry = None
+
+
+  def show_target(self, user_fields):
+    """
+    Show a new target's residues.  Rows that are unchanged are left alone,
+    so only the rows that differ from the last target are touched.
+    """
+    self._cancel_edit()
+    mask = [ bool(int(m)) for m in user_fields["mask"].split("|") ]
+    names = user_fields["residues"].split("|")
+    acc_res = user_fields["acceptable_residues"].split("|")
+    self.residues = [ [ n, m, a ] for (n, m, a) in zip(names, mask, acc_res) ]
+    self.segments = [
+      [ user_fields["seg_pattern"][i], bool(user_fields["seg_joins"][i]) ]
+      for i in range(len(user_fields["seg_lengths"])) ]
+    self._seg_lengths = list(user_fields["seg_lengths"])
+    self._apply(self._model_rows())
+
+
+  def values(self):
+    "The filters as the plain values do_search expects"
+    values = {
+      "residues": "|".join([ r[0] for r in self.residues ]),
+      "num_segs": len(self.segments),
+    }
+    for (name, mask, acc_res) in self.residues:
+      values[name + "_mask"] = int(mask)
+      values[name + "_filter"] = acc_res
+    for (i, (pattern, joins)) in enumerate(self.segments):
+      values["seg_pattern_%d" % (i)] = pattern
+      values["seg_%d_joins_prev" % (i)] = int(joins)
+    return values
+
+
+  def toggle(self, iid):
+    "Flip a residue's distance geometry mask or a segment's join"
+    (kind, i) = self._parse_iid(iid)
+    if(kind == "res"):
+      self.residues[i][1] = not self.residues[i][1]
+    elif(kind == "seg" and i > 0):
+      self.segments[i][1] = not self.segments[i][1]
+    else:
+      return
+    self._apply(self._model_rows())
+
+
+  def _model_rows(self):
+    rows = []
+    res_idx = 0
+    for (seg_idx, (pattern, joins)) in enumerate(self.segments):
+      seg_iid = "seg%d" % (seg_idx)
+      joins_txt = "" if seg_idx == 0 else (
+        "Joins previous" if joins else "Does not join previous")
+      rows.append((seg_iid, "", "Segment %d" % (seg_idx),
+                   (joins_txt, "Pattern: %s" % (pattern))))
+      for i in range(self._seg_lengths[seg_idx]):
+        (name, mask, acc_res) = self.residues[res_idx]
+        rows.append(("res%d" % (res_idx), seg_iid, name,
+                     ("On" if mask else "Off", acc_res)))
+        res_idx += 1
+    return rows
+
+
+  def _apply(self, rows):
+    "Bring the tree in line with rows, touching only the rows that differ"
+    index = collections.defaultdict(int)
+    new_iids = set()
+    for (iid, parent, text, values) in rows:
+      new_iids.add(iid)
+      row = (parent, index[parent], text, values)
+      index[parent] += 1
+      old = self._rows.get(iid)
+      if(old == row):
+        continue
+      if(old is None):
+        self.tree.insert(parent, row[1], iid=iid, text=text, values=values,
+                         open=True)
+      else:
+        if(old[:2] != row[:2]):
+          self.tree.move(iid, parent, row[1])
+        if(old[2:] != row[2:]):
+          self.tree.item(iid, text=text, values=values)
+      self._rows[iid] = row
+    # deleting a segment deletes the residues still under it
+    for iid in sorted(set(self._rows) - new_iids, reverse=True):
+      if(self.tree.exists(iid)):
+        self.tree.delete(iid)
+      del self._rows[iid]
+
+
+  def _parse_iid(self, iid):
+    if(not iid or iid not in self._rows):
+      return (None, None)
+    return (iid[:3], int(iid[3:]))
+
+
+  def _on_click(self, event):
+    if(self.tree.identify_column(event.x) == "#1"):
+      self.toggle(self.tree.identify_row(event.y))
+
+
+  def _on_double_click(self, event):
+    if(self.tree.identify_column(event.x) == "#2"):
+      self._begin_edit(self.tree.identify_row(event.y))
+      return "break"
+
+
+  def _begin_edit(self, iid):
+    "Place an entry over the acceptable residues or pattern of a row"
+    (kind, i) = self._parse_iid(iid)
+    if(kind is None):
+      return
+    self._cancel_edit()
+    self.tree.see(iid)
+    self.tree.update_idletasks()
+    bbox = self.tree.bbox(iid, "#2")
+    if(not bbox):
+      return
+    value = self.residues[i][2] if kind == "res" else self.segments[i][0]
+    self._entry = ttk.Entry(self.tree)
+    self._entry.insert(0, value)
+    self._entry.select_range(0, Tkinter.END)
+    self._entry.place(x=bbox[0], y=bbox[1], width=bbox[2], height=bbox[3])
+    self._entry.focus_set()
+    self._entry.bind("<Return>", lambda e, k=kind, i=i: self._end_edit(k, i))
+    self._entry.bind("<FocusOut>", lambda e, k=kind, i=i: self._end_edit(k, i))
+    self._entry.bind("<Escape>", lambda e: self._cancel_edit())
+
+
+  def _end_edit(self, kind, i):
+    if(self._entry is None):
+      return
+    value = self._entry.get().strip()
+    self._cancel_edit()
+    if(kind == "res"):
+      self.residues[i][2] = value
+    else:
+      self.segments[i][0] = value
+    self._apply(self._model_rows())
+    self.tree.focus_set()
+
+
+  def _cancel_edit(self):
+    if(self._entry is not None):
+      (entry, self._entry) = (self._entry, None)
+      entry.destroy()
+
+
+class ResultsFrame(TabFrame):
+  _columns = (
+    ("row_no", "#", 60),
+    ("pdbname", "Structure", 120),
+    ("residues", "Matched Residues", 280),
+    ("rmsd", "RMSD", 80),
+  )
+  # only this many pages of overlays are kept in the tree at one time
+  _max_pages = 4
+  # how close to either end of the tree a scroll must get to load a page
+  _edge = 0.1
+
+  def __init__(self, master=None, **kw):
+    TabFrame.__init__(self, master=master, **kw)
+    self.pager = None
+    self.loaded_pages = []
+
+    self.summary = ttk.Label(self.inner_frame, text="No search has been run")
+    self.tree = ttk.Treeview(
+      self.inner_frame, columns=[ c[0] for c in self._columns ],
+      show="headings", height=20)
+    for (col, heading, width) in self._columns:
+      self.tree.heading(col, text=heading)
+      self.tree.column(col, width=width, anchor="w")
+    self.scrollbar = ttk.Scrollbar(
+      self.inner_frame, orient=Tkinter.VERTICAL, command=self.tree.yview)
+    self.tree.configure(yscrollcommand=self._on_tree_scroll)
+
+    self.load_button = ttk.Button(self.inner_frame, text="Load Structures")
+    self.overlay_button = ttk.Button(self.inner_frame, text="Overlay Hits")
+    self.export_button = ttk.Button(self.inner_frame, text="Export...")
+
+    self.summary.grid(row=0, column=0, padx=5, pady=5, sticky="W")
+    self.tree.grid(row=1, column=0, padx=(5,0), pady=5, sticky="news")
+    self.scrollbar.grid(row=1, column=1, pady=5, sticky="ns")
+    self.load_button.grid(row=2, column=0, padx=5, pady=5, sticky="W")
+    self.overlay_button.grid(row=3, column=0, padx=5, pady=5, sticky="W")
+    self.export_button.grid(row=4, column=0, padx=5, pady=5, sticky="W")
+
+
+  def set_on_load_button_pushed_cb(self, cb):
+    self.load_button.configure(
+      command=lambda s=self: cb(widget=s, values=s.selected_hits()))
+
+
+  def set_on_overlay_button_pushed_cb(self, cb):
+    self.overlay_button.configure(
+      command=lambda s=self: cb(widget=s, values=s.selected_hits()))
+
+
+  def set_on_export_button_pushed_cb(self, cb):
+    def ask():
+      fname = tkFileDialog.asksaveasfilename(
+        parent=self, title="Export the hits", defaultextension=".csv",
+        filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl"),
+                   ("NumPy archive", "*.npz")])
+      if(fname):
+        cb(widget=self, values={"fname": fname})
+    self.export_button.configure(command=ask)
+
+
+  def selected_hits(self):
+    "The rows and structures of the selected hits, or of every hit shown"
+    iids = self.tree.selection() or self.tree.get_children()
+    return {
+      "row_nos": [ int(iid) for iid in iids ],
+      "pdbnames": [ self.tree.set(iid, "pdbname") for iid in iids ],
+    }
+
+
+  def show(self, pager):
+    "Start showing the overlays of a new search"
+    self.pager = pager
+    self.tree.delete(*self.tree.get_children())
+    self.loaded_pages = []
+    self.summary.configure(text="%d overlays found" % (pager.num_rows))
+    self._load_page(0)
+    pager.prefetch(1)
+
+
+  def _load_page(self, page_no):
+    self.pager.get_page(
+      page_no, lambda p, rows, pager=self.pager: self._on_page(pager, p, rows))
+
+
+  def _on_page(self, pager, page_no, rows):
+    # ignore pages that arrive for an earlier search or that are no longer
+    # next to the ones on display
+    if(pager is not self.pager or page_no in self.loaded_pages):
+      return
+    if(not self.loaded_pages or page_no == self.loaded_pages[-1] + 1):
+      (index, at_end) = ("end", True)
+      self.loaded_pages.append(page_no)
+    elif(page_no == self.loaded_pages[0] - 1):
+      (index, at_end) = (0, False)
+      self.loaded_pages.insert(0, page_no)
+    else:
+      return
+
+    for (i, row) in enumerate(rows):
+      rmsd = "" if row["rmsd"] is None else "%.3f" % (row["rmsd"])
+      values = (row["row_no"] + 1, row["pdbname"], row["residues"], rmsd)
+      self.tree.insert("", index if at_end else i, iid=str(row["row_no"]),
+                       values=values)
+
+    while(len(self.loaded_pages) > self._max_pages):
+      self._drop_page(self.loaded_pages.pop(0 if at_end else -1))
+
+
+  def _drop_page(self, page_no):
+    # keep the rows the user is looking at in view while rows above go away
+    anchor = self.tree.identify_row(5)
+    (row_start, row_stop) = self.pager.page_bounds(page_no)
+    self.tree.delete(*[ str(i) for i in range(row_start, row_stop) ])
+    if(anchor and self.tree.exists(anchor)):
+      self.tree.see(anchor)
+
+
+  def _on_tree_scroll(self, first, last):
+    self.scrollbar.set(first, last)
+    if(self.pager is None or not self.loaded_pages):
+      return
+    if(float(last) >= 1.0 - self._edge):
+      self._load_page(self.loaded_pages[-1] + 1)
+      self.pager.prefetch(self.loaded_pages[-1] + 2)
+    elif(float(first) <= self._edge and self.loaded_pages[0] > 0):
+      self._load_page(self.loaded_pages[0] - 1)
+
+
+class DisplayTargetDef(ttk.Labelframe):
+  _labels_text = ["No target is defined;", "PyMOL Selection:",
+                    "Lore PDB Name:", "Lore Residue Text:"]
+  _padding = (5,5)
+
+  def __init__(self, master=None, **kw):
+    print 'inside Display Target Def'
+    ttk.Labelframe.__init__(self, master=master, **kw)
+    self["padding"] = self._padding
+
+    self.labels = [ ttk.Label(self, text=l) for l in self._labels_text ]
+    self.values = [ ttk.Label(self, text="") for l in self._labels_text ]
+    self.values[0].configure(text="please define a target")
+    self.labels[0].grid(row=0, sticky='w', padx=2, pady=2)
+    self.values[0].grid(row=0, column=1, padx=2, pady=2)
+
+
+  def update(self, pymol_selection="", target_pdbname="", residue_txt=""):
+    for l in self.labels:
+      l.grid_forget()
+    for i in range(len(self.values)):
+      self.values[i].grid_forget()
+
+    if(pymol_selection):
+      grid_idz = [1]
+      self.values[1].configure(text=pymol_selection)
+    elif(target_pdbname and residue_txt):
+      grid_idz = [2, 3]
+      self.values[2].configure(text=target_pdbname)
+      self.values[3].configure(text=residue_txt.split("\n")[0])
+    else:
+      grid_idz = [0]
+
+    for rowno, i in enumerate(grid_idz):
+      self.labels[i].grid(row=rowno, sticky="W", padx=2, pady=2)
+      self.values[i].grid(row=rowno, column=1, sticky="W", padx=2, pady=2)
+
+
+
+class Notebook(ttk.Notebook):
+  _panel_borderwidth="2"
+  _panel_relief="groove"
+
+  _panels = collections.OrderedDict([
+    ("Define Target", DefineFrame),
+    ("Adjust Target", AdjustFrame),
+    ("Search Results", ResultsFrame),
+  ])
+
+  def __init__(self, master=None, **kw):
+    ttk.Notebook.__init__(self, master=master, **kw)
+    self.searchable = master.searchable
+
+    _style = ttk.Style()
+    _style.configure("Notebook.TFrame", borderwidth=self._panel_borderwidth,
+                     relief=self._panel_relief)
+
+    master.grid_rowconfigure(0, weight=1)
+    master.grid_columnconfigure(0, weight=1)
+
+    # each tab starts as an empty frame; its page is built when first shown
+    self.pages = {}
+    self.on_page_built = None
+    self._placeholders = {}
+    for tag in self._panels:
+      self._placeholders[tag] = ttk.Frame(self, style="Notebook.TFrame")
+      self.add(self._placeholders[tag], text=tag)
+    self.bind("<<NotebookTabChanged>>", self._on_tab_changed)
+
+
+  def page(self, tag):
+    "The page for a tab, built the first time it is asked for"
+    if(tag in self.pages):
+      return self.pages[tag]
+    with STATS.timer("ui", "build %s" % (tag)):
+      page = self._panels[tag](self, style="Notebook.TFrame")
+      placeholder = self._placeholders.pop(tag)
+      selected = (self.select() == str(placeholder))
+      self.insert(placeholder, page, text=tag)
+      self.forget(placeholder)
+      placeholder.destroy()
+      self.pages[tag] = page
+      page.rowconfigure(0, weight=1)
+      page.columnconfigure(0, weight=1)
+#      page.grid(row=0, column=0, sticky="nw")
+      page.update_scroll()
+      if(selected):
+        self.select(page)
+    if(self.on_page_built is not None):
+      self.on_page_built(tag, page)
+    return page
+
+
+  def show(self, tag):
+    self.select(self.page(tag))
+
+
+  def _on_tab_changed(self, event=None):
+    for (tag, placeholder) in self._placeholders.items():
+      if(self.select() == str(placeholder)):
+        self.page(tag)
+#    #self.grid(row=0, column=0, padx=10, pady=10, sticky="ne")
+#    #self.update_scroll()
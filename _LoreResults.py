@@ -0,0 +1,87 @@
+class ResultPager(object):
+  """
+  Pages through the overlays found by one search.
+
+  set_user_fields only returns the overlay keys, so the overlays themselves
+  are fetched page by page with the server's get_overlays method.  A page is
+  fetched on first use, stored in the overlays table, and served from the
+  table from then on; only the pages being displayed are held in memory.
+
+  :param table: an OverlaysTable
+  :param submit: a callable submit(method, on_result, **kwargs) that runs an
+                 rpc call in the background, returns its RpcFuture and later
+                 calls on_result(result) on the calling thread
+  :param user_fields_sha1: the key of the search
+  :param ovly_keys: the overlay keys returned by set_user_fields
+  :param page_size: the number of overlays per page
+  """
+  overlay_method = "get_overlays"
+
+  def __init__(self, table, submit, user_fields_sha1, ovly_keys,
+               page_size=200):
+    self.table = table
+    self.submit = submit
+    self.user_fields_sha1 = user_fields_sha1
+    self.ovly_keys = list(ovly_keys or [])
+    self.page_size = page_size
+    # page number -> callbacks waiting on a fetch that is in flight
+    self._in_flight = {}
+
+
+  @property
+  def num_rows(self):
+    return len(self.ovly_keys)
+
+
+  @property
+  def num_pages(self):
+    return (self.num_rows + self.page_size - 1) // self.page_size
+
+
+  def page_bounds(self, page_no):
+    row_start = page_no * self.page_size
+    return (row_start, min(row_start + self.page_size, self.num_rows))
+
+
+  def get_page(self, page_no, callback=None):
+    """
+    Get one page of overlay rows.  callback(page_no, rows) is called at once
+    if the page is stored locally, otherwise when the fetch completes.
+    """
+    if(page_no < 0 or page_no >= self.num_pages):
+      return
+    (row_start, row_stop) = self.page_bounds(page_no)
+    rows = self.table.page(self.user_fields_sha1, row_start, row_stop)
+    if(len(rows) == row_stop - row_start):
+      if(callback is not None):
+        callback(page_no, rows)
+      return
+
+    if(page_no in self._in_flight):
+      if(callback is not None):
+        self._in_flight[page_no].append(callback)
+      return
+    self._in_flight[page_no] = [ callback ] if callback is not None else []
+    future = self.submit(
+      self.overlay_method,
+      lambda overlays, p=page_no: self._on_page(p, overlays),
+      ovly_keys=self.ovly_keys[row_start:row_stop])
+    # a failed fetch must not leave the page marked as in flight
+    future.add_done_callback(
+      lambda f, p=page_no: self._in_flight.pop(p, None))
+
+
+  def prefetch(self, page_no):
+    "Make sure a page is stored locally without waiting for it"
+    self.get_page(page_no)
+
+
+  def _on_page(self, page_no, overlays):
+    (row_start, row_stop) = self.page_bounds(page_no)
+    self.table.store_page(self.user_fields_sha1, row_start,
+                          self.ovly_keys[row_start:row_stop], overlays)
+    callbacks = self._in_flight.pop(page_no, [])
+    if(callbacks):
+      rows = self.table.page(self.user_fields_sha1, row_start, row_stop)
+      for callback in callbacks:
+        callback(page_no, rows)
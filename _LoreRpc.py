@@ -0,0 +1,226 @@
+import collections
+import itertools
+import json
+import time
+import xmlrpclib
+
+import jsonrpclib
+
+from _LoreStats import STATS
+
+
+class BatchCall(object):
+  """
+  One call collected by an RpcBatch.  result() returns the call's result
+  once the batch has been sent, or raises the error the server returned
+  for this call alone.
+  """
+
+  def __init__(self, rpcid, method, params):
+    self.rpcid = rpcid
+    self.method = method
+    self.params = params
+    self.done = False
+    self._result = None
+    self._error = None
+
+
+  def request(self):
+    return { "jsonrpc": "2.0", "method": self.method,
+             "params": self.params, "id": self.rpcid }
+
+
+  def result(self):
+    if(not self.done):
+      raise RuntimeError("The batch holding %s has not been sent" %
+                         (self.method))
+    if(self._error is not None):
+      raise self._error
+    return self._result
+
+
+  def _set_response(self, response):
+    self.done = True
+    error = response.get("error")
+    if(error):
+      self._error = jsonrpclib.jsonrpc.ProtocolError(
+        (error.get("code"), error.get("message")))
+    else:
+      self._result = response.get("result")
+
+
+  def _set_error(self, error):
+    self.done = True
+    self._error = error
+
+
+class RpcBatch(object):
+  """
+  Collect rpc calls and send them to the server as one JSON-RPC 2.0 batch.
+
+    batch = batcher.batch()
+    a = batch.define_target(pdbname="1abc", residue_txt=txt)
+    b = batch.get_searchable_subsets()
+    batch.send()
+    a.result()
+
+  Made by RpcBatcher.batch(); can also be used as a context manager, in
+  which case the batch is sent on exit.  Any attribute not starting with an
+  underscore is taken as an rpc method name, except for send().
+  """
+
+  def __init__(self, batcher):
+    self._batcher = batcher
+    self._calls = []
+
+
+  def __getattr__(self, method):
+    if(method.startswith("_")):
+      raise AttributeError(method)
+    return lambda *args, **kwargs: self._add(method, *args, **kwargs)
+
+
+  def __len__(self):
+    return len(self._calls)
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, exc_type, exc_value, tb):
+    if(exc_type is None):
+      self.send()
+
+
+  def _add(self, method, *args, **kwargs):
+    if(args and kwargs):
+      raise jsonrpclib.jsonrpc.ProtocolError(
+        "JSON-RPC does not support both positional and keyword arguments.")
+    call = BatchCall(self._batcher._next_id(), method, kwargs or list(args))
+    self._calls.append(call)
+    return call
+
+
+  def send(self):
+    """
+    Send the collected calls and map the responses back onto them.
+
+    :returns: the list of BatchCall instances, in the order they were added
+    """
+    (calls, self._calls) = (self._calls, [])
+    if(calls):
+      self._batcher._send(calls)
+    return calls
+
+
+class RpcBatcher(object):
+  """
+  A batching layer around a jsonrpclib.Server proxy.
+
+  If the server rejects a batch, the calls are made one at a time instead
+  and the batcher stops trying to batch.  Each sent batch is recorded in
+  self.history as a dict with the number of calls, the elapsed time, and
+  an estimate of the latency saved compared to making the calls one by
+  one (None until a single call has been timed).  STATS gets the batch's
+  time as ("rpc", "batch") with the calls as its rows, and the latency
+  saved as ("rpc", "batch saved").
+
+  :param proxy: a jsonrpclib.Server proxy; any other object, such as an
+                in-process stand-in, is called one call at a time
+  :param history_size: the number of batches to keep in self.history
+  """
+
+  def __init__(self, proxy, history_size=100):
+    self.proxy = proxy
+    self.batches_supported = hasattr(proxy, "_run_request")
+    self.single_call_latency = None
+    self.history = collections.deque(maxlen=history_size)
+    self._ids = itertools.count(1)
+
+
+  def batch(self):
+    return RpcBatch(self)
+
+
+  def call(self, method, *args, **kwargs):
+    "Make a single timed call; the timing feeds the latency saved estimate"
+    start = time.time()
+    try:
+      return getattr(self.proxy, method)(*args, **kwargs)
+    finally:
+      self._record_single(time.time() - start)
+
+
+  @property
+  def total_saved(self):
+    return sum([ b["saved"] for b in self.history if b["saved"] is not None ])
+
+
+  def _next_id(self):
+    return next(self._ids)
+
+
+  def _record_single(self, elapsed, weight=0.2):
+    if(self.single_call_latency is None):
+      self.single_call_latency = elapsed
+    else:
+      self.single_call_latency += weight * (elapsed - self.single_call_latency)
+
+
+  def _send(self, calls):
+    start = time.time()
+    responses = None
+    if(self.batches_supported and len(calls) > 1):
+      body = json.dumps([ c.request() for c in calls ])
+      try:
+        responses = self.proxy._run_request(body)
+      except (jsonrpclib.jsonrpc.ProtocolError, xmlrpclib.ProtocolError):
+        responses = None
+      if(not isinstance(responses, list)):
+        self.batches_supported = False
+        responses = None
+
+    if(responses is None):
+      self._send_singly(calls)
+      return
+
+    by_id = dict([ (r.get("id"), r) for r in responses
+                   if isinstance(r, dict) ])
+    for call in calls:
+      if(call.rpcid in by_id):
+        call._set_response(by_id[call.rpcid])
+      else:
+        call._set_error(jsonrpclib.jsonrpc.ProtocolError(
+          (-32603, "No response to %s in the batch" % (call.method))))
+
+    elapsed = time.time() - start
+    saved = None
+    singles = [ self._single_latency(c.method) for c in calls ]
+    if(None not in singles):
+      saved = sum(singles) - elapsed
+    self.history.append(
+      { "calls": len(calls), "elapsed": elapsed, "saved": saved })
+    STATS.record("rpc", "batch", elapsed, rows=len(calls))
+    if(saved is not None):
+      STATS.record("rpc", "batch saved", max(saved, 0.0), rows=len(calls))
+
+
+  def _single_latency(self, method):
+    "What one call of method takes, from the calls STATS has timed"
+    latency = STATS.mean("rpc", method)
+    return self.single_call_latency if latency is None else latency
+
+
+  def _send_singly(self, calls):
+    for call in calls:
+      try:
+        if(isinstance(call.params, dict)):
+          result = self.call(call.method, **call.params)
+        else:
+          result = self.call(call.method, *call.params)
+      except Exception as E:
+        # one failed call must not lose the others' results
+        call._set_error(E)
+      else:
+        call._set_response({ "result": result })
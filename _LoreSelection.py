@@ -0,0 +1,171 @@
+import collections
+import hashlib
+
+import numpy
+
+
+# the only atoms needed to classify residues and link them into segments
+_LINK_ATOMS = "N+CA+C+P+O3'+O3*"
+# longest C-N peptide or O3'-P phosphodiester bond taken as a link
+_MAX_LINK = 2.0
+
+
+def format_residue_txt(segments):
+  """
+  The residue text sent to define_target: one segment per line, residues
+  separated by blanks, each written as chain:resn resi (e.g. A:GLY12).
+
+  :param segments: lists of (chain, resn, resi) tuples
+  """
+  return "\n".join([ " ".join([ "%s:%s%s" % r for r in seg ])
+                     for seg in segments ])
+
+
+def _link_coords(res_idx, n_res, names, coords, wanted):
+  "An (n_res, 3) array of the first atom named in wanted; NaN if missing"
+  out = numpy.empty((n_res, 3))
+  out.fill(numpy.nan)
+  picked = numpy.in1d(names, wanted)
+  # assign in reverse so the first matching atom of a residue wins
+  out[res_idx[picked][::-1]] = coords[picked][::-1]
+  return out
+
+
+def split_segments(chains, resns, resis, res_idx, names, coords):
+  """
+  Classify residues as amino or nucleic acids and split them into bonded
+  segments, from per atom arrays of the link atoms.
+
+  :param res_idx: the residue number (0 based, in order) of each atom
+  :returns: a tuple (segments, polytypes, skipped), where each segment is a
+            list of (chain, resn, resi), polytypes gives "AA" or "NA" for
+            each segment and skipped lists the residues that are neither
+  """
+  n_res = len(chains)
+  names = numpy.asarray(names)
+  n = _link_coords(res_idx, n_res, names, coords, ["N"])
+  ca = _link_coords(res_idx, n_res, names, coords, ["CA"])
+  c = _link_coords(res_idx, n_res, names, coords, ["C"])
+  p = _link_coords(res_idx, n_res, names, coords, ["P"])
+  o3 = _link_coords(res_idx, n_res, names, coords, ["O3'", "O3*"])
+
+  has = lambda a: ~numpy.isnan(a[:, 0])
+  is_aa = has(n) & has(ca) & has(c)
+  is_na = ~is_aa & (has(p) | has(o3))
+  kept = is_aa | is_na
+
+  # residue i links to i+1 if they are the same kind, in the same chain, and
+  # bonded C-N (amino acids) or O3'-P (nucleic acids)
+  with numpy.errstate(invalid="ignore"):
+    pep = numpy.sqrt(((c[:-1] - n[1:]) ** 2).sum(axis=1)) < _MAX_LINK
+    pho = numpy.sqrt(((o3[:-1] - p[1:]) ** 2).sum(axis=1)) < _MAX_LINK
+  chain_ids = numpy.asarray(chains)
+  linked = (chain_ids[:-1] == chain_ids[1:]) & (
+    (is_aa[:-1] & is_aa[1:] & pep) | (is_na[:-1] & is_na[1:] & pho))
+
+  (segments, polytypes, skipped) = ([], [], [])
+  for i in range(n_res):
+    residue = (chains[i], resns[i], resis[i])
+    if(not kept[i]):
+      skipped.append(residue)
+      continue
+    if(i == 0 or not linked[i - 1] or not kept[i - 1]):
+      segments.append([])
+      polytypes.append("AA" if is_aa[i] else "NA")
+    segments[-1].append(residue)
+  return (segments, polytypes, skipped)
+
+
+class SelectionConverter(object):
+  """
+  Turns a PyMOL selection into the pdbname and residue_txt used to define
+  a target on the Lore server.
+
+  Conversions are remembered by the selection, its object and state and a
+  sha1 of its coordinates, so defining a target again from an unchanged
+  object costs one get_coords call.
+
+  :param cmd: the pymol.cmd module; imported when first needed if None
+  :param memo_size: the number of conversions to remember
+  """
+
+  def __init__(self, cmd=None, memo_size=32):
+    self._cmd = cmd
+    self.memo_size = memo_size
+    self.memo = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+
+  @property
+  def cmd(self):
+    if(self._cmd is None):
+      from pymol import cmd
+      self._cmd = cmd
+    return self._cmd
+
+
+  def convert(self, selection, state=1):
+    """
+    :returns: a dict with pdbname, residue_txt, seg_polytypes and the
+              skipped residues that are neither amino nor nucleic acids
+    """
+    objects = self.cmd.get_object_list("(%s)" % (selection))
+    if(not objects):
+      raise ValueError("The selection %s has no atoms" % (selection))
+    if(len(objects) > 1):
+      raise ValueError("The selection %s spans more than one object: %s" %
+                       (selection, ", ".join(objects)))
+
+    coords = self.cmd.get_coords(selection, state)
+    digest = hashlib.sha1(
+      numpy.ascontiguousarray(coords, dtype="<f4").tobytes()).hexdigest()
+    key = (selection, objects[0], state, digest)
+    if(key in self.memo):
+      self.hits += 1
+      self.memo[key] = self.memo.pop(key)
+      return self.memo[key]
+
+    self.misses += 1
+    target = self._convert(selection, objects[0], state)
+    self.memo[key] = target
+    while(len(self.memo) > self.memo_size):
+      self.memo.popitem(last=False)
+    return target
+
+
+  def _convert(self, selection, pdbname, state):
+    # every residue, numbered in the order their atoms come, so that those
+    # without link atoms (ligands, waters, ions) are reported as skipped
+    space = { "residues": [] }
+    self.cmd.iterate("(%s)" % (selection),
+                     "residues.append((segi, chain, resi, resn))",
+                     space=space)
+    (index, chains, resns, resis) = ({}, [], [], [])
+    for (segi, chain, resi, resn) in space["residues"]:
+      if((segi, chain, resi) not in index):
+        index[(segi, chain, resi)] = len(chains)
+        chains.append(chain)
+        resns.append(resn)
+        resis.append(resi)
+
+    model = self.cmd.get_model(
+      "(%s) and name %s" % (selection, _LINK_ATOMS), state)
+    atoms = model.atom
+    if(not atoms):
+      raise ValueError("The selection %s has no amino or nucleic acids" %
+                       (selection))
+    res_idx = [ index[(a.segi, a.chain, a.resi)] for a in atoms ]
+
+    (segments, polytypes, skipped) = split_segments(
+      chains, resns, resis, numpy.array(res_idx),
+      [ a.name for a in atoms ], numpy.array([ a.coord for a in atoms ]))
+    if(not segments):
+      raise ValueError("The selection %s has no amino or nucleic acids" %
+                       (selection))
+    return {
+      "pdbname": pdbname,
+      "residue_txt": format_residue_txt(segments),
+      "seg_polytypes": polytypes,
+      "skipped": skipped,
+    }
@@ -0,0 +1,287 @@
+"""
+A stand-in Lore server for measuring the client offline.
+
+Every answer is synthetic but shaped like the real server's, and derived
+from the request and the seed alone, so a run can be repeated exactly.
+Latency, jitter, payload size, error rate and the number of hits are all
+configurable.  Run it with
+
+  python -m LoreClient._LoreServer --port 8765 --latency 0.05
+
+and point the plugin at http://localhost:8765/mmLore/jsonrpc, e.g. by
+setting LORE_URL.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import SocketServer
+import StringIO
+import threading
+import time
+
+from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCServer
+from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCRequestHandler
+
+
+_AMINO = ("ALA", "ARG", "ASN", "ASP", "CYS", "GLN", "GLU", "GLY", "HIS",
+          "ILE", "LEU", "LYS", "MET", "PHE", "PRO", "SER", "THR", "TRP",
+          "TYR", "VAL")
+_NUCLEIC = ("A", "C", "G", "U", "DA", "DC", "DG", "DT")
+_NA_SUPERPOSITION_ATOMS = "P|C4'|N1"
+
+
+def _seed(*parts):
+  "A stable integer seed from the parts of a request"
+  return int(hashlib.sha1(json.dumps(parts, sort_keys=True)).hexdigest()[:8],
+             16)
+
+
+class StandInLore(object):
+  """
+  The rpc methods of the stand-in server.
+
+  :param seed: changes every synthetic answer
+  :param latency: seconds added to every call
+  :param jitter: up to this many seconds more, drawn uniformly
+  :param error_rate: the fraction of calls that fail
+  :param num_hits: the number of overlays set_user_fields finds
+  :param superposition_atoms: the |-joined atoms define_target gives for
+                              amino acid residues; each overlay has the
+                              coordinates of the target's superposition
+                              atoms, so more of them scale the get_overlays
+                              payload
+  :param num_subsets: the number of searchable subsets
+  """
+
+  def __init__(self, seed=0, latency=0.0, jitter=0.0, error_rate=0.0,
+               num_hits=1000, superposition_atoms="N|CA|C", num_subsets=20):
+    self.seed = seed
+    self.latency = latency
+    self.jitter = jitter
+    self.error_rate = error_rate
+    self.num_hits = num_hits
+    self.superposition_atoms = superposition_atoms
+    self.num_subsets = num_subsets
+    # latency and failures are drawn in call order, not from the request
+    self._rng = random.Random(seed)
+    self._lock = threading.Lock()
+    # the start of a fixed_fields_sha1 -> the target's (residues, atoms)
+    self._targets = {}
+    self.num_calls = 0
+
+
+  def _delay(self, method):
+    with self._lock:
+      self.num_calls += 1
+      delay = self.latency + self._rng.uniform(0, self.jitter)
+      failed = self._rng.random() < self.error_rate
+    if(delay > 0):
+      time.sleep(delay)
+    if(failed):
+      raise RuntimeError("Injected failure in %s" % (method))
+
+
+  def get_searchable_subsets(self):
+    self._delay("get_searchable_subsets")
+    return [ ["subset_%03d" % (i), i] for i in range(1, self.num_subsets + 1) ]
+
+
+  def define_target(self, pdbname="", residue_txt=""):
+    """
+    Accepts residue_txt as written by format_residue_txt, one segment per
+    line; any other residue text is taken as one segment per line of
+    blank separated residue names.
+    """
+    self._delay("define_target")
+    segments = [ l.split() for l in residue_txt.splitlines() if l.split() ]
+    if(not segments):
+      rng = random.Random(_seed(self.seed, pdbname))
+      segments = [ [ "A:%s%d" % (rng.choice(_AMINO), i)
+                     for i in range(1, rng.randint(4, 12)) ] ]
+    residues = [ r for seg in segments for r in seg ]
+    polytypes = []
+    # the overlays hold each residue's superposition atoms, as the client
+    # reads them from target_atoms
+    num_atoms = 0
+    for seg in segments:
+      resn = seg[0].split(":")[-1].rstrip("0123456789")
+      polytypes.append("NA" if resn in _NUCLEIC else "AA")
+      atoms = (_NA_SUPERPOSITION_ATOMS if polytypes[-1] == "NA" else
+               self.superposition_atoms)
+      num_atoms += len(seg) * len(atoms.split("|"))
+
+    fixed_fields_sha1 = hashlib.sha1(
+      json.dumps([self.seed, pdbname, segments])).hexdigest()
+    with self._lock:
+      self._targets[fixed_fields_sha1[:12]] = (len(residues), num_atoms)
+    return {
+      "fixed_fields_sha1": fixed_fields_sha1,
+      "pdbname": pdbname,
+      "residue_txt": residue_txt,
+      "residues": "|".join(residues),
+      "acceptable_residues": "|".join([ "" for r in residues ]),
+      "mask": "|".join([ "1" for r in residues ]),
+      "seg_lengths": [ len(s) for s in segments ],
+      "seg_polytypes": polytypes,
+      "seg_pattern": "".join([ "+" for s in segments ]),
+      "seg_joins": [ False for s in segments ],
+      "ignore_seg_pattern": False,
+      "bestsequence": False,
+      "best_match_only": False,
+      "superposition_atoms": self.superposition_atoms,
+      "na_superposition_atoms": _NA_SUPERPOSITION_ATOMS,
+      "intra_tolerance": 1.0,
+      "inter_tolerance": 2.0,
+      "na_intra_tolerance": 1.5,
+      "na_inter_tolerance": 3.0,
+      "rmslimit": 2.0,
+    }
+
+
+  def set_user_fields(self, **user_fields):
+    "The overlay keys of a search; tighter limits find fewer of them"
+    self._delay("set_user_fields")
+    num_hits = int(self.num_hits * min(
+      1.0, float(user_fields.get("rmslimit", 2.0)) / 2.0))
+    base = str(user_fields.get("fixed_fields_sha1"))[:12]
+    return [ "%s-%d" % (base, i) for i in range(num_hits) ]
+
+
+  def get_overlays(self, ovly_keys=()):
+    "One overlay per key, the same one every time the key is asked for"
+    self._delay("get_overlays")
+    overlays = []
+    for key in ovly_keys:
+      rng = random.Random(_seed(self.seed, key))
+      (num_res, num_atoms) = self._target_size(key)
+      overlays.append({
+        "pdbname": "%d%s" % (rng.randint(1, 9), "".join(
+          [ rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789")
+            for i in range(3) ])),
+        "residues": [ "A:%s%d" % (rng.choice(_AMINO), rng.randint(1, 500))
+                      for i in range(num_res) ],
+        "rmsd": round(rng.uniform(0.1, 2.0), 3),
+        "intra_dg_errors": [ round(rng.uniform(0, 1), 3)
+                             for i in range(num_res) ],
+        "inter_dg_errors": [ round(rng.uniform(0, 2), 3)
+                             for i in range(num_res) ],
+        "coords": [ [ round(rng.uniform(-50, 50), 3) for j in range(3) ]
+                    for i in range(num_atoms) ],
+      })
+    return overlays
+
+
+  def _target_size(self, ovly_key):
+    # keys made before a restart have no target, so fall back to 8 amino
+    # acid residues
+    with self._lock:
+      return self._targets.get(str(ovly_key).split("-")[0], (
+        8, 8 * len(self.superposition_atoms.split("|"))))
+
+
+class KeepAliveRequestHandler(SimpleJSONRPCRequestHandler):
+  """
+  Answers over HTTP/1.1 without closing the connection, and gzips the
+  response if the client accepts it, like the production web server.
+  """
+  protocol_version = "HTTP/1.1"
+  rpc_paths = ("/mmLore/jsonrpc",)
+  gzip_threshold = 1024
+
+  def do_POST(self):
+    if(not self.is_rpc_path_valid()):
+      self.report_404()
+      return
+    data = self.rfile.read(int(self.headers["content-length"]))
+    if(self.headers.get("content-encoding", "") == "gzip"):
+      data = gzip.GzipFile(fileobj=StringIO.StringIO(data)).read()
+    response = self.server._marshaled_dispatch(data) or ""
+
+    self.send_response(200)
+    self.send_header("Content-type", "application/json-rpc")
+    if(len(response) >= self.gzip_threshold and
+       "gzip" in self.headers.get("accept-encoding", "")):
+      buf = StringIO.StringIO()
+      with gzip.GzipFile(fileobj=buf, mode="wb") as f:
+        f.write(response)
+      response = buf.getvalue()
+      self.send_header("Content-Encoding", "gzip")
+    self.send_header("Content-length", str(len(response)))
+    self.end_headers()
+    self.wfile.write(response)
+    self.wfile.flush()
+
+
+class StandInServer(SocketServer.ThreadingMixIn, SimpleJSONRPCServer):
+  """
+  A threaded JSON-RPC server for a StandInLore.  Use port 0 to get a free
+  port; the url property gives the address to hand to the client.
+  """
+  daemon_threads = True
+
+  def __init__(self, lore=None, host="localhost", port=0, log_requests=False):
+    SimpleJSONRPCServer.__init__(self, (host, port),
+                                 requestHandler=KeepAliveRequestHandler,
+                                 logRequests=log_requests)
+    self.lore = lore if lore is not None else StandInLore()
+    for name in ["get_searchable_subsets", "define_target",
+                 "set_user_fields", "get_overlays"]:
+      self.register_function(getattr(self.lore, name), name)
+    self.register_function(lambda: "pong", "ping")
+
+
+  @property
+  def url(self):
+    (host, port) = self.server_address[:2]
+    return "http://%s:%d%s" % (
+      host, port, self.RequestHandlerClass.rpc_paths[0])
+
+
+  def start(self):
+    "Serve from a daemon thread and return the thread"
+    thread = threading.Thread(target=self.serve_forever,
+                              name="StandInLore")
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+
+
+def main(args=None):
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+  parser.add_argument("--host", default="localhost")
+  parser.add_argument("--port", type=int, default=8765)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--latency", type=float, default=0.0)
+  parser.add_argument("--jitter", type=float, default=0.0)
+  parser.add_argument("--error-rate", type=float, default=0.0)
+  parser.add_argument("--num-hits", type=int, default=1000)
+  parser.add_argument("--superposition-atoms", default="N|CA|C",
+                      help="the |-joined atoms of amino acid residues")
+  parser.add_argument("--num-subsets", type=int, default=20)
+  parser.add_argument("--log-requests", action="store_true")
+  opts = parser.parse_args(args)
+
+  lore = StandInLore(
+    seed=opts.seed, latency=opts.latency, jitter=opts.jitter,
+    error_rate=opts.error_rate, num_hits=opts.num_hits,
+    superposition_atoms=opts.superposition_atoms,
+    num_subsets=opts.num_subsets)
+  server = StandInServer(lore, opts.host, opts.port, opts.log_requests)
+  print "Serving a stand-in Lore at %s" % (server.url)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+
+
+if __name__ == "__main__":
+  main()
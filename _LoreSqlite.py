@@ -1,33 +1,258 @@
+import contextlib
+import itertools
 import sqlite3
+import time
+
+import numpy
+
+from _LoreStats import STATS, sql_name
+
+
+# The version of the local cache's schema, kept in PRAGMA user_version.  Bump
+# it whenever a table's fields or indexes change, and add any step that adding
+# the missing columns cannot handle to that table's migrations.
+SCHEMA_VERSION = 4
+
+
+def schema_version(con):
+  return con.execute("PRAGMA user_version").fetchone()[0]
+
+
+def set_schema_version(con, version=SCHEMA_VERSION):
+  """
+  Record that every table is up to date; call once all tables are built.
+  A newer version already recorded is kept.
+  """
+  if(schema_version(con) < int(version)):
+    con.execute("PRAGMA user_version = %d" % (int(version)))
+
+
+class ResultStoreError(Exception):
+  pass
+
+
+def pack_floats(values):
+  "Pack a sequence or array of floats into a little endian float32 blob"
+  if(values is None):
+    return None
+  return sqlite3.Binary(numpy.ascontiguousarray(values, dtype="<f4").tobytes())
+
+
+def unpack_floats(blob, shape=None):
+  "A read-only float32 array over a blob; the blob's bytes are not copied"
+  if(blob is None):
+    return None
+  values = numpy.frombuffer(blob, dtype="<f4")
+  if(shape is not None):
+    values = values.reshape(shape)
+  return values
+
+
+class LoreConnection(sqlite3.Connection):
+  """
+  A connection in autocommit mode whose writes can be grouped into a unit of
+  work with transaction().  commit() is a no-op inside a unit of work, so the
+  tables' own commits do not end it early.
+
+  A unit of work takes the write lock when it begins.  A deferred one that
+  reads and then writes cannot wait for another connection's write to
+  finish; sqlite fails it with "database is locked" at once instead.
+  """
+
+  def __init__(self, *args, **kwargs):
+    sqlite3.Connection.__init__(self, *args, **kwargs)
+    self.isolation_level = None
+    self.row_factory = sqlite3.Row
+    self._tx_depth = 0
+
+
+  @contextlib.contextmanager
+  def transaction(self):
+    """
+    Run the writes in the block as one transaction, committed on exit and
+    rolled back on an exception.  A nested unit of work becomes a savepoint
+    of the outermost one.
+    """
+    savepoint = "lore_%d" % (self._tx_depth)
+    if(self._tx_depth == 0): self.execute("BEGIN IMMEDIATE")
+    else: self.execute("SAVEPOINT %s" % (savepoint))
+    self._tx_depth += 1
+    try:
+      yield self
+    except:
+      self._tx_depth -= 1
+      if(self._tx_depth == 0):
+        self.execute("ROLLBACK")
+      else:
+        self.execute("ROLLBACK TO SAVEPOINT %s" % (savepoint))
+        self.execute("RELEASE SAVEPOINT %s" % (savepoint))
+      raise
+    self._tx_depth -= 1
+    if(self._tx_depth == 0): self.execute("COMMIT")
+    else: self.execute("RELEASE SAVEPOINT %s" % (savepoint))
+
+
+  def commit(self):
+    if(self._tx_depth == 0):
+      sqlite3.Connection.commit(self)
+
+
+  def execute(self, sql, *args):
+    "Execute a statement, timing it in STATS when that is enabled"
+    if(not STATS.enabled):
+      return sqlite3.Connection.execute(self, sql, *args)
+    start = time.time()
+    cur = sqlite3.Connection.execute(self, sql, *args)
+    # rowcount is only known for writes; SELECTs count their rows lazily
+    STATS.record("sql", sql_name(sql), time.time() - start,
+                 rows=cur.rowcount)
+    return cur
+
+
+  def executemany(self, sql, *args):
+    if(not STATS.enabled):
+      return sqlite3.Connection.executemany(self, sql, *args)
+    start = time.time()
+    cur = sqlite3.Connection.executemany(self, sql, *args)
+    STATS.record("sql", sql_name(sql), time.time() - start,
+                 rows=cur.rowcount)
+    return cur
+
+
+def connect(fname, journal_mode="WAL", synchronous="NORMAL",
+            cache_size=-8000, check_same_thread=True, busy_timeout=30.0):
+  """
+  Open the local cache.  WAL lets readers carry on while a write commits,
+  and with synchronous=NORMAL a WAL database only syncs at checkpoints.
+
+  :param cache_size: the sqlite page cache size; negative values are KiB
+  :param check_same_thread: False lets other threads use the connection;
+                            the caller must then serialize its use
+  :param busy_timeout: seconds to wait for another connection's write,
+                       e.g. another PyMOL's, before "database is locked"
+  """
+  con = sqlite3.connect(fname, factory=LoreConnection, timeout=busy_timeout,
+                        check_same_thread=check_same_thread)
+  con.execute("PRAGMA busy_timeout=%d" % (int(busy_timeout * 1000)))
+  con.execute("PRAGMA journal_mode=%s" % (journal_mode))
+  con.execute("PRAGMA synchronous=%s" % (synchronous))
+  con.execute("PRAGMA cache_size=%d" % (int(cache_size)))
+  return con
+
 
 class BaseTable(object):
+  # (index name, (column, ...)) pairs; tables set these next to their fields
+  indexes = ()
+  # (version, (step, ...)) pairs; each step is an sql string or a callable
+  # taking the table, run when upgrading a cache older than that version
+  migrations = ()
+  # rows fetched per round trip by iter_records
+  arraysize = 500
 
   def __init__(self, con):
     self.made_table = False
     self.con = con
+    self.insert_cmd = None
 
-    row = self.con.execute(
-      """SELECT name, sql FROM sqlite_master 
-         WHERE type = 'table' AND name = '%s'""" % (self.name)
-    ).fetchone()
+    # an up to date cache needs no schema checks at all
+    version = schema_version(self.con)
+    if(version > SCHEMA_VERSION):
+      raise ResultStoreError(
+        "The cache was written by a newer Lore plugin (schema version %d, "
+        "this one knows up to %d); upgrade the plugin or use another cache "
+        "file" % (version, SCHEMA_VERSION))
+    if(version < SCHEMA_VERSION):
+      self.migrate(version)
 
+
+  @property
+  def create_cmd(self):
     cmd = "CREATE TABLE '%s'(\n\t%s %s" % \
       (self.name, self.fields[0][0], self.fields[0][1])
     for field in self.fields[1:]: cmd += ",\n\t%s %s" % (field[0], field[1])
     cmd += ")"
-               
-    # this check assumes that if one adds fields to the table, the added
-    # fields will be appended to the existing list of fields.
-    create_table = False
-    if(row is not None and cmd != row["sql"]):
-      create_table = True
-      
-    if(row is None or create_table):
-      if(create_table): self.con.execute("DROP TABLE '%s'" % (self.name))
-      self.con.execute(cmd)
-      self.made_table = True
+    return cmd
 
-    self.insert_cmd = None
+
+  def migrate(self, from_version):
+    """
+    Bring the table from an older schema version up to date without losing
+    the rows already cached: run the table's migration steps newer than
+    from_version, then add any fields the table is still missing.
+    """
+    # looked up under the write lock, so that two PyMOLs opening a new
+    # cache do not both create the table
+    with self.transaction():
+      row = self.con.execute(
+        """SELECT name, sql FROM sqlite_master
+           WHERE type = 'table' AND name = ?""", (self.name,)
+      ).fetchone()
+      if(row is None):
+        self.con.execute(self.create_cmd)
+        self.made_table = True
+      else:
+        for (version, steps) in self.migrations:
+          if(version <= from_version):
+            continue
+          for step in steps:
+            if(callable(step)): step(self)
+            else: self.con.execute(step)
+        self._add_missing_fields()
+
+      for (index_name, columns) in self.indexes:
+        self.con.execute("CREATE INDEX IF NOT EXISTS '%s' ON '%s' (%s)" %
+                         (index_name, self.name, ",".join(columns)))
+
+
+  def copy_forward(self):
+    """
+    Rebuild the table from its current fields, copying over the columns the
+    old and new tables have in common.  A migration step for the changes
+    ALTER TABLE cannot make, e.g. a new primary key or a changed type.
+    """
+    old_name = "%s_old" % (self.name)
+    self.con.execute("ALTER TABLE '%s' RENAME TO '%s'" % (self.name, old_name))
+    old_columns = [ r[1] for r in
+                    self.con.execute("PRAGMA table_info('%s')" % (old_name)) ]
+    common = ",".join([ f[0] for f in self.fields if f[0] in old_columns ])
+    self.con.execute(self.create_cmd)
+    self.con.execute("INSERT INTO '%s' (%s) SELECT %s FROM '%s'" %
+                     (self.name, common, common, old_name))
+    self.con.execute("DROP TABLE '%s'" % (old_name))
+
+
+  def _add_missing_fields(self):
+    columns = [ r[1] for r in
+                self.con.execute("PRAGMA table_info('%s')" % (self.name)) ]
+    missing = [ f for f in self.fields if f[0] not in columns ]
+    # ALTER TABLE cannot add a key column, so fall back to copying forward
+    if([ f for f in missing if "PRIMARY KEY" in f[1] or "UNIQUE" in f[1] ]):
+      self.copy_forward()
+      return
+    for (name, type) in missing:
+      self.con.execute(
+        "ALTER TABLE '%s' ADD COLUMN %s %s" % (self.name, name, type))
+
+
+  def transaction(self):
+    """
+    A unit of work: the writes made in the block are committed together.
+    """
+    if(hasattr(self.con, "transaction")):
+      return self.con.transaction()
+    return self._commit_on_exit()
+
+
+  @contextlib.contextmanager
+  def _commit_on_exit(self):
+    # a plain connection outside autocommit mode already keeps the writes in
+    # one implicit transaction until commit()
+    try:
+      yield self.con
+    except:
+      self.con.rollback()
+      raise
+    self.con.commit()
 
 
   def clear(self, rm_ids=[]):
@@ -35,22 +260,23 @@ class BaseTable(object):
     Clear all records in the table subject to the remove ids.
     We don't want an unsantized where clause.
     """
-    if(rm_ids):
-      sql = "DELETE FROM '%s' WHERE ID IN (%s)" % \
-        (self.name, ",".join(["?" for i in rm_ids]))
-      self.con.execute(sql, tuple(rm_ids))
-    else:
-      self.con.execute("DELETE FROM '%s'" % (self.name,))
-
-    # if we clear the entire table, we should be fine with reseting
-    # autoincrement back to zero.
-    if("AUTOINCREMENT" in self.fields[0][1]):
-      cur = self.con.execute("SELECT COUNT(*), MAX(id) from '%s'" % (self.name))
-      (count, max_id) = cur.fetchone()
-      if(count <= 0): max_id = 1
-      self.con.execute("UPDATE sqlite_sequence SET seq=? WHERE NAME=?",
-                       (max_id, self.name)) 
-    self.con.commit()
+    with self.transaction():
+      if(rm_ids):
+        sql = "DELETE FROM '%s' WHERE ID IN (%s)" % \
+          (self.name, ",".join(["?" for i in rm_ids]))
+        self.con.execute(sql, tuple(rm_ids))
+      else:
+        self.con.execute("DELETE FROM '%s'" % (self.name,))
+
+      # if we clear the entire table, we should be fine with reseting
+      # autoincrement back to zero.
+      if("AUTOINCREMENT" in self.fields[0][1]):
+        cur = self.con.execute(
+          "SELECT COUNT(*), MAX(id) from '%s'" % (self.name))
+        (count, max_id) = cur.fetchone()
+        if(count <= 0): max_id = 1
+        self.con.execute("UPDATE sqlite_sequence SET seq=? WHERE NAME=?",
+                         (max_id, self.name)) 
 
 
   def clear_by(self, **kwargs):
@@ -72,32 +298,41 @@ class BaseTable(object):
                  a tuple representing a new row
     """
     if(self.insert_cmd is None): self._setup_insert_cmd()
-    if(isinstance(data, (dict,))):
-      tmp = tuple([ data.get(col) for (col, type) in self.fields[1:] ])
-    elif(not isinstance(data, (tuple,))):
+    if(not isinstance(data, (dict, tuple))):
       raise ResultStoreError("Data for store_row must be a tuple or dictionary")
-    else: 
-      tmp = data
 
-    rowid = self.con.execute(self.insert_cmd, tmp).lastrowid
+    rowid = self.con.execute(self.insert_cmd, self._row_tuple(data)).lastrowid
     self.con.commit()
     return rowid
 
 
   def store_many_rows(self, rows):
     """
-    Store a number of records
+    Store a number of records in one transaction.  The rows are streamed
+    into executemany, so a generator never has to be held in memory.
 
-    :param rows: a list of class instances OR a list of tuples
+    :param rows: a list or iterator of tuples, dictionaries OR class instances
     """
-    if(not rows): return
+    rows = iter(rows)
+    try:
+      first = next(rows)
+    except StopIteration:
+      return
     if(self.insert_cmd is None): self._setup_insert_cmd()
-    tmp = rows
-    if(not isinstance(rows[0], (tuple))):
-      tmp = [ tuple([ r.__dict__.get(col, "") for (col, t) in self.fields[1:] ])
-              for r in rows ]
-    self.con.executemany(self.insert_cmd, tmp)
-    self.con.commit()
+    tmp = itertools.chain([first], rows)
+    if(not isinstance(first, (tuple))):
+      tmp = itertools.imap(self._row_tuple, tmp)
+    with self.transaction():
+      self.con.executemany(self.insert_cmd, tmp)
+
+
+  def _row_tuple(self, data):
+    # a missing INTEGER PRIMARY KEY comes through as None and is assigned
+    if(isinstance(data, (tuple,))):
+      return data
+    if(not isinstance(data, (dict,))):
+      data = data.__dict__
+    return tuple([ data.get(col) for (col, type) in self.fields ])
 
 
   def _setup_insert_cmd(self):
@@ -126,10 +361,29 @@ class BaseTable(object):
     return self.con.execute(cmd, (int(id), )).fetchone()
 
 
-  def records(self, pagination=None, order_by_tag="", ids=[]):
+  @property
+  def primary_key(self):
+    return self.fields[0][0]
+
+
+  @property
+  def sort_fields(self):
+    """
+    The fields that records() may order by: the primary key and the leading
+    column of each index, so that every ordering is backed by an index.
+    """
+    return [ self.primary_key ] + [ cols[0] for (name, cols) in self.indexes ]
+
+
+  def records(self, pagination=None, order_by_tag="", ids=[], after=None):
     """
     Get one page of matches from this table.  Order the matches based on the 
     order by clause that is constructed from the HTML form arguments.
+
+    With after set to the last row of the previous page, the page is found
+    by seeking past that row (keyset pagination) rather than with an OFFSET,
+    which would have to step over every earlier row.  Keyset pages assume
+    the sort field has no NULL values.
     """
     order_by = self.get_order_by(order_by_tag)
    
@@ -141,24 +395,81 @@ class BaseTable(object):
       else:  
         sql = "SELECT * FROM '%s' %s" % (self.name, order_by)
         args = ()
+    elif(after is not None):
+      (where, args) = self._seek_clause(order_by_tag, after)
+      sql = "SELECT * FROM '%s' WHERE %s %s LIMIT ?" % \
+        (self.name, where, order_by)
+      args += (pagination.per_page,)
     else:
       sql = "SELECT * FROM '%s' %s LIMIT ?, ?" % (self.name, order_by)
       args = (pagination.row_start, pagination.per_page)
     return self.con.execute(sql, args).fetchall()
 
+
+  def iter_records(self, order_by_tag="", arraysize=None, **where):
+    """
+    Stream the records of this table, fetching arraysize rows at a time so
+    a large table is never held in memory all at once.
+
+    :param where: field=value pairs that the records must match
+    """
+    field_names = [ f[0] for f in self.fields ]
+    for field in where:
+      if(field not in field_names):
+        raise ResultStoreError("%s has no field %s" % (self.name, field))
+    sql = "SELECT * FROM '%s'" % (self.name)
+    if(where):
+      sql += " WHERE " + " AND ".join([ "%s=?" % (f) for f in where ])
+    sql += self.get_order_by(order_by_tag)
+
+    cur = self.con.execute(sql, tuple(where.values()))
+    cur.arraysize = arraysize or self.arraysize
+    while(True):
+      rows = cur.fetchmany()
+      if(not rows):
+        break
+      for row in rows:
+        yield row
+
   
   def get_order_by(self, order_by_tag):
     """
-    Get an order by clause based on an html tag name (i.e. a string)
+    Get an order by clause based on an html tag name (i.e. a string).  The
+    primary key is added as a tie breaker so that the order is total.
     """
     if(order_by_tag == ""): return ""
 
+    (field, order) = self._parse_order_by(order_by_tag)
+    if(field == self.primary_key):
+      return "\nORDER BY %s%s" % (field, order)
+    return "\nORDER BY %s%s, %s%s" % (field, order, self.primary_key, order)
+
+
+  def _parse_order_by(self, order_by_tag):
     tmp = order_by_tag.lower()
     if(tmp[-4:] == "_asc"): (field, order) = (order_by_tag[:-4], " ASC")
     elif(tmp[-4:] == "_dsc"): (field, order) = (order_by_tag[:-4], " DESC")
     else: (field, order) = (order_by_tag, "")
 
-    return "\nORDER BY %s%s" % (field, order)
+    # the field name is pasted into the sql, so it must be one we know
+    if(field not in self.sort_fields):
+      raise ResultStoreError("Cannot order %s by %s" % (self.name, field))
+    return (field, order)
+
+
+  def _seek_clause(self, order_by_tag, after):
+    "The WHERE clause selecting the rows that sort after the row after"
+    (field, order) = (self.primary_key, "")
+    if(order_by_tag):
+      (field, order) = self._parse_order_by(order_by_tag)
+    op = "<" if order == " DESC" else ">"
+    if(field == self.primary_key):
+      return ("%s %s ?" % (field, op), (after[field],))
+    # the leading range term lets sqlite seek the index instead of scanning
+    where = "%s %s= ? AND (%s %s ? OR %s %s ?)" % \
+      (field, op, field, op, self.primary_key, op)
+    return (where, (after[field], after[field], after[self.primary_key]))
+
 
 class FixedFieldsTable(BaseTable):
 
@@ -204,9 +515,36 @@ class UserFieldsTable(BaseTable):
                    ("ignore_seg_pattern", "INTEGER"),
                    ("probe_pdblist", "TEXT"),
                   )
+    self.indexes = (
+      ("user_fields_fixed_fields_sha1", ("fixed_fields_sha1",)),
+    )
+    BaseTable.__init__(self, con)
+
+
+class ResultSetsTable(BaseTable):
+
+  def __init__(self, con):
+    self.name = "result_sets"
+    self.fields = (("user_fields_sha1", "TEXT PRIMARY KEY"),
+                   ("num_hits", "INTEGER"),
+                   ("ovly_keys", "TEXT"),
+                   ("date_created", "TEXT"),
+                  )
     BaseTable.__init__(self, con)
 
 
+  def lookup(self, user_fields_sha1):
+    cmd = "SELECT * from '%s' WHERE user_fields_sha1=?" % (self.name)
+    return self.con.execute(cmd, (user_fields_sha1, )).fetchone()
+
+
+  def latest(self):
+    "The most recently stored result set, or None"
+    cmd = "SELECT * from '%s' ORDER BY date_created DESC, rowid DESC " \
+          "LIMIT 1" % (self.name)
+    return self.con.execute(cmd).fetchone()
+
+
 class Searchable(BaseTable):
 
   def __init__(self, con):
@@ -214,4 +552,318 @@ class Searchable(BaseTable):
     self.fields = (("id", "INTEGER PRIMARY KEY"),
                    ("name", "TEXT"),
                   )
+    self.indexes = (("searchable_name", ("name",)),)
     BaseTable.__init__(self, con)
+
+
+  def sync(self, rows):
+    """
+    Bring the table in line with a new list of (id, name) rows by applying
+    only the differences.
+
+    The diff is read and applied in one unit of work, so other connections
+    see either the old list or the new one, never a mix.
+
+    :returns: a tuple of the inserted, deleted and renamed ids
+    """
+    with self.transaction():
+      old = dict([ (r["id"], r["name"]) for r in self.records() ])
+      new = dict([ (int(r[0]), r[1]) for r in rows ])
+      inserted = [ i for i in new if i not in old ]
+      deleted = [ i for i in old if i not in new ]
+      renamed = [ i for i in new if i in old and old[i] != new[i] ]
+
+      if(deleted):
+        self.clear(rm_ids=deleted)
+      self.store_many_rows([ (i, new[i]) for i in inserted + renamed ])
+    return (inserted, deleted, renamed)
+
+
+class TargetCacheTable(BaseTable):
+
+  def __init__(self, con):
+    self.name = "target_cache"
+    self.fields = (("cache_key", "TEXT PRIMARY KEY"),
+                   ("fixed_fields_sha1", "TEXT"),
+                   ("user_fields", "TEXT"),
+                   ("date_created", "REAL"),
+                  )
+    self.indexes = (("target_cache_date_created", ("date_created",)),)
+    BaseTable.__init__(self, con)
+
+
+  def lookup(self, cache_key):
+    cmd = "SELECT * from '%s' WHERE cache_key=?" % (self.name)
+    return self.con.execute(cmd, (cache_key, )).fetchone()
+
+
+  def purge(self, older_than):
+    """
+    Remove the entries created before the given time (seconds since the epoch)
+    """
+    sql = "DELETE FROM '%s' WHERE date_created < ?" % (self.name)
+    count = self.con.execute(sql, (older_than, )).rowcount
+    self.con.commit()
+    return count
+
+
+class OverlaysTable(BaseTable):
+  """
+  The overlays found by each search.  The per residue DG-errors and the
+  coordinates of the matched atoms (n_atoms x 3) are float32 blobs.
+  """
+  # the columns load_arrays and iter_hits read, in order
+  hit_columns = ("row_no", "ovly_key", "pdbname", "residues", "rmsd",
+                 "n_atoms", "intra_dg_errors", "inter_dg_errors", "coords")
+
+  def __init__(self, con):
+    self.name = "overlays"
+    self.fields = (("id", "INTEGER PRIMARY KEY"),
+                   ("user_fields_sha1", "TEXT"),
+                   ("row_no", "INTEGER"),
+                   ("ovly_key", "TEXT"),
+                   ("pdbname", "TEXT"),
+                   ("residues", "TEXT"),
+                   ("rmsd", "REAL"),
+                   ("n_atoms", "INTEGER"),
+                   ("intra_dg_errors", "BLOB"),
+                   ("inter_dg_errors", "BLOB"),
+                   ("coords", "BLOB"),
+                  )
+    self.indexes = (("overlays_page", ("user_fields_sha1", "row_no")),)
+    BaseTable.__init__(self, con)
+
+
+  def store_page(self, user_fields_sha1, row_start, ovly_keys, overlays):
+    """
+    Store one page of overlays as returned by the server.
+
+    :param row_start: the row number of the first overlay in the page
+    :param ovly_keys: the overlay keys of the page, in the same order
+    """
+    rows = []
+    for (i, (key, ovly)) in enumerate(zip(ovly_keys, overlays)):
+      residues = ovly.get("residues", "")
+      if(isinstance(residues, (list, tuple))):
+        residues = "|".join(residues)
+      coords = ovly.get("coords")
+      rows.append((None, user_fields_sha1, row_start + i, str(key),
+                   ovly.get("pdbname"), residues, ovly.get("rmsd"),
+                   len(coords) if coords is not None else None,
+                   pack_floats(ovly.get("intra_dg_errors")),
+                   pack_floats(ovly.get("inter_dg_errors")),
+                   pack_floats(coords)))
+    with self.transaction():
+      self.clear_page(user_fields_sha1, row_start, row_start + len(ovly_keys))
+      self.store_many_rows(rows)
+
+
+  def clear_page(self, user_fields_sha1, row_start, row_stop):
+    sql = "DELETE FROM '%s' WHERE user_fields_sha1=? AND row_no>=? AND " \
+          "row_no<?" % (self.name)
+    self.con.execute(sql, (user_fields_sha1, row_start, row_stop))
+    self.con.commit()
+
+
+  def page(self, user_fields_sha1, row_start, row_stop):
+    "Get the stored overlays with row_start <= row_no < row_stop"
+    sql = "SELECT * FROM '%s' WHERE user_fields_sha1=? AND row_no>=? AND " \
+          "row_no<? ORDER BY row_no" % (self.name)
+    return self.con.execute(
+      sql, (user_fields_sha1, row_start, row_stop)).fetchall()
+
+
+  def count_complete(self, user_fields_sha1):
+    "The number of stored overlays of a search that have their DG-errors"
+    sql = "SELECT COUNT(*) FROM '%s' WHERE user_fields_sha1=? AND " \
+          "intra_dg_errors IS NOT NULL AND inter_dg_errors IS NOT NULL" % \
+          (self.name)
+    return self.con.execute(sql, (user_fields_sha1,)).fetchone()[0]
+
+
+  def copy_rows(self, src_sha1, dst_sha1, row_nos):
+    """
+    Copy the overlays of one search with the given row numbers to another
+    search, numbering them from zero in the order given.
+    """
+    columns = [ f[0] for f in self.fields[3:] ]
+    with self.transaction():
+      self.con.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS overlay_rows (old INTEGER, "
+        "new INTEGER)")
+      self.con.execute("DELETE FROM overlay_rows")
+      self.con.executemany("INSERT INTO overlay_rows VALUES (?, ?)",
+                           ((int(r), i) for (i, r) in enumerate(row_nos)))
+      self.con.execute("DELETE FROM '%s' WHERE user_fields_sha1=?" %
+                       (self.name), (dst_sha1,))
+      self.con.execute(
+        """INSERT INTO '%s' (user_fields_sha1, row_no, %s)
+           SELECT ?, m.new, %s FROM '%s' o JOIN overlay_rows m
+           ON o.row_no = m.old WHERE o.user_fields_sha1 = ?""" %
+        (self.name, ",".join(columns),
+         ",".join([ "o." + c for c in columns ]), self.name),
+        (dst_sha1, src_sha1))
+      self.con.execute("DELETE FROM overlay_rows")
+
+
+  def load_arrays(self, user_fields_sha1):
+    """
+    Load every stored overlay of a search as columns: lists for the text
+    fields and float32 arrays for the numbers.  rmsd is shaped (hits,).
+    When every hit has as many values as the others, the DG-errors are
+    shaped (hits, residues) and coords (hits, atoms, 3); otherwise they
+    are the hits' values one after another, shaped (values,) and
+    (atoms, 3).  Either way <column>_offsets, shaped (hits + 1,), has
+    where each hit's values start, in residues or atoms.  A blob column
+    and its offsets are None unless every overlay has it.
+    """
+    rows = self._hits_cursor(user_fields_sha1).fetchall()
+    columns = zip(*rows) or [ () ] * 9
+
+    arrays = {
+      "row_no": numpy.array(columns[0], dtype=numpy.int64),
+      "ovly_key": list(columns[1]),
+      "pdbname": list(columns[2]),
+      "residues": list(columns[3]),
+      "rmsd": numpy.array(columns[4], dtype="<f4"),
+    }
+    n_hits = len(rows)
+    for (i, name, width) in [ (6, "intra_dg_errors", 1),
+                              (7, "inter_dg_errors", 1), (8, "coords", 3) ]:
+      blobs = columns[i]
+      if(not n_hits or None in blobs):
+        (arrays[name], arrays[name + "_offsets"]) = (None, None)
+        continue
+      # float32 blobs, so 4 bytes a value
+      counts = numpy.array([ len(b) // (4 * width) for b in blobs ])
+      offsets = numpy.zeros(n_hits + 1, dtype=numpy.int64)
+      numpy.cumsum(counts, out=offsets[1:])
+      # each blob is viewed in place, and joined by the one copy here
+      values = numpy.concatenate([ unpack_floats(b) for b in blobs ])
+      shape = (n_hits, counts[0]) if (counts == counts[0]).all() else (-1,)
+      if(width > 1):
+        shape += (width,)
+      arrays[name] = values.reshape(shape)
+      arrays[name + "_offsets"] = offsets
+    return arrays
+
+
+  def _hits_cursor(self, user_fields_sha1):
+    cur = self.con.cursor()
+    # plain tuples are much cheaper to build than sqlite3.Row instances
+    cur.row_factory = None
+    return cur.execute(
+      "SELECT %s FROM '%s' WHERE user_fields_sha1=? ORDER BY row_no" % (
+        ", ".join(self.hit_columns), self.name), (user_fields_sha1,))
+
+
+  def iter_hits(self, user_fields_sha1, arraysize=None):
+    """
+    Stream the stored overlays of a search in row order, as plain tuples of
+    the hit_columns, fetching arraysize rows at a time.
+    """
+    cur = self._hits_cursor(user_fields_sha1)
+    cur.arraysize = arraysize or self.arraysize
+    while(True):
+      rows = cur.fetchmany()
+      if(not rows):
+        break
+      for row in rows:
+        yield row
+
+
+  def hit_sizes(self, user_fields_sha1):
+    """
+    What it takes to hold a search's stored overlays as arrays: a dict of
+    the number of hits, the total, fewest and most matched atoms, the
+    most residues with DG-errors and the longest of each text column.
+    """
+    sql = """SELECT COUNT(*), SUM(n_atoms), MIN(n_atoms), MAX(n_atoms),
+                    MAX(LENGTH(intra_dg_errors)), MAX(LENGTH(inter_dg_errors)),
+                    MAX(LENGTH(ovly_key)), MAX(LENGTH(pdbname)),
+                    MAX(LENGTH(residues))
+             FROM '%s' WHERE user_fields_sha1=?""" % (self.name)
+    row = self.con.execute(sql, (user_fields_sha1,)).fetchone()
+    keys = ("num_hits", "total_atoms", "min_atoms", "max_atoms",
+            "intra_residues", "inter_residues", "ovly_key", "pdbname",
+            "residues")
+    sizes = dict(zip(keys, [ v or 0 for v in row ]))
+    # the DG-errors are float32 blobs, 4 bytes a residue
+    sizes["intra_residues"] //= 4
+    sizes["inter_residues"] //= 4
+    return sizes
+
+
+class MetaTable(BaseTable):
+
+  def __init__(self, con):
+    self.name = "lore_meta"
+    self.fields = (("key", "TEXT PRIMARY KEY"),
+                   ("value", "TEXT"),
+                  )
+    BaseTable.__init__(self, con)
+
+
+  def get_value(self, key, default=None):
+    cmd = "SELECT value from '%s' WHERE key=?" % (self.name)
+    row = self.con.execute(cmd, (key, )).fetchone()
+    if(row is None):
+      return default
+    return row["value"]
+
+
+  def set_value(self, key, value):
+    self.store_row((key, value))
+
+
+class StatsTable(BaseTable):
+  "Saved timing histograms, one row per (category, name) per session"
+
+  def __init__(self, con):
+    self.name = "lore_stats"
+    self.fields = (("id", "INTEGER PRIMARY KEY"),
+                   ("session", "TEXT"),
+                   ("category", "TEXT"),
+                   ("name", "TEXT"),
+                   ("count", "INTEGER"),
+                   ("total", "REAL"),
+                   ("min", "REAL"),
+                   ("max", "REAL"),
+                   ("bytes", "INTEGER"),
+                   ("rows", "INTEGER"),
+                   # counts per _LoreStats.BUCKETS bucket, as JSON
+                   ("buckets", "TEXT"),
+                   ("date_created", "TEXT"),
+                  )
+    self.indexes = (("lore_stats_session", ("session",)),)
+    BaseTable.__init__(self, con)
+
+
+class BatchJobsTable(BaseTable):
+  """
+  The checkpoint of a batch run: one row per finished job, so a run that
+  is started again skips the jobs it already did.
+  """
+
+  def __init__(self, con):
+    self.name = "batch_jobs"
+    self.fields = (("job_key", "TEXT PRIMARY KEY"),
+                   ("batch", "TEXT"),
+                   ("target_key", "TEXT"),
+                   ("params", "TEXT"),
+                   ("status", "TEXT"),
+                   ("user_fields_sha1", "TEXT"),
+                   ("num_hits", "INTEGER"),
+                   ("error", "TEXT"),
+                   ("elapsed", "REAL"),
+                   ("date_created", "TEXT"),
+                  )
+    self.indexes = (("batch_jobs_batch", ("batch", "status")),)
+    BaseTable.__init__(self, con)
+
+
+  def finished(self, batch):
+    "The keys of the jobs of a batch that have completed"
+    cmd = "SELECT job_key FROM '%s' WHERE batch=? AND status='done'" % \
+      (self.name)
+    return set([ r[0] for r in self.con.execute(cmd, (batch,)) ])
@@ -0,0 +1,196 @@
+import bisect
+import contextlib
+import cProfile
+import json
+import pstats
+import re
+import StringIO
+import threading
+import time
+
+
+# bucket upper bounds in seconds; the last bucket holds everything slower
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+  "Counts of timings in fixed buckets, with their sizes and row counts"
+
+  def __init__(self):
+    self.counts = [0] * (len(BUCKETS) + 1)
+    self.count = 0
+    self.total = 0.0
+    self.min = None
+    self.max = None
+    self.bytes = 0
+    self.rows = 0
+
+
+  def add(self, seconds, size=None, rows=None):
+    self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+    self.count += 1
+    self.total += seconds
+    if(self.min is None or seconds < self.min): self.min = seconds
+    if(self.max is None or seconds > self.max): self.max = seconds
+    if(size): self.bytes += size
+    if(rows is not None and rows > 0): self.rows += rows
+
+
+  def percentile(self, fraction):
+    "The upper bound of the bucket holding the given fraction of timings"
+    if(not self.count):
+      return None
+    seen = 0
+    for (i, n) in enumerate(self.counts):
+      seen += n
+      if(seen >= fraction * self.count):
+        return BUCKETS[i] if i < len(BUCKETS) else self.max
+    return self.max
+
+
+  def as_dict(self):
+    return {
+      "count": self.count, "total": self.total, "min": self.min,
+      "max": self.max, "p50": self.percentile(0.5),
+      "p95": self.percentile(0.95), "bytes": self.bytes, "rows": self.rows,
+      "buckets": self.counts,
+    }
+
+
+class Stats(object):
+  """
+  Timing histograms for the client's hot paths, kept per (category, name):
+  rpc calls by method, http requests by handler, sql statements by their
+  text and ui rebuilds by method.  Safe to record from any thread.
+  """
+
+  def __init__(self):
+    self.enabled = True
+    self.started = time.time()
+    self.histograms = {}
+    self.last_profile = None
+    self._lock = threading.Lock()
+    # the profiles merged into last_profile
+    self._profilers = []
+
+
+  def record(self, category, name, seconds, size=None, rows=None):
+    if(not self.enabled):
+      return
+    with self._lock:
+      hist = self.histograms.get((category, name))
+      if(hist is None):
+        hist = self.histograms[(category, name)] = Histogram()
+      hist.add(seconds, size, rows)
+
+
+  def percentile(self, category, name, fraction, min_count=1):
+    "A percentile of the timings of (category, name), or None if too few"
+    with self._lock:
+      hist = self.histograms.get((category, name))
+      if(hist is None or hist.count < min_count):
+        return None
+      return hist.percentile(fraction)
+
+
+  def mean(self, category, name):
+    "The mean of the timings of (category, name), or None if there are none"
+    with self._lock:
+      hist = self.histograms.get((category, name))
+      if(hist is None or not hist.count):
+        return None
+      return hist.total / hist.count
+
+
+  @contextlib.contextmanager
+  def timer(self, category, name):
+    "Time the with block"
+    start = time.time()
+    try:
+      yield
+    finally:
+      self.record(category, name, time.time() - start)
+
+
+  def reset(self):
+    with self._lock:
+      self.histograms = {}
+      self.started = time.time()
+
+
+  def summary(self):
+    "A list of (category, name, stats dict), the slowest in total first"
+    with self._lock:
+      items = [ (c, n, h.as_dict())
+                for ((c, n), h) in self.histograms.iteritems() ]
+    return sorted(items, key=lambda i: -i[2]["total"])
+
+
+  def report(self, limit=30):
+    "The summary as a text table"
+    lines = [ "%-5s %-48s %7s %9s %9s %9s %11s %8s" % (
+      "cat", "name", "count", "total s", "p50 ms", "p95 ms", "bytes",
+      "rows") ]
+    ms = lambda s: "%.2f" % (s * 1000) if s is not None else "-"
+    for (category, name, s) in self.summary()[:limit]:
+      lines.append("%-5s %-48s %7d %9.3f %9s %9s %11d %8d" % (
+        category, name[:48], s["count"], s["total"], ms(s["p50"]),
+        ms(s["p95"]), s["bytes"], s["rows"]))
+    return "\n".join(lines)
+
+
+  def save(self, table):
+    "Append the current histograms to a StatsTable"
+    session = time.strftime("%Y-%m-%d %H:%M:%S",
+                            time.localtime(self.started))
+    table.store_many_rows([
+      (None, session, category, name, s["count"], s["total"], s["min"],
+       s["max"], s["bytes"], s["rows"], json.dumps(s["buckets"]),
+       time.strftime("%Y-%m-%d %H:%M:%S"))
+      for (category, name, s) in self.summary() ])
+
+
+  def start_profile(self):
+    "Start a new report; until then, profile() adds to the last one"
+    with self._lock:
+      self._profilers = []
+      self.last_profile = None
+
+
+  def profile(self, fn, *args, **kwargs):
+    """
+    Run fn under cProfile and keep the report in last_profile.  Only the
+    time spent on the calling thread is profiled, so work fn hands to
+    another thread is profiled there too, and the report merges every
+    profile() since start_profile().
+    """
+    profiler = cProfile.Profile()
+    try:
+      return profiler.runcall(fn, *args, **kwargs)
+    finally:
+      with self._lock:
+        self._profilers.append(profiler)
+        out = StringIO.StringIO()
+        stats = pstats.Stats(self._profilers[0], stream=out)
+        for other in self._profilers[1:]:
+          stats.add(other)
+        stats.sort_stats("cumulative").print_stats(30)
+        self.last_profile = out.getvalue()
+
+
+# the histograms shared by the whole client
+STATS = Stats()
+
+
+_sql_names = {}
+_placeholders = re.compile(r"\?(\s*,\s*\?)+")
+
+def sql_name(sql):
+  "A statement's text with its whitespace and runs of ? collapsed"
+  name = _sql_names.get(sql)
+  if(name is None):
+    name = _placeholders.sub("?...", " ".join(sql.split()))
+    if(len(_sql_names) < 1000):
+      _sql_names[sql] = name
+  return name
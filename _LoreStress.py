@@ -0,0 +1,159 @@
+"""
+A stress run of the local cache shared by several processes, each with
+several threads, as when two PyMOLs and their background workers use
+~/.pymol_lore.sqlite3 at once.
+
+Every worker defines targets, searches, stores pages of overlays and
+reads them back through its own Client, against a stand-in Lore in the
+same process.  Meanwhile the searchable subsets are swapped between two
+lists, and every read of them must be one list or the other.  The run
+fails if any operation fails, e.g. with "database is locked", or a read
+sees a torn list:
+
+  python -m LoreClient._LoreStress --processes 4 --threads 4 --seconds 10
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from _LoreCore import Client, SearchParams
+from _LoreServer import StandInLore
+
+
+# the two lists of searchable subsets the workers swap between
+_SUBSETS = (
+  tuple([ (i, "subset_%03d" % (i)) for i in range(1, 51) ]),
+  tuple([ (i, "subset_%03d_v2" % (i)) for i in range(26, 76) ]),
+)
+
+_PDBNAMES = [ "%dXYZ" % (i) for i in range(1, 21) ]
+
+
+def _work(client, rng, counts, errors):
+  "One random operation on the cache"
+  op = rng.choice(("define", "search", "page", "arrays", "subsets",
+                   "subsets_read"))
+  try:
+    if(op == "subsets"):
+      with client.lock() as data:
+        data.update_searchable(list(rng.choice(_SUBSETS)))
+    elif(op == "subsets_read"):
+      rows = tuple([ (r["id"], r["name"])
+                     for r in client.searchable_records() ])
+      if(rows and rows not in _SUBSETS):
+        raise AssertionError("A torn list of %d subsets" % (len(rows)))
+    else:
+      target = client.define_target(rng.choice(_PDBNAMES))
+      if(op != "define"):
+        params = SearchParams.decode(target.user_fields).replace(
+          rmslimit=rng.choice((0.5, 1.0, 1.5, 2.0)))
+        result = client.search(params)
+        if(op == "page" and result.ovly_keys):
+          start = rng.randrange(0, len(result.ovly_keys), 20)
+          keys = result.ovly_keys[start:start + 20]
+          overlays = client.get_overlays(keys)
+          with client.lock() as data:
+            data.overlays.store_page(result.user_fields_sha1, start, keys,
+                                     overlays)
+        elif(op == "arrays"):
+          client.result_arrays(result.user_fields_sha1)
+    counts[op] += 1
+  except Exception:
+    errors.append("%s: %s" % (op, traceback.format_exc().splitlines()[-1]))
+
+
+def _run_process(db, num_threads, seconds, seed, queue):
+  "Run num_threads workers on one Client and report their counts"
+  lore = StandInLore(num_hits=200)
+  # a target another process defined is taken from the cache, but this
+  # stand-in must still know its size to answer get_overlays alike
+  for pdbname in _PDBNAMES:
+    lore.define_target(pdbname)
+  client = Client(db=db, proxy_factory=lambda: lore)
+  # each thread counts for itself
+  counts = [ collections.Counter() for i in range(num_threads) ]
+  errors = [ [] for i in range(num_threads) ]
+  deadline = time.time() + seconds
+
+  def worker(i):
+    rng = random.Random(seed * 1000 + i)
+    while(time.time() < deadline):
+      _work(client, rng, counts[i], errors[i])
+
+  threads = [ threading.Thread(target=worker, args=(i,))
+              for i in range(num_threads) ]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  client.close()
+  queue.put((os.getpid(), dict(sum(counts, collections.Counter())),
+             sum(errors, [])))
+
+
+def run(num_processes=4, num_threads=4, seconds=10.0, db=None):
+  """
+  Run the stress workers on a cache file, a new one by default.
+
+  :returns: a dict of the operations done by kind, their rate and the
+            errors seen
+  """
+  tmp_dir = None
+  if(db is None):
+    tmp_dir = tempfile.mkdtemp()
+    db = os.path.join(tmp_dir, "stress.sqlite3")
+  queue = multiprocessing.Queue()
+  # started together on a new file, so they also race to create the tables
+  processes = [ multiprocessing.Process(
+    target=_run_process, args=(db, num_threads, seconds, i, queue))
+                for i in range(num_processes) ]
+  started = time.time()
+  try:
+    for p in processes:
+      p.start()
+    reports = [ queue.get() for p in processes ]
+    for p in processes:
+      p.join()
+  finally:
+    if(tmp_dir is not None):
+      shutil.rmtree(tmp_dir, ignore_errors=True)
+  elapsed = time.time() - started
+
+  (counts, errors) = (collections.Counter(), [])
+  for (pid, c, e) in reports:
+    counts.update(c)
+    errors += [ "pid %d %s" % (pid, error) for error in e ]
+  return {
+    "counts": dict(counts),
+    "ops_per_s": sum(counts.values()) / elapsed if elapsed else 0.0,
+    "errors": errors,
+  }
+
+
+def main(args=None):
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+  parser.add_argument("--processes", type=int, default=4)
+  parser.add_argument("--threads", type=int, default=4)
+  parser.add_argument("--seconds", type=float, default=10.0)
+  parser.add_argument("--db", help="the sqlite file; a new one by default")
+  opts = parser.parse_args(args)
+  report = run(opts.processes, opts.threads, opts.seconds, opts.db)
+  print "%d operations, %.0f/s: %s" % (
+    sum(report["counts"].values()), report["ops_per_s"],
+    ", ".join([ "%s %d" % i for i in sorted(report["counts"].items()) ]))
+  for error in report["errors"][:20]:
+    print "FAILED %s" % (error)
+  print "%d errors" % (len(report["errors"]))
+  return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,293 @@
+"""
+Loads the library structures of search hits into PyMOL.
+
+Structures are downloaded by a small pool of workers and kept in a
+directory next to ~/.pymol_lore.sqlite3, which is held under a size limit
+by removing the least recently used files.  The first time a structure is
+loaded, its PyMOL object is also saved as a session of that one object,
+and later loads read the session instead of parsing the text again.
+"""
+import os
+import threading
+import time
+import urllib2
+
+from _LoreAsync import RpcPool
+from _LoreStats import STATS
+
+
+DEFAULT_URL_TEMPLATE = "https://files.rcsb.org/download/%s.cif.gz"
+
+
+class StructureCache(object):
+  """
+  A size capped directory of structure files.  Each structure may have
+  its downloaded text and its PyMOL session; a file's mtime is when it was
+  last used.
+
+  :param dirname: the directory; ~/.pymol_lore_structures by default
+  :param max_bytes: the most the files may add up to
+  :param text_suffix: the suffix of the downloaded files
+  """
+  _dirname = ".pymol_lore_structures"
+  binary_suffix = ".pse"
+
+  def __init__(self, dirname=None, max_bytes=512*1024*1024,
+               text_suffix=".cif.gz"):
+    if(dirname is None):
+      dirname = os.path.join(os.path.expanduser('~'), self._dirname)
+    if(not os.path.isdir(dirname)):
+      os.makedirs(dirname)
+    self.dirname = dirname
+    self.max_bytes = max_bytes
+    self.text_suffix = text_suffix
+    self.hits = 0
+    self.misses = 0
+    self.bytes_saved = 0
+    self._lock = threading.Lock()
+
+
+  def path(self, pdbname, binary=False):
+    suffix = self.binary_suffix if binary else self.text_suffix
+    return os.path.join(self.dirname, "%s%s" % (pdbname, suffix))
+
+
+  def lookup(self, pdbname):
+    """
+    The best file kept for a structure, as (path, is_binary), or None.
+    Counts a hit or a miss, and marks the file as just used.
+    """
+    for binary in (True, False):
+      path = self.path(pdbname, binary)
+      try:
+        os.utime(path, None)
+      except OSError:
+        continue
+      # a hit saves downloading the text again
+      text = self.path(pdbname)
+      with self._lock:
+        self.hits += 1
+        if(os.path.exists(text)):
+          self.bytes_saved += os.path.getsize(text)
+      return (path, binary)
+    with self._lock:
+      self.misses += 1
+    return None
+
+
+  def put(self, pdbname, data, binary=False):
+    "Keep a file's contents; written whole or not at all"
+    path = self.path(pdbname, binary)
+    tmp = "%s.%d.%d.tmp" % (path, os.getpid(), threading.current_thread().ident)
+    with open(tmp, "wb") as f:
+      f.write(data)
+    os.rename(tmp, path)
+    self.evict()
+    return path
+
+
+  def adopt(self, pdbname, tmp_path, binary=True):
+    "Move a file written elsewhere, e.g. by PyMOL, into the cache"
+    path = self.path(pdbname, binary)
+    os.rename(tmp_path, path)
+    self.evict()
+    return path
+
+
+  def evict(self):
+    "Remove the least recently used files until under max_bytes"
+    with self._lock:
+      files = []
+      for name in os.listdir(self.dirname):
+        if(name.endswith(".tmp")):
+          continue
+        path = os.path.join(self.dirname, name)
+        try:
+          st = os.stat(path)
+        except OSError:
+          continue
+        files.append((st.st_mtime, st.st_size, path))
+      total = sum([ f[1] for f in files ])
+      for (mtime, size, path) in sorted(files):
+        if(total <= self.max_bytes):
+          break
+        try:
+          os.remove(path)
+        except OSError:
+          pass
+        total -= size
+      return total
+
+
+  def report(self):
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {
+        "hits": self.hits, "misses": self.misses,
+        "hit_rate": float(self.hits) / lookups if lookups else 0.0,
+        "bytes_saved": self.bytes_saved,
+      }
+
+
+def _download(url, timeout=60.0):
+  return urllib2.urlopen(url, timeout=timeout).read()
+
+
+class StructureLoader(object):
+  """
+  Loads structures into PyMOL, downloading the ones that are not cached
+  with at most num_workers downloads at once.  PyMOL is only touched on
+  the thread that calls load() and poll().
+
+  :param cache: a StructureCache; the default one if None
+  :param cmd: the pymol.cmd module; imported when first needed if None
+  :param num_workers: the number of download workers
+  :param url_template: the download address, with %s for the pdbname
+  :param fetch: fetch(pdbname) returning a structure's text; downloads from
+                url_template if None
+  """
+  _poll_s = 0.01
+
+  def __init__(self, cache=None, cmd=None, num_workers=4,
+               url_template=DEFAULT_URL_TEMPLATE, fetch=None):
+    if(cache is None):
+      suffix = url_template.rsplit("%s", 1)[-1]
+      cache = StructureCache(text_suffix=suffix)
+    self.cache = cache
+    self._cmd = cmd
+    self.num_workers = num_workers
+    self.url_template = url_template
+    self.fetch = fetch or (lambda pdbname: _download(url_template % pdbname))
+    self.bytes_downloaded = 0
+    self._pool = None
+    # pdbname -> object names waiting on its download
+    self._waiting = {}
+
+
+  @property
+  def cmd(self):
+    if(self._cmd is None):
+      from pymol import cmd
+      self._cmd = cmd
+    return self._cmd
+
+
+  @property
+  def pool(self):
+    if(self._pool is None):
+      # the workers call download() on this loader
+      self._pool = RpcPool(lambda: self, num_workers=self.num_workers,
+                           category="io")
+    return self._pool
+
+
+  @property
+  def pending(self):
+    return len(self._waiting)
+
+
+  def close(self):
+    if(self._pool is not None):
+      self._pool.shutdown()
+
+
+  def download(self, pdbname):
+    "Download a structure into the cache; run on a worker"
+    start = time.time()
+    data = self.fetch(pdbname)
+    self.cache.put(pdbname, data)
+    STATS.record("io", "download", time.time() - start, size=len(data))
+    return len(data)
+
+
+  def load(self, pdbnames, prefix="", on_loaded=None):
+    """
+    Load structures as PyMOL objects named prefix + pdbname.  Cached ones
+    are loaded at once, the others once poll() sees their download done.
+    Objects that already exist are left alone.
+
+    :param on_loaded: called with (pdbname, object name, error) for each
+    """
+    existing = set(self.cmd.get_names("objects"))
+    for pdbname in sorted(set(pdbnames)):
+      name = prefix + pdbname
+      if(name in existing):
+        continue
+      if(pdbname in self._waiting):
+        self._waiting[pdbname].append((name, on_loaded))
+        continue
+      entry = self.cache.lookup(pdbname)
+      if(entry is not None):
+        self._load(pdbname, name, entry, on_loaded)
+        continue
+      self._waiting[pdbname] = [ (name, on_loaded) ]
+      future = self.pool.submit("download", pdbname=pdbname)
+      future.add_done_callback(
+        lambda f, p=pdbname: self._on_download(p, f))
+
+
+  def poll(self):
+    "Load the structures whose downloads finished; see RpcPool.poll"
+    return self._pool.poll() if self._pool is not None else 0
+
+
+  def wait(self, timeout=None):
+    "Poll until every load has finished or timeout seconds have passed"
+    start = time.time()
+    while(self._waiting):
+      if(timeout is not None and time.time() - start > timeout):
+        break
+      if(not self.poll()):
+        time.sleep(self._poll_s)
+    return not self._waiting
+
+
+  def _on_download(self, pdbname, future):
+    error = future.exception()
+    if(error is None):
+      self.bytes_downloaded += future.result()
+    for (name, on_loaded) in self._waiting.pop(pdbname, []):
+      if(error is not None):
+        if(on_loaded is not None):
+          on_loaded(pdbname, name, error)
+        continue
+      self._load(pdbname, name, (self.cache.path(pdbname), False),
+                 on_loaded)
+
+
+  def _load(self, pdbname, name, entry, on_loaded):
+    (path, binary) = entry
+    # the session is saved under a hidden name, which any prefix replaces
+    hidden = "_lore_load_%s" % (pdbname)
+    error = None
+    try:
+      with STATS.timer("io", "load_binary" if binary else "load_text"):
+        if(binary):
+          self.cmd.load(path, partial=1)
+        else:
+          self.cmd.load(path, hidden)
+          self._save_binary(pdbname, hidden)
+        self.cmd.set_name(hidden, name)
+    except Exception as E:
+      error = E
+    if(on_loaded is not None):
+      on_loaded(pdbname, name, error)
+
+
+  def _save_binary(self, pdbname, hidden):
+    tmp = os.path.join(self.cache.dirname, "%s.pse.%d.tmp" % (
+      pdbname, os.getpid()))
+    try:
+      self.cmd.save(tmp, hidden, format="pse")
+      self.cache.adopt(pdbname, tmp)
+    except Exception:
+      # the text is still cached, so only the faster load is lost
+      if(os.path.exists(tmp)):
+        os.remove(tmp)
+
+
+  def report(self):
+    "The cache's hit rate and bytes saved, and the bytes downloaded"
+    report = self.cache.report()
+    report["bytes_downloaded"] = self.bytes_downloaded
+    return report
@@ -0,0 +1,157 @@
+"""
+Superimposes many hits on their target at once.
+
+Every hit's rotation, translation and RMSD comes out of one vectorized
+Kabsch pass over the matched-atom coordinates stored with the overlays,
+and each hit is then moved with a single transform_object call rather
+than aligned object by object.
+"""
+import re
+
+import numpy
+
+from _LoreFilter import residue_is_na
+
+
+# chain:resn resi as in residue_txt, e.g. A:GLY12 or B:DA-3
+_RESIDUE = re.compile(r"^([^:]*):(.*?)(-?\d+[A-Za-z]?)$")
+
+
+def superpose(mobile, target):
+  """
+  The least squares superposition of each set of mobile coordinates on
+  the target's, found for all of them in one pass.
+
+  :param mobile: coordinates shaped (hits, atoms, 3)
+  :param target: coordinates shaped (atoms, 3), or (hits, atoms, 3)
+  :returns: a tuple (rotations, translations, rmsd) shaped (hits, 3, 3),
+            (hits, 3) and (hits,); a hit's atoms x move to
+            numpy.dot(rotation, x) + translation
+  """
+  mobile = numpy.asarray(mobile, dtype=numpy.float64)
+  target = numpy.asarray(target, dtype=numpy.float64)
+  if(target.ndim == 2):
+    target = target[numpy.newaxis]
+  mob_center = mobile.mean(axis=1)
+  tgt_center = target.mean(axis=1)
+  p = mobile - mob_center[:, numpy.newaxis]
+  q = target - tgt_center[:, numpy.newaxis]
+
+  # the covariance of each hit with the target, and its svd
+  h = numpy.einsum("nai,naj->nij", p, q)
+  (u, s, vt) = numpy.linalg.svd(h)
+  # flip the smallest axis where the best fit would be a reflection
+  d = numpy.sign(numpy.linalg.det(numpy.einsum("nji,nkj->nik", vt, u)))
+  d[d == 0] = 1.0
+  vt[:, 2, :] *= d[:, numpy.newaxis]
+  s[:, 2] *= d
+  rotations = numpy.einsum("nji,nkj->nik", vt, u)
+  translations = tgt_center - numpy.einsum("nij,nj->ni", rotations,
+                                           mob_center)
+
+  # E = |p|^2 + |q|^2 - 2 * the sum of the (signed) singular values
+  n_atoms = mobile.shape[1]
+  e = (p ** 2).sum(axis=(1, 2)) + (q ** 2).sum(axis=(1, 2)) - 2 * s.sum(axis=1)
+  rmsd = numpy.sqrt(numpy.maximum(e, 0.0) / n_atoms)
+  return (rotations, translations, rmsd)
+
+
+def homogeneous(rotations, translations):
+  "4x4 matrices, flattened row by row, as transform_object takes them"
+  n = len(rotations)
+  matrices = numpy.zeros((n, 4, 4))
+  matrices[:, :3, :3] = rotations
+  matrices[:, :3, 3] = translations
+  matrices[:, 3, 3] = 1.0
+  return matrices.reshape((n, 16))
+
+
+def check_rmsd(rmsd, reported, tolerance=0.01):
+  """
+  Compare the RMSDs found here with the server's.
+
+  :param tolerance: the largest difference, in Angstroms, taken as equal
+  :returns: a dict with the largest difference and the positions of the
+            hits that differ by more than tolerance
+  """
+  diff = numpy.abs(numpy.asarray(rmsd) - numpy.asarray(reported))
+  return {
+    "max_error": float(diff.max()) if len(diff) else 0.0,
+    "mismatched": numpy.flatnonzero(diff > tolerance).tolist(),
+  }
+
+
+def parse_residue(residue):
+  "(chain, resn, resi) from a residue name such as A:GLY12"
+  match = _RESIDUE.match(residue.strip())
+  if(match is None):
+    raise ValueError("Cannot read the residue %r" % (residue))
+  return match.groups()
+
+
+def residue_selection(residues):
+  "A PyMOL selection of residues named as in residue_txt"
+  terms = []
+  for residue in residues:
+    (chain, resn, resi) = parse_residue(residue)
+    terms.append("(chain %s and resi %s)" % (
+      chain or '""', resi.replace("-", "\\-")))
+  return "(%s)" % (" or ".join(terms) or "none")
+
+
+def target_atoms(user_fields):
+  """
+  The (residue, atom name) pairs whose coordinates each hit's stored
+  coords hold, in the same order: each residue's superposition atoms,
+  the nucleic acid ones for nucleic acid residues.
+  """
+  residues = user_fields["residues"].split("|")
+  is_na = residue_is_na(user_fields)
+  aa_atoms = user_fields["superposition_atoms"].split("|")
+  na_atoms = user_fields["na_superposition_atoms"].split("|")
+  pairs = []
+  for (i, residue) in enumerate(residues):
+    names = na_atoms if (is_na is not None and is_na[i]) else aa_atoms
+    pairs += [ (residue, name) for name in names ]
+  return pairs
+
+
+def target_coords(cmd, selection, user_fields, state=1):
+  """
+  The coordinates of the target's superposition atoms in PyMOL, shaped
+  (atoms, 3) in the order of target_atoms.
+  """
+  pairs = target_atoms(user_fields)
+  wanted = set([ name for (residue, name) in pairs ])
+  model = cmd.get_model("(%s) and %s and name %s" % (
+    selection, residue_selection(set([ r for (r, n) in pairs ])),
+    "+".join(wanted)), state)
+  found = {}
+  for atom in model.atom:
+    found.setdefault((atom.chain, atom.resi, atom.name), atom.coord)
+  coords = []
+  for (residue, name) in pairs:
+    (chain, resn, resi) = parse_residue(residue)
+    if((chain, resi, name) not in found):
+      raise ValueError("The target has no atom %s in %s" % (name, residue))
+    coords.append(found[(chain, resi, name)])
+  return numpy.array(coords)
+
+
+def overlay(cmd, objects, coords, target_xyz, reported=None, tolerance=0.01):
+  """
+  Move each hit's object onto the target.
+
+  :param objects: the PyMOL object of each hit
+  :param coords: the hits' stored matched-atom coordinates, shaped
+                 (hits, atoms, 3) and in the order of target_atoms
+  :param reported: the server's RMSD of each hit, checked if given
+  :returns: a dict of the RMSDs found, and the check if one was made
+  """
+  (rotations, translations, rmsd) = superpose(coords, target_xyz)
+  for (name, matrix) in zip(objects, homogeneous(rotations, translations)):
+    cmd.transform_object(name, matrix.tolist(), homogenous=1)
+  result = {"rmsd": rmsd}
+  if(reported is not None):
+    result.update(check_rmsd(rmsd, reported, tolerance))
+  return result
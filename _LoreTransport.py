@@ -0,0 +1,219 @@
+import collections
+import httplib
+import socket
+import threading
+import time
+import urllib
+import xmlrpclib
+import zlib
+
+import jsonrpclib
+
+from _LoreDeadline import current_deadline
+from _LoreStats import STATS
+
+
+def _gzip(data, level=6):
+  compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+  return compressor.compress(data) + compressor.flush()
+
+
+def _decode_body(data, encoding):
+  if(encoding == "gzip"):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+  elif(encoding == "deflate"):
+    # servers disagree on whether deflate means zlib-wrapped or raw deflate
+    try:
+      return zlib.decompress(data)
+    except zlib.error:
+      return zlib.decompress(data, -zlib.MAX_WBITS)
+  return data
+
+
+class PooledTransport(object):
+  """
+  A jsonrpclib transport that keeps HTTP/1.1 keep-alive connections in a
+  pool shared by every thread, and accepts gzip or deflate encoded responses.
+
+  A connection is checked out for the length of one call, so calls made from
+  several threads at once each get their own connection and idle ones are
+  reused by whichever thread needs one next.  Each call is recorded in
+  self.calls with whether its connection was reused, the bytes sent and
+  received on the wire, the time to first byte and the total elapsed time.
+
+  A call made under a Deadline (see _LoreDeadline) waits on its socket no
+  longer than the deadline allows, and cancelling the deadline closes the
+  socket, so the waiting thread gets RpcTimeout or RpcCancelled.
+
+  :param secure: use https connections
+  :param timeout: the socket timeout in seconds, None for no timeout
+  :param max_idle: the number of idle connections kept per host
+  :param compress_threshold: gzip request bodies at least this many bytes
+                             long; None never compresses requests, since not
+                             every server accepts a compressed request
+  :param history_size: the number of calls to keep in self.calls
+  """
+  user_agent = "LoreClient"
+
+  def __init__(self, secure=False, timeout=None, max_idle=4,
+               compress_threshold=None, history_size=1000):
+    self.secure = secure
+    self.timeout = timeout
+    self.max_idle = max_idle
+    self.compress_threshold = compress_threshold
+    self.calls = collections.deque(maxlen=history_size)
+    self._idle = {}
+    self._lock = threading.Lock()
+
+
+  def request(self, host, handler, request_body, verbose=0):
+    """
+    Post one request and return the decoded response body.  A reused
+    connection may have been closed by the server while it sat idle, so a
+    failure on one is retried once on a fresh connection.  A timeout is
+    not retried.
+    """
+    deadline = current_deadline()
+    (conn, reused) = self._checkout(host)
+    try:
+      return self._single_request(conn, reused, host, handler, request_body,
+                                  deadline)
+    except Exception as E:
+      conn.close()
+      # whatever a closed or timed out socket raised, report why it stopped
+      if(deadline is not None and (deadline.cancelled or deadline.expired())):
+        raise deadline.error()
+      retry = (httplib.BadStatusLine, httplib.CannotSendRequest, socket.error)
+      if(not reused or not isinstance(E, retry) or
+         isinstance(E, socket.timeout)):
+        raise
+    (conn, reused) = self._checkout(host, fresh=True)
+    return self._single_request(conn, reused, host, handler, request_body,
+                                deadline)
+
+
+  def close(self):
+    "Close every idle connection"
+    with self._lock:
+      (idle, self._idle) = (self._idle, {})
+    for conns in idle.values():
+      for conn in conns:
+        conn.close()
+
+
+  @property
+  def stats(self):
+    calls = list(self.calls)
+    if(not calls):
+      return { "calls": 0 }
+    return {
+      "calls": len(calls),
+      "reuse_rate": sum([ c["reused"] for c in calls ]) / float(len(calls)),
+      "bytes_sent": sum([ c["bytes_sent"] for c in calls ]),
+      "bytes_received": sum([ c["bytes_received"] for c in calls ]),
+      "bytes_decoded": sum([ c["bytes_decoded"] for c in calls ]),
+      "mean_ttfb": sum([ c["ttfb"] for c in calls ]) / len(calls),
+      "mean_elapsed": sum([ c["elapsed"] for c in calls ]) / len(calls),
+    }
+
+
+  def _checkout(self, host, fresh=False):
+    if(not fresh):
+      with self._lock:
+        conns = self._idle.get(host)
+        if(conns):
+          return (conns.pop(), True)
+    if(self.secure):
+      conn = httplib.HTTPSConnection(host, timeout=self.timeout)
+    else:
+      conn = httplib.HTTPConnection(host, timeout=self.timeout)
+    return (conn, False)
+
+
+  def _checkin(self, host, conn):
+    with self._lock:
+      conns = self._idle.setdefault(host, [])
+      if(len(conns) < self.max_idle):
+        conns.append(conn)
+        return
+    conn.close()
+
+
+  def _set_timeout(self, conn, deadline):
+    "Bound the socket waits of the next step by what the deadline leaves"
+    timeout = self.timeout
+    if(deadline is not None):
+      deadline.check()
+      remaining = deadline.remaining()
+      if(remaining is not None):
+        # a zero timeout would make the socket non-blocking
+        remaining = max(remaining, 0.001)
+        timeout = remaining if timeout is None else min(timeout, remaining)
+    conn.timeout = timeout
+    if(conn.sock is not None):
+      conn.sock.settimeout(timeout)
+
+
+  def _single_request(self, conn, reused, host, handler, request_body,
+                      deadline=None):
+    headers = {
+      "Content-Type": "application/json-rpc",
+      "Accept-Encoding": "gzip, deflate",
+      "User-Agent": self.user_agent,
+    }
+    body = request_body
+    if(self.compress_threshold is not None and
+       len(body) >= self.compress_threshold):
+      body = _gzip(body)
+      headers["Content-Encoding"] = "gzip"
+
+    start = time.time()
+    if(deadline is not None):
+      deadline.attach(conn)
+    try:
+      self._set_timeout(conn, deadline)
+      conn.request("POST", handler or "/", body, headers)
+      response = conn.getresponse()
+      ttfb = time.time() - start
+      self._set_timeout(conn, deadline)
+      data = response.read()
+    finally:
+      if(deadline is not None):
+        deadline.detach(conn)
+    elapsed = time.time() - start
+    if(deadline is not None):
+      # an idle connection waits as long as any other
+      conn.timeout = self.timeout
+      if(conn.sock is not None):
+        conn.sock.settimeout(self.timeout)
+
+    if(response.status != 200):
+      conn.close()
+      raise xmlrpclib.ProtocolError(
+        host + handler, response.status, response.reason, response.msg)
+
+    encoding = (response.getheader("content-encoding") or "").lower()
+    decoded = _decode_body(data, encoding)
+    if(response.will_close):
+      conn.close()
+    else:
+      self._checkin(host, conn)
+
+    self.calls.append({
+      "reused": reused, "bytes_sent": len(body), "bytes_received": len(data),
+      "bytes_decoded": len(decoded), "ttfb": ttfb, "elapsed": elapsed,
+      "encoding": encoding,
+    })
+    STATS.record("http", handler or "/", elapsed, size=len(body) + len(data))
+    return decoded
+
+
+def server_proxy(url, transport=None, **kwargs):
+  """
+  Make a jsonrpclib.Server proxy for url that talks through a
+  PooledTransport.  Pass the same transport to share its connection pool.
+  """
+  if(transport is None):
+    secure = (urllib.splittype(url)[0] == "https")
+    transport = PooledTransport(secure=secure, **kwargs)
+  return jsonrpclib.Server(url, transport=transport)
@@ -1 +1,25 @@
 from _LoreSqlite import FixedFieldsTable, UserFieldsTable, Searchable
+from _LoreSqlite import TargetCacheTable, MetaTable, OverlaysTable
+from _LoreSqlite import ResultStoreError, SCHEMA_VERSION, set_schema_version
+from _LoreSqlite import LoreConnection, connect
+from _LoreSqlite import ResultSetsTable, pack_floats, unpack_floats
+from _LoreSqlite import StatsTable, BatchJobsTable
+from _LoreAsync import RpcFuture, RpcPool
+from _LoreCache import TargetCache, user_fields_key
+from _LoreCache import canonical_user_fields
+from _LoreRpc import BatchCall, RpcBatch, RpcBatcher
+from _LoreTransport import PooledTransport, server_proxy
+from _LoreResults import ResultPager
+from _LoreFilter import is_tightening, refilter, residue_is_na
+from _LoreSelection import SelectionConverter, split_segments
+from _LoreServer import StandInLore, StandInServer
+from _LoreStats import STATS, Stats, Histogram
+from _LoreData import Data, DataPool
+from _LoreCore import Client, SearchParams, SearchResult, Target
+from _LoreCore import CallPolicy, CALL_POLICIES
+from _LoreBatch import BatchRunner, load_jobs, run_batch, search_params
+from _LoreStructures import StructureCache, StructureLoader
+from _LoreSuperpose import superpose, check_rmsd
+from _LoreExport import export, format_report
+from _LoreDeadline import Deadline, RpcCancelled, RpcTimeout
+from _LoreDeadline import current_deadline, deadline_scope